@@ -0,0 +1,69 @@
+#
+# The analyses a job can run. Like datatier.py, this file is
+# deployed alongside the lambda functions that need it.
+#
+# A job's jobtype is one analysis ("ner"), or several separated
+# by commas ("benford,ner,pii"): compute then downloads and
+# parses the PDF once, runs each analysis over the same page
+# texts, and writes one results document with a section per
+# analysis. Jobtypes are stored in the order of ANALYSES, so
+# "pii,benford" and "benford,pii" are the same job type.
+#
+
+ANALYSES = ["benford", "sentiment", "ner", "pii"]
+
+#
+# the analyses that call AWS Comprehend, which compute runs
+# concurrently:
+#
+COMPREHEND_ANALYSES = ["sentiment", "ner", "pii"]
+
+#
+# each analysis's heading in the results document:
+#
+TITLES = {
+  "benford": "Benford Analysis",
+  "sentiment": "Sentiment Analysis",
+  "ner": "Name Entity Recognition",
+  "pii": "Personally Identifiable Entities",
+}
+
+
+def parse_jobtype(jobtype):
+  """
+  "pii, benford" => ["benford", "pii"]. Raises an exception for
+  an unknown or missing analysis.
+  """
+  names = [name.strip().lower() for name in str(jobtype).split(",")]
+  names = [name for name in names if name != ""]
+
+  if len(names) == 0:
+    raise Exception("jobtype names no analyses")
+
+  for name in names:
+    if name not in ANALYSES:
+      raise Exception("unknown analysis '" + name + "', expecting " + ", ".join(ANALYSES))
+
+  return [name for name in ANALYSES if name in names]
+
+
+def format_jobtype(names):
+  """
+  ["benford", "pii"] => "benford,pii"
+  """
+  return ",".join(names)
+
+
+def jobtypes_including(names):
+  """
+  Every jobtype, as stored, that runs all of the given analyses:
+  ["pii"] => ["pii", "ner,pii", ..., "benford,sentiment,ner,pii"].
+  """
+  others = [name for name in ANALYSES if name not in names]
+
+  jobtypes = []
+  for mask in range(2 ** len(others)):
+    extra = [others[i] for i in range(len(others)) if mask & (1 << i)]
+    jobtypes.append(format_jobtype([name for name in ANALYSES if name in names or name in extra]))
+
+  return jobtypes
@@ -0,0 +1,326 @@
+#
+# Client-side transport for the benford app web service.
+#
+# Every call goes through one ApiClient, which keeps a pool of
+# keep-alive connections (so commands reuse TLS connections
+# instead of opening a new one per request), applies per-request
+# timeouts, retries with exponential backoff on 429/5xx, attaches
+# the session token, and records the latency of each call.
+#
+# For concurrency there is an asyncio API: arequest() runs a
+# request on a worker thread over the same connection pool, and
+# at most max_in_flight requests are outstanding at once, e.g.
+#
+#   results = asyncio.run(client.gather([
+#     client.arequest("GET", "/results/1001"),
+#     client.arequest("GET", "/results/1002")]))
+#
+# requests and asyncio are imported when first needed, so the
+# command-line client starts quickly for commands that make no
+# calls.
+#
+# apiclient_test.py checks the retries, re-login and async limit
+# against a fake web service (python apiclient_test.py).
+#
+
+import random
+import threading
+import time
+
+import authtoken
+
+#
+# status codes worth retrying: throttled, or the gateway /
+# lambda failed in a way that may succeed on a second try:
+#
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+#
+# for POST (not idempotent), only retry when we know the
+# request was not processed: these status codes, or a
+# connection that failed before the request was sent (see
+# never_sent):
+#
+RETRY_STATUS_UNSAFE = [429, 503]
+
+SAFE_METHODS = ["GET", "DELETE", "HEAD"]
+
+
+def never_sent(err):
+  """
+  True if a requests exception means the request never reached
+  the server: the connection could not be made (refused, DNS,
+  connect timeout). A read timeout or a connection dropped
+  mid-request may have been processed.
+  """
+  import requests
+  import urllib3.exceptions
+
+  if isinstance(err, requests.ConnectTimeout):
+    return True
+  if isinstance(err, requests.ReadTimeout):
+    return False
+
+  reason = err.args[0] if len(err.args) > 0 else None
+  reason = getattr(reason, "reason", reason)  # urllib3's MaxRetryError wraps the cause
+  return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+#
+# log in again when the token has less than this long to live:
+#
+TOKEN_REFRESH_SECS = 60
+
+
+class ApiClient:
+
+  def __init__(self, baseurl, timeout=(3.05, 30.0), retries=4, backoff=0.25,
+               max_backoff=8.0, max_in_flight=16):
+    """
+    Parameters
+    ----------
+    baseurl: baseurl for web service, without a trailing /
+    timeout: default (connect, read) timeout in seconds
+    retries: how many times to retry a failed request
+    backoff: first retry delay in seconds, doubled each retry
+    max_backoff: longest delay between retries
+    max_in_flight: connection pool size, and the most async
+      requests outstanding at once
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    self.baseurl = baseurl
+    self.timeout = timeout
+    self.retries = retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.max_in_flight = max_in_flight
+
+    #
+    # one session, one pool of keep-alive connections per host:
+    #
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_in_flight, max_retries=0)
+    self.session.mount("https://", adapter)
+    self.session.mount("http://", adapter)
+
+    self.username = None
+    self.password = None
+    self.token = None
+    self.expiry = 0
+
+    self.latencies = {}
+    self.lock = threading.Lock()
+    self.auth_lock = threading.Lock()
+    self.semaphore = None
+    self.semaphore_loop = None
+
+  ##########################################################
+  #
+  # authentication
+  #
+  def login(self, username, password):
+    """
+    Logs in with the web service and stores the session token,
+    which is then attached to every request.
+
+    Returns the response from /login.
+    """
+    res = self.request("POST", "/login", json={"username": username, "password": password},
+                       authenticate=False)
+
+    if res.status_code == 200:
+      self.token = res.json()["token"]
+      (userid, self.expiry) = authtoken.parse(self.token)
+
+    return res
+
+  def auth_headers(self):
+    """
+    Returns the Authorization header for a request, logging in
+    again with the stored credentials if the token is missing
+    or about to expire.
+    """
+    with self.auth_lock:
+      if self.token is None or self.expiry - TOKEN_REFRESH_SECS < time.time():
+        self.token = None
+        if self.username is not None and self.password is not None:
+          self.login(self.username, self.password)
+
+      if self.token is None:
+        return {}
+
+      return {"Authorization": "Bearer " + self.token}
+
+  ##########################################################
+  #
+  # requests
+  #
+  def request(self, method, api, params=None, json=None, data=None, headers=None,
+              timeout=None, stream=False, authenticate=True):
+    """
+    Calls the web service, retrying with exponential backoff
+    (and jitter) on connection errors and retryable status
+    codes; for a POST, only on 429/503 or if the request was
+    never sent. A Retry-After header from the server is honored.
+
+    Parameters
+    ----------
+    method: GET, POST, DELETE, ...
+    api: path under the baseurl, e.g. "/results/1001"
+    params, json, data, headers, stream: as for requests
+    timeout: (connect, read) timeout for this request, defaults
+      to the client's timeout
+    authenticate: attach the session token
+
+    Returns
+    -------
+    the response object, from the last attempt
+    """
+    import requests
+
+    url = self.baseurl + api
+
+    if timeout is None:
+      timeout = self.timeout
+
+    safe = method in SAFE_METHODS
+    retry_status = RETRY_STATUS if safe else RETRY_STATUS_UNSAFE
+
+    attempt = 0
+    relogged = False
+
+    while True:
+      all_headers = {}
+      if authenticate:
+        all_headers.update(self.auth_headers())
+      if headers is not None:
+        all_headers.update(headers)
+
+      start = time.perf_counter()
+
+      try:
+        res = self.session.request(method, url, params=params, json=json, data=data,
+                                   headers=all_headers, timeout=timeout, stream=stream)
+        error = None
+      except (requests.ConnectionError, requests.Timeout) as err:
+        res = None
+        error = err
+
+      self.record(method, api, time.perf_counter() - start)
+
+      #
+      # an expired or revoked token: log in again, once:
+      #
+      if res is not None and res.status_code == 401 and authenticate and not relogged \
+         and self.username is not None:
+        res.close()  # hand the connection back to the pool
+        self.token = None
+        relogged = True
+        continue
+
+      #
+      # a POST whose response timed out may have created a job,
+      # so errors are only retried if the request was never sent:
+      #
+      if error is not None:
+        retryable = safe or never_sent(error)
+      else:
+        retryable = res.status_code in retry_status
+
+      if not retryable or attempt >= self.retries:
+        if error is not None:
+          raise error
+        return res
+
+      #
+      # full jitter: sleep a random time up to the backoff:
+      #
+      delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+      delay = random.uniform(0, delay)
+
+      if res is not None and "Retry-After" in res.headers:
+        try:
+          delay = max(delay, float(res.headers["Retry-After"]))
+        except ValueError:
+          pass
+
+      if res is not None:
+        res.close()  # hand the connection back to the pool
+
+      time.sleep(delay)
+      attempt += 1
+
+  async def arequest(self, method, api, **kwargs):
+    """
+    asyncio version of request(): runs it on a worker thread
+    over the shared connection pool, with at most max_in_flight
+    requests outstanding.
+    """
+    import asyncio
+
+    #
+    # a semaphore belongs to one event loop, so make a new one
+    # for each asyncio.run():
+    #
+    loop = asyncio.get_running_loop()
+    if self.semaphore_loop is not loop:
+      self.semaphore = asyncio.Semaphore(self.max_in_flight)
+      self.semaphore_loop = loop
+
+    async with self.semaphore:
+      return await asyncio.to_thread(self.request, method, api, **kwargs)
+
+  async def gather(self, coroutines):
+    """
+    Runs the given arequest() calls concurrently, and returns
+    their responses in order.
+    """
+    import asyncio
+
+    return await asyncio.gather(*coroutines)
+
+  def close(self):
+    self.session.close()
+
+  ##########################################################
+  #
+  # latency
+  #
+  def record(self, method, api, secs):
+    """
+    Records one request's latency under "METHOD /first-part",
+    so e.g. all /results/<jobid> calls are grouped together.
+    """
+    parts = api.split("/")
+    name = method + " /" + (parts[1] if len(parts) > 1 else "")
+
+    with self.lock:
+      self.latencies.setdefault(name, []).append(secs)
+
+  def latency_report(self):
+    """
+    Returns a list of (name, count, p50, p95, max) in seconds,
+    one per kind of request made.
+    """
+    report = []
+
+    with self.lock:
+      for name in sorted(self.latencies):
+        samples = sorted(self.latencies[name])
+        n = len(samples)
+        p50 = samples[min(n - 1, int(0.50 * n))]
+        p95 = samples[min(n - 1, int(0.95 * n))]
+        report.append((name, n, p50, p95, samples[-1]))
+
+    return report
+
+  def print_latency_report(self):
+    report = self.latency_report()
+
+    if len(report) == 0:
+      return
+
+    print("%-16s %6s %10s %10s %10s" % ("request", "count", "p50 ms", "p95 ms", "max ms"))
+    for (name, n, p50, p95, worst) in report:
+      print("%-16s %6d %10.1f %10.1f %10.1f" % (name, n, p50 * 1000.0, p95 * 1000.0, worst * 1000.0))
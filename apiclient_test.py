@@ -0,0 +1,367 @@
+#
+# Checks apiclient.ApiClient's retries, backoff, re-login and
+# async limit against a fake web service: FakeAdapter is mounted
+# on the client's requests session in place of the HTTP
+# connection pool, so everything above the socket (requests,
+# urllib3's response objects, ApiClient) is the real code.
+#
+# Runs under pytest, or on its own, exiting 1 on a failure:
+#
+#   python apiclient_test.py
+#
+# batch_test.py uses the same fake for batch mode.
+#
+
+import asyncio
+import io
+import json
+import socket
+import sys
+import threading
+import time
+
+import requests
+import urllib3
+
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+import apiclient
+import authtoken
+
+BASEURL = "http://benfordapp.test"
+SECRET = "apiclient-test-secret"
+
+
+class FakeAdapter(BaseAdapter):
+  """
+  A requests transport adapter that answers every request with
+  handler(request, path), which returns a response (see
+  respond) or raises as a connection failure would. Records
+  (method, path, headers) of every request it's sent.
+  """
+
+  def __init__(self, handler):
+    super().__init__()
+    self.handler = handler
+    self.sent = []
+    self.lock = threading.Lock()
+
+  def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+    path = request.path_url.split("?")[0]
+    with self.lock:
+      self.sent.append((request.method, path, dict(request.headers)))
+    return self.handler(request, path)
+
+  def close(self):
+    pass
+
+  def count(self, method, path):
+    with self.lock:
+      return sum(1 for (m, p, h) in self.sent if m == method and p == path)
+
+
+class FakeRawResponse(urllib3.HTTPResponse):
+  """
+  urllib3's response, noting whether its connection was handed
+  back to the pool.
+  """
+
+  def release_conn(self):
+    self.released = True
+    super().release_conn()
+
+
+def respond(request, status, body=b"", headers=None):
+  """
+  A response as requests' HTTPAdapter builds one, over a urllib3
+  response whose body is read lazily, so stream=True works.
+  """
+  if not isinstance(body, bytes):
+    body = json.dumps(body).encode()
+    headers = dict(headers or {}, **{"Content-Type": "application/json"})
+
+  raw = FakeRawResponse(body=io.BytesIO(body), headers=headers or {}, status=status,
+                        preload_content=False, decode_content=False)
+  raw.released = False
+
+  res = requests.Response()
+  res.status_code = status
+  res.headers = CaseInsensitiveDict(headers or {})
+  res.raw = raw
+  res.url = request.url
+  res.request = request
+  res.encoding = "utf-8"
+  return res
+
+
+def new_client(handler, **kwargs):
+  """
+  An ApiClient talking to handler, with no delay between retries.
+  """
+  kwargs.setdefault("backoff", 0.0)
+  client = apiclient.ApiClient(BASEURL, **kwargs)
+  adapter = FakeAdapter(handler)
+  client.session.mount(BASEURL, adapter)
+  return (client, adapter)
+
+
+def scripted(*outcomes):
+  """
+  A handler giving each outcome in turn, then 200s: a status
+  code, or an exception class to raise.
+  """
+  outcomes = list(outcomes)
+  lock = threading.Lock()
+
+  def handler(request, path):
+    with lock:
+      outcome = outcomes.pop(0) if len(outcomes) > 0 else 200
+    if isinstance(outcome, type):
+      raise outcome("scripted " + outcome.__name__)
+    return respond(request, outcome, {"ok": outcome == 200})
+
+  return handler
+
+
+def refused_error():
+  """
+  The exception requests raises when nothing listens on a port:
+  a ConnectionError wrapping urllib3's NewConnectionError.
+  """
+  sock = socket.socket()
+  sock.bind(("127.0.0.1", 0))
+  port = sock.getsockname()[1]
+  sock.close()
+
+  try:
+    requests.get("http://127.0.0.1:" + str(port) + "/", timeout=2)
+  except requests.ConnectionError as err:
+    return err
+
+  raise AssertionError("connected to a closed port")
+
+
+############################################################
+#
+# retries
+#
+def test_get_retries_5xx_until_success():
+  (client, adapter) = new_client(scripted(503, 500, 502))
+
+  res = client.request("GET", "/results/1001")
+
+  assert res.status_code == 200
+  assert adapter.count("GET", "/results/1001") == 4
+
+
+def test_gives_up_after_retries():
+  (client, adapter) = new_client(scripted(*([503] * 10)), retries=2)
+
+  res = client.request("GET", "/jobs")
+
+  assert res.status_code == 503
+  assert adapter.count("GET", "/jobs") == 3
+
+
+def test_no_retry_on_4xx():
+  (client, adapter) = new_client(scripted(400))
+
+  assert client.request("GET", "/results/1001").status_code == 400
+  assert adapter.count("GET", "/results/1001") == 1
+
+
+def test_retry_after_is_honored():
+  calls = []
+
+  def handler(request, path):
+    calls.append(time.perf_counter())
+    if len(calls) == 1:
+      return respond(request, 429, {"throttled": True}, {"Retry-After": "0.3"})
+    return respond(request, 200, {})
+
+  (client, adapter) = new_client(handler)
+
+  assert client.request("GET", "/jobs").status_code == 200
+  assert calls[1] - calls[0] >= 0.3
+
+
+def test_get_retries_read_timeout():
+  (client, adapter) = new_client(scripted(requests.ReadTimeout))
+
+  assert client.request("GET", "/results/1001").status_code == 200
+  assert adapter.count("GET", "/results/1001") == 2
+
+
+############################################################
+#
+# a POST is never resent once it may have reached the server
+#
+def test_post_not_resent_after_read_timeout():
+  (client, adapter) = new_client(scripted(requests.ReadTimeout))
+
+  try:
+    client.request("POST", "/pdf/80001/benford", data=b"%PDF")
+    raise AssertionError("expected the ReadTimeout")
+  except requests.ReadTimeout:
+    pass
+
+  assert adapter.count("POST", "/pdf/80001/benford") == 1
+
+
+def test_post_not_resent_after_dropped_connection():
+  (client, adapter) = new_client(scripted(requests.ConnectionError))
+
+  try:
+    client.request("POST", "/pdf/80001/benford", data=b"%PDF")
+    raise AssertionError("expected the ConnectionError")
+  except requests.ConnectionError:
+    pass
+
+  assert adapter.count("POST", "/pdf/80001/benford") == 1
+
+
+def test_post_not_resent_after_500():
+  (client, adapter) = new_client(scripted(500))
+
+  assert client.request("POST", "/pdf/80001/benford", data=b"%PDF").status_code == 500
+  assert adapter.count("POST", "/pdf/80001/benford") == 1
+
+
+def test_post_resent_after_503_and_connect_timeout():
+  (client, adapter) = new_client(scripted(503, requests.ConnectTimeout))
+
+  assert client.request("POST", "/pdf/80001/benford", data=b"%PDF").status_code == 200
+  assert adapter.count("POST", "/pdf/80001/benford") == 3
+
+
+def test_post_resent_after_refused_connection():
+  err = refused_error()
+  assert apiclient.never_sent(err)
+
+  outcomes = [err]
+
+  def handler(request, path):
+    if len(outcomes) > 0:
+      raise outcomes.pop()
+    return respond(request, 200, "1001")
+
+  (client, adapter) = new_client(handler)
+
+  assert client.request("POST", "/pdf/80001/benford", data=b"%PDF").json() == "1001"
+  assert adapter.count("POST", "/pdf/80001/benford") == 2
+
+
+############################################################
+#
+# session tokens
+#
+def test_relogin_once_on_401():
+  issued = []
+  rejected = []
+
+  def handler(request, path):
+    if path == "/login":
+      (token, expiry) = authtoken.issue(80001, SECRET)
+      issued.append(token)
+      return respond(request, 200, {"token": token, "userid": 80001})
+
+    #
+    # the first token has been revoked:
+    #
+    if request.headers.get("Authorization") == "Bearer " + issued[0]:
+      res = respond(request, 401, "token has been revoked")
+      rejected.append(res)
+      return res
+    return respond(request, 200, {"rows": [], "next": None})
+
+  (client, adapter) = new_client(handler)
+  client.username = "p_sarkar"
+  client.password = "secret"
+
+  assert client.login("p_sarkar", "secret").status_code == 200
+  time.sleep(1.1)  # so the second token differs
+
+  #
+  # streamed, as /results downloads are, so only closing the 401
+  # hands its connection back:
+  #
+  res = client.request("GET", "/jobs", stream=True)
+
+  assert res.status_code == 200
+  assert len(issued) == 2
+  assert adapter.count("GET", "/jobs") == 2
+  assert adapter.sent[-1][2]["Authorization"] == "Bearer " + issued[1]
+  assert rejected[0].raw.released, "the 401 response's connection was not released"
+
+
+def test_relogin_gives_up_on_second_401():
+  def handler(request, path):
+    if path == "/login":
+      return respond(request, 200, {"token": authtoken.issue(80001, SECRET)[0]})
+    return respond(request, 401, "no")
+
+  (client, adapter) = new_client(handler)
+  client.username = "p_sarkar"
+  client.password = "secret"
+
+  assert client.request("GET", "/jobs").status_code == 401
+  assert adapter.count("GET", "/jobs") == 2
+  assert adapter.count("POST", "/login") == 2
+
+
+############################################################
+#
+# asyncio
+#
+def test_arequest_limits_requests_in_flight():
+  lock = threading.Lock()
+  state = {"now": 0, "most": 0}
+
+  def handler(request, path):
+    with lock:
+      state["now"] += 1
+      state["most"] = max(state["most"], state["now"])
+    time.sleep(0.05)
+    with lock:
+      state["now"] -= 1
+    return respond(request, 200, path)
+
+  (client, adapter) = new_client(handler, max_in_flight=3)
+
+  async def run():
+    return await client.gather([client.arequest("GET", "/results/" + str(1001 + i))
+                                for i in range(12)])
+
+  responses = asyncio.run(run())
+
+  assert [res.json() for res in responses] == ["/results/" + str(1001 + i) for i in range(12)]
+  assert state["most"] == 3
+
+  #
+  # and again under a new event loop:
+  #
+  assert len(asyncio.run(run())) == 12
+
+
+def run_all(module):
+  """
+  Runs the module's test_ functions. Returns the number failed.
+  """
+  failed = 0
+  for (name, test) in sorted(vars(module).items()):
+    if not name.startswith("test_") or not callable(test):
+      continue
+    try:
+      test()
+      print("passed", name)
+    except Exception as err:
+      failed += 1
+      print("**FAILED**", name, "-", type(err).__name__, err)
+  return failed
+
+
+if __name__ == "__main__":
+  failed = run_all(sys.modules[__name__])
+  print("**PASSED**" if failed == 0 else "**FAILED** " + str(failed))
+  sys.exit(1 if failed > 0 else 0)
@@ -0,0 +1,193 @@
+#
+# Stateless session tokens for the BenfordApp web service. Like
+# datatier.py, this file is deployed alongside each lambda
+# function that checks tokens.
+#
+# A token is "v1.<userid>.<expiry>.<signature>", where expiry is
+# in seconds since the epoch (UTC) and the signature is an
+# HMAC-SHA256 over the first three fields, keyed with the secret
+# from the [auth] section of the config file. Checking a token
+# is therefore a local computation, with no database access.
+#
+# Tokens are issued by /login (proj03_login), which checks the
+# password against users.pwdhash once. Logging out adds the
+# token to the tokens table, which serves as a revocation list;
+# each lambda container caches that list in memory and refreshes
+# it at most once per REVOCATION_REFRESH_SECS.
+#
+# Config file settings:
+#
+#   [auth]
+#   secret = <long random string>
+#   required = true       ; reject requests without a token
+#   ttl_secs = 3600
+#   revocation = true     ; honor the revocation list (default);
+#                         ; false also disables logging out
+#
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+VERSION = "v1"
+DEFAULT_TTL_SECS = 3600
+REVOCATION_REFRESH_SECS = 60
+
+
+class AuthError(Exception):
+  """
+  Raised when a request's token is missing, malformed, expired,
+  revoked, or for a different user.
+  """
+  pass
+
+
+def sign(secret, payload):
+  """
+  Returns the base64url HMAC-SHA256 signature of payload.
+  """
+  digest = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()
+  return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+
+def issue(userid, secret, ttl_secs=DEFAULT_TTL_SECS):
+  """
+  Returns (token, expiry) for the given user, valid for ttl_secs.
+  """
+  expiry = int(time.time()) + int(ttl_secs)
+  payload = VERSION + "." + str(userid) + "." + str(expiry)
+  return (payload + "." + sign(secret, payload), expiry)
+
+
+def parse(token):
+  """
+  Splits a token into (userid, expiry) without checking the
+  signature; clients use this to know when to log in again.
+  """
+  fields = token.split(".")
+  if len(fields) != 4 or fields[0] != VERSION:
+    raise AuthError("malformed token")
+  if not fields[1].isnumeric() or not fields[2].isnumeric():
+    raise AuthError("malformed token")
+  return (int(fields[1]), int(fields[2]))
+
+
+def verify(token, secret, now=None):
+  """
+  Checks the token's signature and expiry, and returns the
+  userid it was issued to. Raises AuthError otherwise.
+  """
+  (userid, expiry) = parse(token)
+
+  payload = token[0:token.rindex(".")]
+  signature = token[token.rindex(".") + 1:]
+
+  if not hmac.compare_digest(signature, sign(secret, payload)):
+    raise AuthError("invalid token")
+
+  if now is None:
+    now = time.time()
+  if expiry <= now:
+    raise AuthError("token expired")
+
+  return userid
+
+
+############################################################
+#
+# revocation list, cached per container
+#
+_revoked = set()
+_revoked_loaded_at = None
+
+
+def is_revoked(token, dbConn):
+  """
+  True if the token has been revoked (logged out). The list of
+  unexpired revoked tokens is re-read from the database at most
+  once every REVOCATION_REFRESH_SECS.
+  """
+  global _revoked, _revoked_loaded_at
+
+  now = time.monotonic()
+
+  if _revoked_loaded_at is None or now - _revoked_loaded_at >= REVOCATION_REFRESH_SECS:
+    import datatier  # lambda side only, the client never gets here
+
+    sql = "SELECT token FROM tokens WHERE expiration_utc > UTC_TIMESTAMP();"
+    rows = datatier.retrieve_all_rows(dbConn, sql)
+
+    _revoked = set(row[0] for row in rows)
+    _revoked_loaded_at = now
+
+  return token in _revoked
+
+
+def get_bearer_token(event):
+  """
+  Returns the token from an API Gateway event's Authorization
+  header, or None if there isn't one.
+  """
+  headers = event.get("headers") or {}
+  for key in headers:
+    if key.lower() == "authorization" and headers[key].startswith("Bearer "):
+      return headers[key][len("Bearer "):].strip()
+  return None
+
+
+def authenticate(event, configur, dbConn=None):
+  """
+  Checks the bearer token on an API Gateway event, using the
+  [auth] settings in the config file.
+
+  Returns the token's userid, or None if there is no token and
+  tokens are not required. Raises AuthError if the token is
+  bad, or missing when required.
+  """
+  secret = configur.get('auth', 'secret', fallback=None)
+  required = configur.getboolean('auth', 'required', fallback=False)
+  revocation = configur.getboolean('auth', 'revocation', fallback=True)
+
+  token = get_bearer_token(event)
+
+  if token is None:
+    if required:
+      raise AuthError("requires an authorization token, please log in")
+    return None
+
+  if secret is None:
+    raise AuthError("server is not configured to check tokens")
+
+  userid = verify(token, secret)
+
+  if revocation and dbConn is not None and is_revoked(token, dbConn):
+    raise AuthError("token has been revoked")
+
+  return userid
+
+
+def require(event, configur, dbConn=None):
+  """
+  Like authenticate, but a token is always required, whatever
+  [auth] required says: for functions that read across jobs
+  (/search, /entities, /export), and so must be scoped to the
+  caller's own. Returns the token's userid.
+  """
+  userid = authenticate(event, configur, dbConn)
+
+  if userid is None:
+    raise AuthError("requires an authorization token, please log in")
+
+  return userid
+
+
+def unauthorized(err):
+  """
+  The API Gateway response for a failed authentication.
+  """
+  return {
+    'statusCode': 401,
+    'body': json.dumps(str(err))
+  }
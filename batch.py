@@ -0,0 +1,304 @@
+#
+# Batch mode for the benford app client: submits every PDF in a
+# directory (or matching a glob) concurrently, tracks the jobs
+# until they complete or fail, and writes each job's results
+# next to its source file:
+#
+#   reports/q1.pdf  =>  reports/q1.results.txt   (completed)
+#                       reports/q1.error.txt     (error)
+#
+# At most max_in_flight jobs are outstanding at once, counting
+# from upload until the results are written. Job status is
+# tracked with the bulk /status endpoint, one request for all
+# in-flight jobs per poll, and results are only downloaded once
+# a job has finished.
+#
+# The whole batch has a deadline, timeout_secs after it starts:
+# jobs that haven't finished by then are given up on and count
+# as failed (their results can still be downloaded later), and
+# files not yet uploaded are skipped.
+#
+# At the end, throughput (files/s, bytes/s) and a histogram of
+# per-job latency (upload to results written) are printed.
+#
+# batch_test.py runs batches against a fake web service (python
+# batch_test.py).
+#
+
+import asyncio
+import base64
+import glob
+import json
+import os
+import pathlib
+import time
+
+import transport
+
+#
+# time between /status polls, and upper bounds of the latency
+# histogram buckets in seconds:
+#
+POLL_SECS = 1.0
+DEFAULT_TIMEOUT_SECS = 3600.0
+HISTOGRAM_BUCKETS = [1, 2, 5, 10, 20, 30, 60, 120, 300, 600]
+
+
+class BatchJob:
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.size = os.path.getsize(filename)
+    self.jobid = None
+    self.status = None
+    self.message = None
+    self.submitted = None
+    self.finished = None
+    self.done = None  # future, set when the job reaches a terminal state
+
+
+def find_files(pattern):
+  """
+  Returns the sorted list of files to process: every .pdf in
+  pattern if it's a directory, else the files matching pattern
+  as a glob.
+  """
+  if pathlib.Path(pattern).is_dir():
+    pattern = os.path.join(pattern, "*.pdf")
+
+  return sorted(f for f in glob.glob(pattern) if pathlib.Path(f).is_file())
+
+
+def results_filename(filename, suffix):
+  """
+  reports/q1.pdf => reports/q1.<suffix>.txt
+  """
+  path = pathlib.Path(filename)
+  return str(path.with_name(path.stem + "." + suffix + ".txt"))
+
+
+async def submit(client, job, jobtype, userid, encoding):
+  """
+  Uploads one file as a compressed binary body, and records
+  its job id. Raises an Exception if the upload fails.
+  """
+  data = await asyncio.to_thread(read_and_compress, job.filename, encoding)
+
+  headers = {"Content-Type": "application/pdf"}
+  if encoding != "identity":
+    headers["Content-Encoding"] = encoding
+
+  job.submitted = time.perf_counter()
+
+  res = await client.arequest("POST", "/pdf/" + str(userid) + "/" + jobtype,
+                              params={"filename": os.path.basename(job.filename)},
+                              data=data, headers=headers)
+
+  if res.status_code != 200:
+    raise Exception("upload of " + job.filename + " failed with status code " +
+                    str(res.status_code) + ": " + str(res.json()))
+
+  job.jobid = int(res.json())
+
+
+def read_and_compress(filename, encoding):
+  """
+  Reads a file and returns its bytes with the given encoding.
+  """
+  infile = open(filename, "rb")
+  data = infile.read()
+  infile.close()
+
+  return transport.compress(data, encoding)
+
+
+async def fetch_results(client, job):
+  """
+  Downloads a finished job's results (or error message) and
+  writes them next to the source file.
+  """
+  headers = {"Accept": "text/plain", "Accept-Encoding": transport.accept_encoding_header()}
+
+  res = await client.arequest("GET", "/results/" + str(job.jobid), headers=headers, stream=True)
+  wire = await asyncio.to_thread(lambda: res.raw.read(decode_content=False))
+  body = transport.decompress(wire, res.headers.get("Content-Encoding", "identity"))
+
+  if res.status_code == 200:
+    if res.headers.get("Content-Type", "").startswith("application/json"):
+      # server only speaks the base64 fallback:
+      body = base64.b64decode(json.loads(body).encode())
+    outname = results_filename(job.filename, "results")
+  else:
+    job.status = "error"
+    job.message = json.loads(body)
+    body = (str(job.message) + "\n").encode()
+    outname = results_filename(job.filename, "error")
+
+  await asyncio.to_thread(pathlib.Path(outname).write_bytes, body)
+
+
+async def process(client, job, jobtype, userid, encoding, slots, pending, deadline):
+  """
+  Runs one file through the pipeline: upload, wait for the
+  tracker to see it finish, then download its results.
+  """
+  async with slots:
+    try:
+      if time.perf_counter() >= deadline:
+        raise Exception("not uploaded, the batch ran out of time")
+
+      await submit(client, job, jobtype, userid, encoding)
+
+      job.done = asyncio.get_running_loop().create_future()
+      pending[job.jobid] = job
+
+      await job.done
+      await fetch_results(client, job)
+
+    except Exception as err:
+      job.status = "error"
+      job.message = str(err)
+
+    job.finished = time.perf_counter()
+
+    if job.message is None:
+      print(job.filename + ":", job.status, "(job " + str(job.jobid) + ")")
+    else:
+      print(job.filename + ":", job.status, "-", job.message)
+
+
+async def track(client, pending, finished, deadline, timeout_secs):
+  """
+  Polls /status for every in-flight job at once, and resolves
+  each job's future when it completes or fails, or with an
+  exception once the deadline passes.
+  """
+  while not finished.is_set() or len(pending) > 0:
+    if time.perf_counter() >= deadline:
+      for jobid in list(pending.keys()):
+        job = pending.pop(jobid)
+        job.done.set_exception(Exception("job " + str(jobid) + " still " + str(job.status or "uploaded") +
+                                         " after " + str(timeout_secs) + " secs, giving up"))
+    elif len(pending) > 0:
+      jobids = list(pending.keys())
+
+      for i in range(0, len(jobids), 1000):
+        try:
+          res = await client.arequest("POST", "/status", json={"jobids": jobids[i:i + 1000]})
+        except Exception as err:
+          # the client already retried, try again next poll:
+          print("**status poll failed:", err, "**")
+          continue
+
+        if res.status_code != 200:
+          print("**status poll failed with status code", res.status_code, "**")
+          continue
+
+        for entry in res.json():
+          job = pending.get(entry["jobid"])
+          if job is None:
+            continue
+          job.status = entry["status"]
+          if entry["status"] in ["completed", "error"]:
+            del pending[entry["jobid"]]
+            job.done.set_result(entry["status"])
+
+    await asyncio.sleep(POLL_SECS)
+
+
+async def run(client, jobs, jobtype, userid, max_in_flight, encoding, timeout_secs):
+  """
+  Processes all the jobs concurrently, alongside the tracker.
+  """
+  slots = asyncio.Semaphore(max_in_flight)
+  pending = {}
+  finished = asyncio.Event()
+  deadline = time.perf_counter() + timeout_secs
+
+  tracker = asyncio.create_task(track(client, pending, finished, deadline, timeout_secs))
+
+  await asyncio.gather(*[process(client, job, jobtype, userid, encoding, slots, pending, deadline)
+                         for job in jobs])
+
+  finished.set()
+  await tracker
+
+
+def histogram(latencies):
+  """
+  Returns the lines of a text histogram of latencies (secs).
+  """
+  counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+  for secs in latencies:
+    i = 0
+    while i < len(HISTOGRAM_BUCKETS) and secs > HISTOGRAM_BUCKETS[i]:
+      i += 1
+    counts[i] += 1
+
+  widest = max(counts) if len(counts) > 0 and max(counts) > 0 else 1
+
+  lines = []
+  lower = 0
+  for i in range(len(counts)):
+    if i < len(HISTOGRAM_BUCKETS):
+      label = "%4ss - %4ss" % (lower, HISTOGRAM_BUCKETS[i])
+      lower = HISTOGRAM_BUCKETS[i]
+    else:
+      label = "%4ss +      " % lower
+    bar = "#" * int(round(40.0 * counts[i] / widest))
+    lines.append("%s %6d %s" % (label, counts[i], bar))
+
+  return lines
+
+
+def run_batch(client, pattern, jobtype, userid, max_in_flight=8, encoding="gzip",
+              timeout_secs=DEFAULT_TIMEOUT_SECS):
+  """
+  Processes every file matching pattern (a directory or a glob)
+  as a job of the given type for the given user, giving up on
+  jobs unfinished after timeout_secs, and prints a summary at
+  the end.
+
+  Returns
+  -------
+  list of BatchJob, one per file
+  """
+  files = find_files(pattern)
+
+  if len(files) == 0:
+    print("no files match '" + pattern + "'...")
+    return []
+
+  jobs = [BatchJob(f) for f in files]
+
+  print("**Processing", len(jobs), "files,", max_in_flight, "at a time**")
+
+  start = time.perf_counter()
+  asyncio.run(run(client, jobs, jobtype, userid, max_in_flight, encoding, timeout_secs))
+  elapsed = time.perf_counter() - start
+
+  completed = [job for job in jobs if job.status == "completed"]
+  failed = [job for job in jobs if job.status != "completed"]
+  total_bytes = sum(job.size for job in jobs)
+
+  latencies = [job.finished - job.submitted for job in jobs
+               if job.submitted is not None and job.finished is not None]
+
+  print()
+  print("**Batch summary**")
+  print("files:", len(jobs), "completed:", len(completed), "failed:", len(failed))
+  print("elapsed: %.2f secs" % elapsed)
+  print("throughput: %.2f files/s, %.0f bytes/s" % (len(jobs) / elapsed, total_bytes / elapsed))
+
+  if len(latencies) > 0:
+    latencies.sort()
+    print("latency: p50 %.2fs, p95 %.2fs, max %.2fs" % (
+      latencies[int(0.50 * (len(latencies) - 1))],
+      latencies[int(0.95 * (len(latencies) - 1))],
+      latencies[-1]))
+    print()
+    print("per-job latency histogram:")
+    for line in histogram(latencies):
+      print("  " + line)
+
+  return jobs
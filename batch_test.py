@@ -0,0 +1,165 @@
+#
+# Runs batch mode (batch.py) end to end over ApiClient and the
+# fake web service of apiclient_test.py: uploads, bulk /status
+# polling, the limit on jobs in flight, results and error files,
+# and the deadline for jobs that never finish.
+#
+# Runs under pytest, or on its own, exiting 1 on a failure:
+#
+#   python batch_test.py
+#
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import batch
+
+from apiclient_test import new_client, respond, run_all
+
+#
+# poll quickly, the fake jobs finish in a few polls:
+#
+batch.POLL_SECS = 0.05
+
+
+class FakeService:
+  """
+  The /pdf, /status and /results endpoints. A job finishes after
+  POLLS /status polls, as "error" if its file is named bad*.pdf,
+  or never if it's named stuck*.pdf.
+  """
+
+  POLLS = 3
+
+  def __init__(self, fail_first_poll=False):
+    self.lock = threading.Lock()
+    self.jobs = {}  # jobid => [filename, polls so far, status]
+    self.next_jobid = 1001
+    self.in_flight = 0
+    self.most_in_flight = 0
+    self.polled = []
+    self.fail_next_poll = fail_first_poll
+
+  def __call__(self, request, path):
+    with self.lock:
+      if path.startswith("/pdf/"):
+        filename = request.url.split("filename=")[1]
+        jobid = self.next_jobid
+        self.next_jobid += 1
+        self.jobs[jobid] = [filename, 0, "uploaded"]
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        return respond(request, 200, str(jobid))
+
+      if path == "/status":
+        if self.fail_next_poll:
+          self.fail_next_poll = False
+          return respond(request, 500, "internal error")
+
+        jobids = json.loads(request.body)["jobids"]
+        self.polled.append(jobids)
+
+        entries = []
+        for jobid in jobids:
+          job = self.jobs[jobid]
+          job[1] += 1
+          if job[1] >= self.POLLS and not job[0].startswith("stuck"):
+            job[2] = "error" if job[0].startswith("bad") else "completed"
+          else:
+            job[2] = "processing"
+          entries.append({"jobid": jobid, "status": job[2]})
+        return respond(request, 200, entries)
+
+      if path.startswith("/results/"):
+        jobid = int(path.split("/")[2])
+        (filename, polls, status) = self.jobs[jobid]
+        self.in_flight -= 1
+        if status == "completed":
+          return respond(request, 200, ("results of " + filename + "\n").encode(),
+                         {"Content-Type": "text/plain"})
+        return respond(request, 400, "error: " + filename + " has no numbers")
+
+    return respond(request, 404, "no such api")
+
+
+def make_files(names):
+  """
+  A scratch directory with a small "PDF" per name.
+  """
+  directory = tempfile.mkdtemp()
+  for name in names:
+    outfile = open(os.path.join(directory, name), "wb")
+    outfile.write(b"%PDF-1.4 " + name.encode())
+    outfile.close()
+  return directory
+
+
+def read(directory, name):
+  infile = open(os.path.join(directory, name), "r")
+  text = infile.read()
+  infile.close()
+  return text
+
+
+def test_batch_writes_results_and_errors():
+  directory = make_files(["a.pdf", "b.pdf", "bad.pdf", "c.pdf", "d.pdf"])
+  service = FakeService(fail_first_poll=True)
+  (client, adapter) = new_client(service)
+
+  jobs = batch.run_batch(client, directory, "benford", 80001, max_in_flight=2,
+                         encoding="gzip", timeout_secs=30)
+
+  statuses = {os.path.basename(job.filename): job.status for job in jobs}
+  assert statuses == {"a.pdf": "completed", "b.pdf": "completed", "bad.pdf": "error",
+                      "c.pdf": "completed", "d.pdf": "completed"}, statuses
+
+  assert read(directory, "a.results.txt") == "results of a.pdf\n"
+  assert "has no numbers" in read(directory, "bad.error.txt")
+  assert not os.path.exists(os.path.join(directory, "bad.results.txt"))
+
+  #
+  # never more than 2 jobs between upload and results, and all
+  # of them polled in one /status request:
+  #
+  assert service.most_in_flight == 2
+  assert max(len(jobids) for jobids in service.polled) == 2
+  assert adapter.count("POST", "/status") == len(service.polled) + 1  # and the failed one
+
+  assert all(job.finished >= job.submitted for job in jobs)
+
+
+def test_batch_gives_up_at_the_deadline():
+  directory = make_files(["a.pdf", "stuck.pdf", "z.pdf"])
+  service = FakeService()
+  (client, adapter) = new_client(service)
+
+  #
+  # one at a time: a.pdf completes, stuck.pdf holds the only slot
+  # until the deadline, and z.pdf is never uploaded:
+  #
+  start = time.perf_counter()
+  jobs = batch.run_batch(client, directory, "benford", 80001, max_in_flight=1,
+                         encoding="identity", timeout_secs=1.0)
+  elapsed = time.perf_counter() - start
+
+  assert elapsed < 5.0, "batch ran %.1f secs past a 1 sec deadline" % elapsed
+
+  (a, stuck, z) = jobs
+  assert a.status == "completed"
+  assert stuck.status == "error" and "giving up" in stuck.message, stuck.message
+  assert "still processing" in stuck.message, stuck.message
+  assert z.status == "error" and z.jobid is None and "not uploaded" in z.message, z.message
+
+  assert adapter.count("POST", "/pdf/80001/benford") == 2
+  assert os.path.exists(os.path.join(directory, "a.results.txt"))
+  assert not os.path.exists(os.path.join(directory, "stuck.results.txt"))
+
+
+if __name__ == "__main__":
+  failed = run_all(sys.modules[__name__])
+  print("**PASSED**" if failed == 0 else "**FAILED** " + str(failed))
+  sys.exit(1 if failed > 0 else 0)
@@ -0,0 +1,453 @@
+#
+# Benchmarks for the compute engine (proj03_compute), over a
+# deterministic corpus of synthetic PDFs (see pdfgen.py) that
+# vary in page count, numeric density and text volume.
+#
+# Each document is timed in stages, separately and together:
+#
+#   parse      PdfReader over the bytes, counting pages
+#   extract    extract_text() of every page
+#   tally      Benford tally of the extracted text
+#   chunk      comprehend_chunks() of the extracted pages, the
+#              per-page texts the ner/pii analyses send
+#   benford    parse + extract + tally, as the benford job does
+#   ner_pii    parse + comprehend_chunks() over PageTexts, as the
+#              ner/pii jobs do
+#
+# plus the wall time of "python main.py --help", a command that
+# makes no network call (cli/startup), and full-text search
+# over the corpus' pages, in the emulator's SQLite FTS5 rather
+# than MySQL (see textsearch.py):
+#
+#   search/index   indexing every page of the corpus, in batches
+#                  as compute does
+#   search/query   one /search query (ranking, snippets and
+#                  filenames), over SEARCH_QUERIES
+#
+# With --rows N, a ledger of N rows is also written as .csv and
+# .xlsx (see tablegen.py) and tallied as a tabular job does
+# (csv/tally, xlsx/tally), printing rows per second and the peak
+# memory of one more, untimed, tally. Millions of rows take a
+# while, so these are off by default:
+#
+#   python benchmark.py --rows 2000000 --repeats 1 --only small
+#
+# Results are printed, and can be saved as JSON and compared to
+# a saved baseline; a stage whose fastest run is more than
+# --threshold and MIN_REGRESSION_MS slower than the baseline's
+# fastest fails the run (exit status 1), as does a CLI startup
+# over STARTUP_LIMIT_MS. The minimum is compared, not the median,
+# since a run can only be slowed by noise (other processes, GC,
+# frequency scaling), never sped up by it:
+#
+#   python benchmark.py --save baseline.json
+#   ... change proj03_compute ...
+#   python benchmark.py --baseline baseline.json
+#
+# Baselines are only comparable on the same machine.
+#
+# The CLI startup check on its own, no baseline needed:
+#
+#   python benchmark.py --only cli
+#
+
+import argparse
+import importlib
+import io
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import emulator
+import pdfgen
+import tablegen
+import tabular
+
+#
+# (name, pages, lines per page, words per line, numeric fraction):
+#
+CORPUS = [
+  ("small", 1, 45, 10, 0.35),
+  ("medium", 20, 45, 10, 0.35),
+  ("large", 100, 45, 10, 0.35),
+  ("dense", 20, 45, 10, 0.90),
+  ("sparse", 20, 45, 10, 0.02),
+  ("wordy", 20, 90, 20, 0.35),
+]
+
+DEFAULT_REPEATS = 15
+DEFAULT_THRESHOLD = 0.25
+
+#
+# differences below this are noise, whatever the percentage; a
+# few ms of jitter on a stage of a few ms is normal:
+#
+MIN_REGRESSION_MS = 5.0
+
+#
+# most that "python main.py --help" may take, interpreter
+# startup included:
+#
+STARTUP_LIMIT_MS = 100.0
+
+
+def load_function(function_name):
+  """
+  Imports a lambda function's module with the emulator's boto3
+  and datatier in place, since the benchmarks never call AWS.
+  """
+  saved = {}
+  for name in ["boto3", "datatier"]:
+    saved[name] = sys.modules.get(name)
+
+  sys.modules["boto3"] = emulator.make_boto3(emulator.FakeS3(), emulator.FakeComprehend(0.0))
+  sys.modules["datatier"] = emulator.make_datatier(":memory:")
+
+  try:
+    module = importlib.import_module(function_name)
+  finally:
+    for (name, module_saved) in saved.items():
+      if module_saved is None:
+        sys.modules.pop(name, None)
+      else:
+        sys.modules[name] = module_saved
+
+  return module
+
+
+def load_compute():
+  return load_function("proj03_compute")
+
+
+def build_corpus(seed=0):
+  """
+  Returns [(name, pdf bytes)], the same bytes for the same seed.
+  """
+  corpus = []
+  for (i, (name, pages, lines, words, numeric)) in enumerate(CORPUS):
+    rng = random.Random(seed * 1000 + i)
+    corpus.append((name, pdfgen.random_pdf(rng, pages, lines, words, numeric)))
+  return corpus
+
+
+def timeit(fn, repeats, setup=None):
+  """
+  Runs fn (given setup()'s result, if any) repeats times, and
+  returns the run times in ms. setup is not timed.
+  """
+  samples = []
+  for i in range(repeats):
+    arg = setup() if setup is not None else None
+    start = time.perf_counter()
+    if setup is not None:
+      fn(arg)
+    else:
+      fn()
+    samples.append((time.perf_counter() - start) * 1000.0)
+  return samples
+
+
+def bench_document(compute, name, pdf, repeats):
+  """
+  Times each stage on one document. Returns {stage: samples}.
+  """
+  from pypdf import PdfReader
+
+  def new_reader():
+    return PdfReader(io.BytesIO(pdf))
+
+  texts = [page.extract_text() for page in new_reader().pages]
+
+  def parse():
+    reader = new_reader()
+    return len(reader.pages)
+
+  def extract(reader):
+    return [page.extract_text() for page in reader.pages]
+
+  def tally():
+    digits = compute.new_digit_counts()
+    for text in texts:
+      compute.tally_first_digits(text, digits)
+    return digits
+
+  def chunk():
+    return compute.comprehend_chunks("ner", texts)
+
+  def benford():
+    reader = new_reader()
+    digits = compute.new_digit_counts()
+    for i in range(0, len(reader.pages)):
+      compute.tally_first_digits(reader.pages[i].extract_text(), digits)
+    return digits
+
+  def ner_pii():
+    return compute.comprehend_chunks("ner", compute.PageTexts(new_reader()))
+
+  return {
+    "parse": timeit(parse, repeats),
+    "extract": timeit(extract, repeats, setup=new_reader),
+    "tally": timeit(tally, repeats),
+    "chunk": timeit(chunk, repeats),
+    "benford": timeit(benford, repeats),
+    "ner_pii": timeit(ner_pii, repeats),
+  }
+
+
+SEARCH_QUERIES = ["revenue", "lake michigan", "alice johnson", "operating expenses growth",
+                  "evanston", "quarterly fiscal report"]
+
+
+def bench_search(corpus, repeats):
+  """
+  Times indexing the corpus' pages and searching them. Returns
+  {stage: samples}, and the pages indexed per second of the
+  median indexing run.
+  """
+  from pypdf import PdfReader
+
+  search = load_function("proj03_search")
+  textsearch = search.textsearch
+
+  documents = []
+  for (name, pdf) in corpus:
+    documents.append([page.extract_text() for page in PdfReader(io.BytesIO(pdf)).pages])
+
+  pages = sum(len(texts) for texts in documents)
+
+  with tempfile.TemporaryDirectory() as tmp:
+    count = [0]
+
+    def new_database():
+      count[0] += 1
+      database = os.path.join(tmp, "search-" + str(count[0]) + ".db")
+      emulator.create_sqlite_database(database)
+
+      dbConn = sqlite3.connect(database)
+      for (i, texts) in enumerate(documents):
+        dbConn.execute("""
+          INSERT INTO jobs(jobid, userid, status, jobtype, originaldatafile, datafilekey, resultsfilekey)
+                 VALUES(?, 80001, 'completed', 'benford', ?, ?, '');
+        """, [1001 + i, corpus[i][0] + ".pdf", corpus[i][0]])
+      dbConn.commit()
+      return dbConn
+
+    def index(dbConn):
+      for (i, texts) in enumerate(documents):
+        indexer = textsearch.Indexer(dbConn, 1001 + i, 80001)
+        for (page, text) in enumerate(texts):
+          indexer.add(page, text)
+        indexer.flush()
+
+    index_samples = timeit(index, repeats, setup=new_database)
+
+    dbConn = new_database()
+    index(dbConn)
+
+    def query():
+      for q in SEARCH_QUERIES:
+        search.search(dbConn, textsearch.terms(q))
+
+    query_samples = [ms / len(SEARCH_QUERIES) for ms in timeit(query, repeats)]
+
+    dbConn.close()
+
+  pages_per_sec = round(pages / (statistics.median(index_samples) / 1000.0))
+
+  return ({"search/index": index_samples, "search/query": query_samples}, pages_per_sec)
+
+
+def bench_startup(repeats):
+  """
+  Returns samples of the wall time of "python main.py --help",
+  from starting the interpreter until it exits, in ms.
+  """
+  main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+  samples = []
+  for i in range(repeats):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, main_py, "--help"], stdout=subprocess.DEVNULL, check=True)
+    samples.append((time.perf_counter() - start) * 1000.0)
+  return samples
+
+
+def bench_tables(rows, repeats, seed=0):
+  """
+  Returns {"csv/tally": summary, "xlsx/tally": summary}, each
+  with the rows per second of the median run and the peak memory
+  (KiB) of tallying the file once more under tracemalloc.
+  """
+  results = {}
+
+  with tempfile.TemporaryDirectory() as tmp:
+    for extension in [".csv", ".xlsx"]:
+      filename = os.path.join(tmp, "ledger" + extension)
+      tablegen.write_table(filename, rows, seed)
+
+      samples = timeit(lambda: tabular.tally_file(filename, extension), repeats)
+      summary = summarize(samples)
+      summary["rows_per_sec"] = round(rows / (summary["median_ms"] / 1000.0))
+      summary["file_mb"] = round(os.path.getsize(filename) / (1024.0 * 1024.0), 1)
+
+      #
+      # tracemalloc slows allocation down a lot, so it's only on
+      # for this run:
+      #
+      tracemalloc.start()
+      tabular.tally_file(filename, extension)
+      (current, peak) = tracemalloc.get_traced_memory()
+      tracemalloc.stop()
+      summary["peak_kib"] = round(peak / 1024.0)
+
+      results[extension[1:] + "/tally"] = summary
+
+  return results
+
+
+def summarize(samples):
+  return {
+    "median_ms": round(statistics.median(samples), 3),
+    "min_ms": round(min(samples), 3),
+    "repeats": len(samples),
+  }
+
+
+def run_benchmarks(repeats=DEFAULT_REPEATS, only=None, seed=0, startup=True, rows=None):
+  """
+  Runs the suite. Returns {"<document>/<stage>": summary}.
+  """
+  compute = load_compute()
+  results = {}
+
+  for (name, pdf) in build_corpus(seed):
+    if only is not None and name not in only:
+      continue
+    for (stage, samples) in bench_document(compute, name, pdf, repeats).items():
+      results[name + "/" + stage] = summarize(samples)
+
+  if only is None or "search" in only:
+    (samples, pages_per_sec) = bench_search(build_corpus(seed), repeats)
+    for (stage, stage_samples) in samples.items():
+      results[stage] = summarize(stage_samples)
+    results["search/index"]["pages_per_sec"] = pages_per_sec
+
+  if startup and (only is None or "cli" in only):
+    results["cli/startup"] = summarize(bench_startup(repeats))
+
+  if rows is not None:
+    results.update(bench_tables(rows, repeats, seed))
+
+  return results
+
+
+def compare(results, baseline, threshold):
+  """
+  Returns a list of failure messages: stages slower than the
+  baseline by more than threshold, and a slow CLI startup.
+  """
+  failures = []
+
+  for (name, summary) in sorted(results.items()):
+    if name == "cli/startup":
+      if summary["min_ms"] > STARTUP_LIMIT_MS:
+        failures.append("%s: %.1f ms, limit %.1f ms" % (name, summary["min_ms"], STARTUP_LIMIT_MS))
+      continue
+
+    if baseline is None or name not in baseline:
+      continue
+
+    before = baseline_ms(baseline[name])
+    after = summary["min_ms"]
+    if after > before * (1.0 + threshold) and after - before > MIN_REGRESSION_MS:
+      failures.append("%s: %.1f ms, baseline %.1f ms (+%.0f%%)" % (
+        name, after, before, 100.0 * (after - before) / before))
+
+  return failures
+
+
+def baseline_ms(summary):
+  """
+  The baseline's fastest run; older baselines only saved the
+  median.
+  """
+  return summary.get("min_ms", summary["median_ms"])
+
+
+def print_results(results, baseline=None):
+  print("%-20s %12s %12s %12s" % ("benchmark", "median ms", "min ms", "baseline min"))
+  for (name, summary) in sorted(results.items()):
+    before = ""
+    if baseline is not None and name in baseline:
+      before = "%.3f" % baseline_ms(baseline[name])
+    print("%-20s %12.3f %12.3f %12s" % (name, summary["median_ms"], summary["min_ms"], before))
+
+  for (name, summary) in sorted(results.items()):
+    if "pages_per_sec" in summary:
+      print("%s: %d pages/s" % (name, summary["pages_per_sec"]))
+    if "rows_per_sec" in summary:
+      print("%s: %d rows/s over %.1f MB, peak %d KiB" % (
+        name, summary["rows_per_sec"], summary["file_mb"], summary["peak_kib"]))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Benchmark the benford app compute engine.")
+  parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+  parser.add_argument("--only", default=None, help="comma-separated documents, e.g. small,dense, "
+                                                  "or search or cli")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--no-startup", action="store_true", help="skip the CLI startup benchmark")
+  parser.add_argument("--rows", type=int, default=None,
+                      help="also benchmark tallying .csv/.xlsx ledgers of this many rows")
+  parser.add_argument("--save", default=None, help="write results to this JSON file")
+  parser.add_argument("--baseline", default=None, help="compare to results saved earlier")
+  parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                      help="allowed slowdown vs. the baseline, e.g. 0.25 = 25%%")
+  args = parser.parse_args()
+
+  only = args.only.split(",") if args.only is not None else None
+
+  results = run_benchmarks(args.repeats, only, args.seed, not args.no_startup, args.rows)
+
+  baseline = None
+  if args.baseline is not None:
+    infile = open(args.baseline, "r")
+    baseline = json.load(infile)["results"]
+    infile.close()
+
+  print_results(results, baseline)
+
+  if args.save is not None:
+    from pypdf import __version__ as pypdf_version
+
+    outfile = open(args.save, "w")
+    json.dump({
+      "version": 1,
+      "python": platform.python_version(),
+      "pypdf": pypdf_version,
+      "machine": platform.machine(),
+      "seed": args.seed,
+      "results": results
+    }, outfile, indent=2, sort_keys=True)
+    outfile.close()
+    print("results saved to '" + args.save + "'")
+
+  failures = compare(results, baseline, args.threshold)
+
+  if len(failures) > 0:
+    print()
+    print("**FAILED**")
+    for failure in failures:
+      print("  " + failure)
+    sys.exit(1)
+
+  print()
+  print("**PASSED**")
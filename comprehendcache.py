@@ -0,0 +1,456 @@
+#
+# Memoization of AWS Comprehend calls for proj03_compute. Like
+# datatier.py, this file is deployed alongside the lambda
+# function.
+#
+# Our documents share a lot of text (disclaimers, legal pages,
+# repeated headers, the same filing uploaded again), and
+# Comprehend bills for every call. Compute sends each analysis
+# its text a page at a time ("chunks"), and each chunk's
+# response is remembered under a hash of
+#
+#   the API (detect_entities, ...), the language code, and the
+#   chunk's text with its whitespace normalized
+#
+# in two places:
+#
+#   - an in-memory LRU per container, bounded by entries, bytes
+#     and age, and
+#   - the comprehend_cache table, shared by every container,
+#     which proj03_sweeper trims by age (since last use) and by
+#     total size.
+#
+# The table is read and written in batches: compute prefetches
+# every chunk of a job in one query before the analyses start,
+# and writes new responses back after they finish, so the
+# analysis threads never touch the database.
+#
+# Chunks that differ only in whitespace share a response, so
+# responses are cached with their entities' BeginOffset and
+# EndOffset rewritten to positions in the normalized text, and
+# every response handed back has them rewritten again for the
+# chunk actually asked about (see OffsetMap). Offsets are thus
+# always those of the chunk's own text, cached or not.
+#
+# Settings come from the [comprehend_cache] section of the
+# config file:
+#
+#   [comprehend_cache]
+#   enabled = true
+#   memory_entries = 2000
+#   memory_mb = 32
+#   max_age_days = 30
+#   max_store_mb = 256
+#
+
+import bisect
+import collections
+import hashlib
+import json
+import re
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import datatier
+
+DEFAULT_MEMORY_ENTRIES = 2000
+DEFAULT_MEMORY_MB = 32
+DEFAULT_MAX_AGE_DAYS = 30
+DEFAULT_MAX_STORE_MB = 256
+
+#
+# keys per SELECT ... IN (...) or multi-row INSERT:
+#
+KEYS_PER_QUERY = 500
+
+#
+# concurrent Comprehend calls per analysis, for the chunks not
+# found in the cache:
+#
+CHUNK_WORKERS = 4
+
+#
+# part of every key: responses cached before offsets were
+# normalized are never used, and age out of the store:
+#
+KEY_VERSION = "v2"
+
+WORDS = re.compile(r"\S+")
+
+
+class Settings:
+
+  def __init__(self, enabled, memory_entries, memory_mb, max_age_days, max_store_mb):
+    self.enabled = enabled
+    self.memory_entries = memory_entries
+    self.memory_mb = memory_mb
+    self.max_age_days = max_age_days
+    self.max_store_mb = max_store_mb
+
+
+def get_settings(configur):
+  """
+  Reads the [comprehend_cache] section of the config file.
+  """
+  section = 'comprehend_cache'
+  return Settings(
+    configur.getboolean(section, 'enabled', fallback=True),
+    int(configur.get(section, 'memory_entries', fallback=DEFAULT_MEMORY_ENTRIES)),
+    float(configur.get(section, 'memory_mb', fallback=DEFAULT_MEMORY_MB)),
+    float(configur.get(section, 'max_age_days', fallback=DEFAULT_MAX_AGE_DAYS)),
+    float(configur.get(section, 'max_store_mb', fallback=DEFAULT_MAX_STORE_MB)))
+
+
+def normalize(text):
+  return " ".join(text.split())
+
+
+def make_key(api, language, text):
+  data = KEY_VERSION + "\n" + api + "\n" + language + "\n" + normalize(text)
+  return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class OffsetMap:
+  """
+  Maps character offsets between a text and its normalized form,
+  word by word: an offset within (or at the end of) a word maps
+  to the same place in that word, one in the whitespace after a
+  word to the end of that word.
+  """
+
+  def __init__(self, text):
+    self.spans = [m.span() for m in WORDS.finditer(text)]
+    self.starts = [start for (start, end) in self.spans]
+    self.normalized_starts = []
+
+    n = 0
+    for (start, end) in self.spans:
+      self.normalized_starts.append(n)
+      n += end - start + 1
+
+  def to_normalized(self, offset):
+    k = bisect.bisect_right(self.starts, offset) - 1
+    if k < 0:
+      return 0
+    (start, end) = self.spans[k]
+    return self.normalized_starts[k] + min(offset - start, end - start)
+
+  def from_normalized(self, offset):
+    k = bisect.bisect_right(self.normalized_starts, offset) - 1
+    if k < 0:
+      return self.spans[0][0] if len(self.spans) > 0 else 0
+    (start, end) = self.spans[k]
+    return start + min(offset - self.normalized_starts[k], end - start)
+
+
+def remap(response, convert):
+  """
+  A copy of response with its entities' offsets passed through
+  convert; responses without entities are returned as is.
+  """
+  if "Entities" not in response:
+    return response
+
+  entities = []
+  for entity in response["Entities"]:
+    entity = dict(entity)
+    for name in ["BeginOffset", "EndOffset"]:
+      if name in entity:
+        entity[name] = convert(entity[name])
+    entities.append(entity)
+
+  return dict(response, Entities=entities)
+
+
+############################################################
+#
+# in memory, per container
+#
+class LRU:
+  """
+  Responses by key, least recently used evicted first once there
+  are more than max_entries or max_bytes of them. Entries older
+  than max_age_secs are misses.
+  """
+
+  def __init__(self, max_entries, max_bytes, max_age_secs):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.max_age_secs = max_age_secs
+    self.entries = collections.OrderedDict()  # key => (stored at, size, response)
+    self.bytes = 0
+    self.lock = threading.Lock()
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        return None
+
+      if time.time() - entry[0] > self.max_age_secs:
+        self.remove(key)
+        return None
+
+      self.entries.move_to_end(key)
+      return entry[2]
+
+  def put(self, key, response, size):
+    with self.lock:
+      if key in self.entries:
+        self.remove(key)
+
+      self.entries[key] = (time.time(), size, response)
+      self.bytes += size
+
+      while len(self.entries) > 0 and \
+            (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+        self.remove(next(iter(self.entries)))
+
+  def remove(self, key):
+    (stored_at, size, response) = self.entries.pop(key)
+    self.bytes -= size
+
+
+#
+# one per container, shared by the invocations it runs:
+#
+_memory = None
+_memory_lock = threading.Lock()
+
+
+def memory(settings):
+  global _memory
+
+  with _memory_lock:
+    if _memory is None:
+      _memory = LRU(settings.memory_entries,
+                    int(settings.memory_mb * 1024 * 1024),
+                    settings.max_age_days * 24 * 60 * 60)
+    return _memory
+
+
+############################################################
+#
+# a job's view of the cache
+#
+class Memo:
+  """
+  Calls Comprehend through the cache for one job, and counts
+  where each chunk's response came from.
+  """
+
+  def __init__(self, settings, language='en'):
+    self.settings = settings
+    self.language = language
+    self.memory = memory(settings) if settings.enabled else None
+    self.prefetched = {}  # key => response, from the store
+    self.new = {}         # key => (api, response JSON), to store
+    self.used = set()     # keys answered from the cache
+    self.memory_hits = 0
+    self.store_hits = 0
+    self.api_calls = 0
+    self.lock = threading.Lock()
+
+  def prefetch(self, dbConn, requests):
+    """
+    Loads from the store the responses for requests, a list of
+    (api, text), that aren't in memory.
+    """
+    if not self.settings.enabled:
+      return
+
+    keys = set()
+    for (api, text) in requests:
+      key = make_key(api, self.language, text)
+      if self.memory.get(key) is None:
+        keys.add(key)
+
+    keys = sorted(keys)
+
+    for i in range(0, len(keys), KEYS_PER_QUERY):
+      batch = keys[i:i + KEYS_PER_QUERY]
+
+      sql = """
+        SELECT hashkey, response
+          FROM comprehend_cache
+         WHERE hashkey IN (""" + ", ".join(["%s"] * len(batch)) + """);
+      """
+      for row in datatier.retrieve_all_rows(dbConn, sql, batch):
+        self.prefetched[row[0]] = json.loads(row[1])
+
+  def call(self, comprehend, api, text):
+    """
+    Returns the response of comprehend.<api>(text), from the
+    cache if we can.
+    """
+    return remap(self.lookup(comprehend, api, text), OffsetMap(text).from_normalized)
+
+  def lookup(self, comprehend, api, text):
+    """
+    Returns the response of comprehend.<api>(text) as cached,
+    i.e. with offsets into the normalized text.
+    """
+    key = make_key(api, self.language, text)
+
+    if self.settings.enabled:
+      response = self.prefetched.get(key)
+      if response is not None:
+        self.memory.put(key, response, len(json.dumps(response)))
+        with self.lock:
+          self.store_hits += 1
+          self.used.add(key)
+        return response
+
+      response = self.memory.get(key)
+      if response is not None:
+        with self.lock:
+          self.memory_hits += 1
+          self.used.add(key)
+        return response
+
+    response = getattr(comprehend, api)(Text=text, LanguageCode=self.language)
+
+    #
+    # the request id etc. belong to this call, not the text:
+    #
+    response = {k: v for (k, v) in response.items() if k != "ResponseMetadata"}
+    response = remap(response, OffsetMap(text).to_normalized)
+
+    with self.lock:
+      self.api_calls += 1
+
+    if self.settings.enabled:
+      data = json.dumps(response)
+      self.memory.put(key, response, len(data))
+      with self.lock:
+        self.new[key] = (api, data)
+
+    return response
+
+  def call_all(self, comprehend, api, texts):
+    """
+    Returns the responses for each of texts, in order. Chunks
+    that repeat within the job (up to whitespace) are sent once,
+    and misses are sent CHUNK_WORKERS at a time.
+    """
+    unique = {}
+    for text in texts:
+      unique.setdefault(make_key(api, self.language, text), text)
+
+    with self.lock:
+      self.memory_hits += len(texts) - len(unique)
+
+    with ThreadPoolExecutor(max_workers=CHUNK_WORKERS) as pool:
+      responses = dict(zip(unique.keys(), pool.map(lambda text: self.lookup(comprehend, api, text),
+                                                   unique.values())))
+
+    return [remap(responses[make_key(api, self.language, text)], OffsetMap(text).from_normalized)
+            for text in texts]
+
+  def flush(self, dbConn):
+    """
+    Writes the new responses to the store, and marks the ones
+    we used as recently used.
+    """
+    if not self.settings.enabled:
+      return
+
+    new = sorted(self.new.items())
+
+    for i in range(0, len(new), KEYS_PER_QUERY):
+      batch = new[i:i + KEYS_PER_QUERY]
+
+      values = []
+      for (key, (api, data)) in batch:
+        values.extend([key, api, len(data), data])
+
+      #
+      # IGNORE: another container may have stored the same
+      # chunk meanwhile:
+      #
+      sql = """
+        INSERT IGNORE INTO comprehend_cache(hashkey, api, bytes, response)
+               VALUES """ + ", ".join(["(%s, %s, %s, %s)"] * len(batch)) + ";"
+      datatier.perform_action(dbConn, sql, values)
+
+    used = sorted(self.used)
+
+    for i in range(0, len(used), KEYS_PER_QUERY):
+      batch = used[i:i + KEYS_PER_QUERY]
+
+      sql = """
+        UPDATE comprehend_cache SET last_used_at = NOW(3)
+         WHERE hashkey IN (""" + ", ".join(["%s"] * len(batch)) + ");"
+      datatier.perform_action(dbConn, sql, batch)
+
+  def report(self):
+    """
+    The job's chunks, where their responses came from, and the
+    Comprehend calls the cache saved.
+    """
+    hits = self.memory_hits + self.store_hits
+    chunks = hits + self.api_calls
+
+    return {
+      "chunks": chunks,
+      "memory_hits": self.memory_hits,
+      "store_hits": self.store_hits,
+      "api_calls": self.api_calls,
+      "calls_saved": hits,
+      "hit_rate": round(hits / chunks, 3) if chunks > 0 else 0.0
+    }
+
+
+############################################################
+#
+# eviction from the store (proj03_sweeper)
+#
+def sweep(dbConn, settings):
+  """
+  Deletes responses not used in max_age_days, then the least
+  recently used until the store is under max_store_mb.
+
+  Returns
+  -------
+  (rows deleted for age, rows deleted for size)
+  """
+  #
+  # NOW(3), the clock last_used_at is written with (its default,
+  # and flush), so the age doesn't shift by the session's UTC
+  # offset:
+  #
+  sql = """
+    DELETE FROM comprehend_cache
+     WHERE last_used_at < NOW(3) - INTERVAL %s DAY;
+  """
+  aged = datatier.perform_action(dbConn, sql, [int(settings.max_age_days)])
+
+  row = datatier.retrieve_one_row(dbConn, "SELECT COALESCE(SUM(bytes), 0) FROM comprehend_cache;")
+
+  excess = int(row[0]) - int(settings.max_store_mb * 1024 * 1024)
+  trimmed = 0
+
+  while excess > 0:
+    sql = """
+      SELECT hashkey, bytes
+        FROM comprehend_cache
+       ORDER BY last_used_at
+       LIMIT %s;
+    """
+    rows = datatier.retrieve_all_rows(dbConn, sql, [KEYS_PER_QUERY])
+    if len(rows) == 0:
+      break
+
+    keys = []
+    for (key, size) in rows:
+      if excess <= 0:
+        break
+      keys.append(key)
+      excess -= size
+
+    sql = "DELETE FROM comprehend_cache WHERE hashkey IN (" + ", ".join(["%s"] * len(keys)) + ");"
+    trimmed += datatier.perform_action(dbConn, sql, keys)
+
+  return (aged, trimmed)
@@ -2,7 +2,12 @@ CREATE DATABASE IF NOT EXISTS benfordapp;
 
 USE benfordapp;
 
+DROP TABLE IF EXISTS page_texts;
+DROP TABLE IF EXISTS entities;
+DROP TABLE IF EXISTS digit_counts;
+DROP TABLE IF EXISTS comprehend_cache;
 DROP TABLE IF EXISTS tokens;
+DROP TABLE IF EXISTS jobs_archive;
 DROP TABLE IF EXISTS jobs;
 DROP TABLE IF EXISTS users;
 
@@ -21,18 +26,64 @@ CREATE TABLE jobs
 (
     jobid             int not null AUTO_INCREMENT,
     userid            int not null,
-    status            varchar(256) not null,  -- uploaded, completed, error, processing...
-    jobtype           varchar(256) not null,  -- sentiment, summary, benford, entity
-    originaldatafile  varchar(256) not null,  -- original PDF filename from user
+    status            enum('uploaded', 'queued', 'processing', 'completed', 'error') not null,
+    claimid           char(36) null,          -- compute invocation processing the job (scheduler.py)
+    duplicate_events  int not null default 0, -- repeated S3 events / hand-offs ignored for the job
+    pages_done        int not null default 0, -- progress while processing
+    pages_total       int not null default 0,
+    digits            json null,              -- Benford counts: so far while processing, then final
+    jobtype           varchar(256) not null,  -- benford, sentiment, ner, pii, or several: "benford,ner"
+    analyses          json null,              -- status of each analysis: {"ner": "completed", ...}
+    comprehend_report json null,              -- Comprehend calls and cache hits (comprehendcache.py)
+    originaldatafile  varchar(256) not null,  -- original PDF (or .csv, .xlsx) filename from user
+    input_columns     json null,              -- .csv/.xlsx columns to analyze, null = the numeric ones
     datafilekey       varchar(256) not null,  -- PDF filename in S3 (bucketkey)
     resultsfilekey    varchar(256) not null,  -- results filename in S3 bucket
+    resultsetag       varchar(64) null,       -- ETag of completed results
+    created_at        timestamp(3) not null   -- when the job was uploaded (UTC)
+                        DEFAULT CURRENT_TIMESTAMP(3),
+    started_at        timestamp(3) null,      -- when processing started
+    finished_at       timestamp(3) null,      -- when the job completed or failed
+    updated_at        timestamp(3) not null   -- last change to this row (UTC)
+                        DEFAULT CURRENT_TIMESTAMP(3) ON UPDATE CURRENT_TIMESTAMP(3),
     PRIMARY KEY (jobid),
     FOREIGN KEY (userid) REFERENCES users(userid),
-    UNIQUE      (datafilekey)
+    UNIQUE      (datafilekey),
+    INDEX       jobs_userid_updated (userid, updated_at),  -- /status?userid=...&since=...
+    --
+    -- /jobs filters, each paired with jobid for keyset pagination:
+    --
+    INDEX       jobs_userid_jobid (userid, jobid),
+    INDEX       jobs_status_jobid (status, jobid),
+    INDEX       jobs_jobtype_jobid (jobtype, jobid),
+    INDEX       jobs_created_at (created_at, jobid),
+    --
+    -- covers the queue-wait / run-time percentile queries in
+    -- proj03_stats (per jobtype or per user), so they never
+    -- read the table rows:
+    --
+    INDEX       jobs_finished_timing (finished_at, jobtype, created_at, started_at, userid, duplicate_events),
+    --
+    -- fair-share admission (scheduler.py): running and queued
+    -- jobs per user, and when each user last had a job start:
+    --
+    INDEX       jobs_userid_status (userid, status),
+    INDEX       jobs_userid_started (userid, started_at)
 );
 
 ALTER TABLE jobs AUTO_INCREMENT = 1001;  -- starting value
 
+--
+-- jobs moved here by the retention sweeper (proj03_sweeper)
+-- when its action is "archive":
+--
+CREATE TABLE jobs_archive LIKE jobs;
+
+--
+-- session tokens are signed and verified without the database
+-- (see authtoken.py); this table only lists revoked tokens,
+-- until they would have expired anyway:
+--
 CREATE TABLE tokens
 (
     token             varchar(128) not null,  -- authentication token
@@ -42,6 +93,122 @@ CREATE TABLE tokens
     FOREIGN KEY (userid) REFERENCES users(userid)
 );
 
+--
+-- Comprehend responses memoized per chunk of text, shared by
+-- every compute container (see comprehendcache.py); the
+-- retention sweeper trims it by last use and total size:
+--
+CREATE TABLE comprehend_cache
+(
+    hashkey           char(64) not null,      -- sha256 of api, language and normalized text
+    api               varchar(32) not null,   -- detect_entities, ...
+    bytes             int not null,           -- size of response
+    response          mediumtext not null,    -- the response, as JSON
+    created_at        timestamp(3) not null DEFAULT CURRENT_TIMESTAMP(3),
+    last_used_at      timestamp(3) not null DEFAULT CURRENT_TIMESTAMP(3),
+    PRIMARY KEY (hashkey),
+    INDEX       comprehend_cache_last_used (last_used_at)
+);
+
+--
+-- each user's Benford digit counts per day (DATE(finished_at), in
+-- the session time zone), summed over their completed benford jobs, so
+-- /digits never reads the jobs or their results. Maintained by
+-- the jobs_digit_counts trigger below, as part of the update
+-- that completes a job, and rebuilt from the jobs by
+-- proj03_reset:
+--
+CREATE TABLE digit_counts
+(
+    userid            int not null,
+    day               date not null,
+    jobs              int not null default 0,  -- jobs counted
+    d1                bigint not null default 0,
+    d2                bigint not null default 0,
+    d3                bigint not null default 0,
+    d4                bigint not null default 0,
+    d5                bigint not null default 0,
+    d6                bigint not null default 0,
+    d7                bigint not null default 0,
+    d8                bigint not null default 0,
+    d9                bigint not null default 0,
+    PRIMARY KEY (userid, day),
+    INDEX       digit_counts_day (day, userid),
+    FOREIGN KEY (userid) REFERENCES users(userid)
+);
+
+--
+-- the entities found by NER and PII analyses (entitystore.py),
+-- searched by proj03_entities. Each index ends in entityid, so
+-- a filter on its leading column(s) reads the matches already
+-- in entityid order, a page at a time (keyset pagination). No
+-- foreign key to jobs: archived jobs keep their entities.
+--
+CREATE TABLE entities
+(
+    entityid          bigint not null AUTO_INCREMENT,
+    jobid             int not null,
+    userid            int not null,
+    analysis          enum('ner', 'pii') not null,
+    type              varchar(32) not null,   -- ORGANIZATION, SSN, ...
+    text              varchar(255) null,      -- normalized (entitystore.normalize), null for PII
+    score             float not null,
+    page              int not null,           -- 1, 2, ...
+    begin_offset      int null,               -- within the page's text
+    end_offset        int null,
+    PRIMARY KEY (entityid),
+    INDEX       entities_text (text, entityid),
+    INDEX       entities_type (type, entityid),
+    INDEX       entities_jobid (jobid, entityid),
+    INDEX       entities_userid_type (userid, type, entityid)
+);
+
+--
+-- the text of each page of jobs' PDFs, as compute extracted it
+-- (textsearch.py), for /search (proj03_search). Like entities,
+-- archived jobs keep theirs.
+--
+CREATE TABLE page_texts
+(
+    jobid             int not null,
+    userid            int not null,
+    page              int not null,           -- 1, 2, ...
+    text              mediumtext not null,
+    PRIMARY KEY (jobid, page),
+    INDEX       page_texts_userid (userid),
+    FULLTEXT INDEX page_texts_text (text)
+);
+
+--
+-- adds a job's digits to its user's day when the job completes.
+-- A trigger runs in the completing update's transaction, so a
+-- job is counted exactly when it completes (and once, since a
+-- completed job never completes again).
+--
+-- NOTE: on RDS with binary logging, creating a trigger needs
+-- log_bin_trust_function_creators = 1 in the parameter group.
+--
+DELIMITER //
+
+CREATE TRIGGER jobs_digit_counts AFTER UPDATE ON jobs
+FOR EACH ROW
+BEGIN
+  IF NEW.status = 'completed' AND OLD.status <> 'completed' AND NEW.digits IS NOT NULL THEN
+    INSERT INTO digit_counts(userid, day, jobs, d1, d2, d3, d4, d5, d6, d7, d8, d9)
+         VALUES (NEW.userid, DATE(NEW.finished_at), 1,
+                 NEW.digits->>'$."1"', NEW.digits->>'$."2"', NEW.digits->>'$."3"',
+                 NEW.digits->>'$."4"', NEW.digits->>'$."5"', NEW.digits->>'$."6"',
+                 NEW.digits->>'$."7"', NEW.digits->>'$."8"', NEW.digits->>'$."9"')
+    ON DUPLICATE KEY UPDATE
+         jobs = jobs + 1,
+         d1 = d1 + VALUES(d1), d2 = d2 + VALUES(d2), d3 = d3 + VALUES(d3),
+         d4 = d4 + VALUES(d4), d5 = d5 + VALUES(d5), d6 = d6 + VALUES(d6),
+         d7 = d7 + VALUES(d7), d8 = d8 + VALUES(d8), d9 = d9 + VALUES(d9);
+  END IF;
+END //
+
+DELIMITER ;
+
 --
 -- Insert some users to start with:
 -- 
@@ -0,0 +1,1222 @@
+#
+# In-process emulator of the benford app backend, and a load
+# generator on top of it, so the pipeline can be load tested
+# without AWS.
+#
+# The real lambda functions (proj03_upload, proj03_compute and
+# proj03_download) run unchanged in this process, against:
+#
+#   S3:          an in-memory bucket. Uploading a .pdf fires a
+#                synthetic ObjectCreated event, which invokes
+#                proj03_compute asynchronously on a worker pool,
+#                the way the S3 trigger does.
+#   Comprehend:  a fake client returning canned sentiment and
+#                entities, after a configurable latency.
+#   RDS:         a SQLite database (the default), translating the
+#                few MySQL-isms the functions use. Or pass
+#                --rds-config to use a local MySQL server set up
+#                with database_creation.sql, via the real datatier.
+#
+# The fakes are installed as the boto3 (and datatier) modules
+# before the functions are imported, and the functions read a
+# generated benfordapp-config.ini in a scratch directory.
+#
+# The load generator uploads synthetic PDFs (see pdfgen.py) from
+# a number of concurrent clients, long-polls /results for each
+# job, and reports throughput and end-to-end latency (upload to
+# results) per jobtype:
+#
+#   python emulator.py --jobs 200 --clients 16 --compute-workers 8 \
+#     --mix benford=2,sentiment=1,ner=1,pii=1 --comprehend-latency 0.1
+#
+# Or, with --replay N, it checks compute is idempotent: each
+# job's S3 event is delivered N times at once, then once more
+# (and as a hand-off) after the job finished, and every job must
+# be processed exactly once, the other deliveries counted in its
+# duplicate_events (see scheduler.py):
+#
+#   python emulator.py --replay 8 --jobs 6 --mix benford+ner
+#
+# replay_test.py runs the same check as a test (pytest, or
+# python replay_test.py), failing on a job processed twice.
+#
+
+import argparse
+import base64
+import configparser
+import hashlib
+import importlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.parse
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+
+import authtoken
+import pdfgen
+import tabular
+
+BUCKET_NAME = "benfordapp-emulator"
+
+#
+# tokens are optional, except for the functions that read
+# across jobs (see authtoken.require), which get one from
+# Emulator.authorization:
+#
+AUTH_SECRET = "benfordapp-emulator-secret"
+
+USERS = [(80001, "p_sarkar"), (80002, "e_ricci"), (80003, "l_chen")]
+
+#
+# Comprehend's request size limits (UTF-8 bytes), enforced so
+# jobs that would fail in AWS fail here too:
+#
+COMPREHEND_LIMITS = {
+  "detect_sentiment": 5000,
+  "detect_entities": 100000,
+  "detect_pii_entities": 100000,
+}
+
+SQLITE_SCHEMA = """
+  CREATE TABLE users
+  (
+      userid       INTEGER PRIMARY KEY AUTOINCREMENT,
+      username     TEXT NOT NULL UNIQUE,
+      pwdhash      TEXT NOT NULL
+  );
+
+  CREATE TABLE jobs
+  (
+      jobid             INTEGER PRIMARY KEY AUTOINCREMENT,
+      userid            INTEGER NOT NULL REFERENCES users(userid),
+      status            TEXT NOT NULL
+                          CHECK (status IN ('uploaded', 'queued', 'processing', 'completed', 'error')),
+      claimid           TEXT NULL,
+      duplicate_events  INTEGER NOT NULL DEFAULT 0,
+      pages_done        INTEGER NOT NULL DEFAULT 0,
+      pages_total       INTEGER NOT NULL DEFAULT 0,
+      digits            TEXT NULL,
+      jobtype           TEXT NOT NULL,
+      analyses          TEXT NULL,
+      comprehend_report TEXT NULL,
+      originaldatafile  TEXT NOT NULL,
+      input_columns     TEXT NULL,
+      datafilekey       TEXT NOT NULL UNIQUE,
+      resultsfilekey    TEXT NOT NULL,
+      resultsetag       TEXT NULL,
+      created_at        TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+      started_at        TEXT NULL,
+      finished_at       TEXT NULL,
+      updated_at        TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+  );
+
+  CREATE INDEX jobs_userid_status ON jobs(userid, status);
+  CREATE INDEX jobs_userid_started ON jobs(userid, started_at);
+
+  CREATE TRIGGER jobs_updated_at AFTER UPDATE ON jobs
+  BEGIN
+    UPDATE jobs SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+     WHERE jobid = NEW.jobid;
+  END;
+
+  CREATE TABLE entities
+  (
+      entityid          INTEGER PRIMARY KEY AUTOINCREMENT,
+      jobid             INTEGER NOT NULL,
+      userid            INTEGER NOT NULL,
+      analysis          TEXT NOT NULL CHECK (analysis IN ('ner', 'pii')),
+      type              TEXT NOT NULL,
+      text              TEXT NULL,
+      score             REAL NOT NULL,
+      page              INTEGER NOT NULL,
+      begin_offset      INTEGER NULL,
+      end_offset        INTEGER NULL
+  );
+
+  CREATE INDEX entities_text ON entities(text, entityid);
+  CREATE INDEX entities_type ON entities(type, entityid);
+  CREATE INDEX entities_jobid ON entities(jobid, entityid);
+  CREATE INDEX entities_userid_type ON entities(userid, type, entityid);
+
+  CREATE VIRTUAL TABLE page_texts USING fts5(text, jobid UNINDEXED, userid UNINDEXED, page UNINDEXED);
+
+  CREATE TABLE digit_counts
+  (
+      userid            INTEGER NOT NULL REFERENCES users(userid),
+      day               TEXT NOT NULL,
+      jobs              INTEGER NOT NULL DEFAULT 0,
+      d1                INTEGER NOT NULL DEFAULT 0,
+      d2                INTEGER NOT NULL DEFAULT 0,
+      d3                INTEGER NOT NULL DEFAULT 0,
+      d4                INTEGER NOT NULL DEFAULT 0,
+      d5                INTEGER NOT NULL DEFAULT 0,
+      d6                INTEGER NOT NULL DEFAULT 0,
+      d7                INTEGER NOT NULL DEFAULT 0,
+      d8                INTEGER NOT NULL DEFAULT 0,
+      d9                INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (userid, day)
+  );
+
+  CREATE INDEX digit_counts_day ON digit_counts(day, userid);
+
+  CREATE TRIGGER jobs_digit_counts AFTER UPDATE OF status ON jobs
+  WHEN NEW.status = 'completed' AND OLD.status <> 'completed' AND NEW.digits IS NOT NULL
+  BEGIN
+    INSERT INTO digit_counts(userid, day, jobs, d1, d2, d3, d4, d5, d6, d7, d8, d9)
+         VALUES (NEW.userid, date(NEW.finished_at), 1,
+                 json_extract(NEW.digits, '$."1"'), json_extract(NEW.digits, '$."2"'),
+                 json_extract(NEW.digits, '$."3"'), json_extract(NEW.digits, '$."4"'),
+                 json_extract(NEW.digits, '$."5"'), json_extract(NEW.digits, '$."6"'),
+                 json_extract(NEW.digits, '$."7"'), json_extract(NEW.digits, '$."8"'),
+                 json_extract(NEW.digits, '$."9"'))
+    ON CONFLICT(userid, day) DO UPDATE SET
+         jobs = jobs + 1,
+         d1 = d1 + excluded.d1, d2 = d2 + excluded.d2, d3 = d3 + excluded.d3,
+         d4 = d4 + excluded.d4, d5 = d5 + excluded.d5, d6 = d6 + excluded.d6,
+         d7 = d7 + excluded.d7, d8 = d8 + excluded.d8, d9 = d9 + excluded.d9;
+  END;
+
+  CREATE TABLE comprehend_cache
+  (
+      hashkey           TEXT PRIMARY KEY,
+      api               TEXT NOT NULL,
+      bytes             INTEGER NOT NULL,
+      response          TEXT NOT NULL,
+      created_at        TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')),
+      last_used_at      TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+  );
+
+  CREATE TABLE tokens
+  (
+      token             TEXT PRIMARY KEY,
+      userid            INTEGER NOT NULL REFERENCES users(userid),
+      expiration_utc    TEXT NOT NULL
+  );
+
+  INSERT INTO sqlite_sequence(name, seq) VALUES('users', 80000);
+  INSERT INTO sqlite_sequence(name, seq) VALUES('jobs', 1000);
+"""
+
+
+############################################################
+#
+# S3
+#
+class FakeBucket:
+
+  def __init__(self, s3, name):
+    self.s3 = s3
+    self.name = name
+
+  def upload_file(self, filename, key, ExtraArgs=None):
+    infile = open(filename, "rb")
+    data = infile.read()
+    infile.close()
+
+    self.s3.put(self.name, key, data)
+
+  def put_object(self, Key, Body, **kwargs):
+    self.s3.put(self.name, Key, Body)
+
+  def download_file(self, key, filename):
+    data = self.s3.get(self.name, key)
+
+    outfile = open(filename, "wb")
+    outfile.write(data)
+    outfile.close()
+
+
+class FakeS3:
+  """
+  In-memory object store. on_created(bucket, key, size) is
+  called after every put, like an S3 event notification.
+  """
+
+  def __init__(self):
+    self.objects = {}
+    self.lock = threading.Lock()
+    self.on_created = None
+
+  def put(self, bucket, key, data):
+    with self.lock:
+      self.objects[(bucket, key)] = data
+
+    if self.on_created is not None:
+      self.on_created(bucket, key, len(data))
+
+  def get(self, bucket, key):
+    with self.lock:
+      if (bucket, key) not in self.objects:
+        raise Exception("An error occurred (404) when calling the HeadObject operation: Not Found")
+      return self.objects[(bucket, key)]
+
+  def Bucket(self, name):
+    return FakeBucket(self, name)
+
+
+class FakeS3Client:
+  """
+  The S3 client, for the calls proj03_export makes: reading
+  objects, multipart uploads (with S3's minimum part size), and
+  presigned URLs, which here are only names for the object.
+  """
+
+  MIN_PART_BYTES = 5 * 1024 * 1024
+
+  class NoSuchKey(Exception):
+    pass
+
+  def __init__(self, s3):
+    self.s3 = s3
+    self.uploads = {}
+    self.lock = threading.Lock()
+    self.exceptions = types.SimpleNamespace(NoSuchKey=FakeS3Client.NoSuchKey)
+
+  def get_object(self, Bucket, Key):
+    with self.s3.lock:
+      if (Bucket, Key) not in self.s3.objects:
+        raise FakeS3Client.NoSuchKey("An error occurred (NoSuchKey) when calling the GetObject operation")
+      data = self.s3.objects[(Bucket, Key)]
+    return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+  def create_multipart_upload(self, Bucket, Key, **kwargs):
+    upload_id = str(uuid.uuid4())
+    with self.lock:
+      self.uploads[upload_id] = {}
+    return {"UploadId": upload_id}
+
+  def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+    with self.lock:
+      self.uploads[UploadId][PartNumber] = bytes(Body)
+    return {"ETag": '"' + hashlib.md5(Body).hexdigest() + '"'}
+
+  def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+    with self.lock:
+      parts = self.uploads.pop(UploadId)
+
+    numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+    if numbers != sorted(parts):
+      raise Exception("An error occurred (InvalidPart) when calling the CompleteMultipartUpload operation")
+    for number in numbers[0:-1]:
+      if len(parts[number]) < FakeS3Client.MIN_PART_BYTES:
+        raise Exception("An error occurred (EntityTooSmall) when calling the CompleteMultipartUpload operation")
+
+    self.s3.put(Bucket, Key, b"".join(parts[number] for number in numbers))
+    return {"Bucket": Bucket, "Key": Key}
+
+  def abort_multipart_upload(self, Bucket, Key, UploadId):
+    with self.lock:
+      self.uploads.pop(UploadId, None)
+
+  def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+    return "https://" + Params["Bucket"] + ".s3.amazonaws.com/" + \
+           urllib.parse.quote(Params["Key"]) + "?X-Amz-Expires=" + str(ExpiresIn)
+
+
+############################################################
+#
+# Comprehend
+#
+class FakeComprehend:
+  """
+  Answers detect_sentiment, detect_entities and
+  detect_pii_entities deterministically from the text, after
+  sleeping latency +/- jitter seconds. Counts calls and billed
+  units (100 characters, minimum 3) per operation.
+  """
+
+  def __init__(self, latency=0.05, jitter=0.0, seed=0):
+    self.latency = latency
+    self.jitter = jitter
+    self.rng = random.Random(seed)
+    self.lock = threading.Lock()
+    self.calls = {}
+    self.units = {}
+
+  def call(self, operation, text):
+    size = len(text.encode("utf-8"))
+    if size > COMPREHEND_LIMITS[operation]:
+      raise Exception("An error occurred (TextSizeLimitExceededException) when calling the " +
+                      operation + " operation: input text size " + str(size) +
+                      " exceeds limit " + str(COMPREHEND_LIMITS[operation]))
+
+    with self.lock:
+      self.calls[operation] = self.calls.get(operation, 0) + 1
+      self.units[operation] = self.units.get(operation, 0) + max(3, (len(text) + 99) // 100)
+      delay = self.latency + self.rng.uniform(-self.jitter, self.jitter)
+
+    time.sleep(max(0.0, delay))
+
+  def detect_sentiment(self, Text, LanguageCode):
+    self.call("detect_sentiment", Text)
+
+    digest = hashlib.md5(Text.encode()).digest()
+    weights = [digest[i] + 1 for i in range(4)]
+    total = sum(weights)
+    scores = {
+      "Positive": weights[0] / total,
+      "Negative": weights[1] / total,
+      "Neutral": weights[2] / total,
+      "Mixed": weights[3] / total,
+    }
+    sentiment = max(scores, key=scores.get).upper()
+
+    return {"Sentiment": sentiment, "SentimentScore": scores}
+
+  def detect_entities(self, Text, LanguageCode):
+    self.call("detect_entities", Text)
+
+    entities = []
+    for match in re.finditer(r"\b[A-Z][a-z]+(?: [A-Z][a-z]+)*\b|\b\d+\b", Text):
+      word = match.group(0)
+      if word.isnumeric():
+        kind = "QUANTITY"
+      else:
+        kind = ["PERSON", "ORGANIZATION", "LOCATION"][hashlib.md5(word.encode()).digest()[0] % 3]
+      entities.append({"Type": kind, "Text": word, "Score": 0.99,
+                       "BeginOffset": match.start(), "EndOffset": match.end()})
+
+    return {"Entities": entities}
+
+  def detect_pii_entities(self, Text, LanguageCode):
+    self.call("detect_pii_entities", Text)
+
+    entities = []
+    for (kind, pattern) in [("EMAIL", r"\b[\w.]+@[\w.]+\.\w+\b"),
+                            ("PHONE", r"\(\d{3}\) \d{3}-\d{4}")]:
+      for match in re.finditer(pattern, Text):
+        entities.append({"Type": kind, "Score": 0.99,
+                         "BeginOffset": match.start(), "EndOffset": match.end()})
+
+    return {"Entities": entities}
+
+
+class FakeLambda:
+  """
+  The lambda client, for the async self-invokes proj03_compute
+  makes when it hands a queued job off (see scheduler.py).
+  """
+
+  def __init__(self, emulator):
+    self.emulator = emulator
+
+  def invoke(self, FunctionName, InvocationType, Payload):
+    if InvocationType != "Event":
+      raise Exception("emulator only invokes asynchronously")
+    self.emulator.submit(FunctionName, json.loads(Payload))
+    return {"StatusCode": 202}
+
+
+def make_boto3(s3, comprehend, lambda_client=None):
+  """
+  Returns a module standing in for boto3, with the calls the
+  lambda functions make.
+  """
+  module = types.ModuleType("boto3")
+
+  def setup_default_session(**kwargs):
+    pass
+
+  def resource(service_name, **kwargs):
+    if service_name != "s3":
+      raise Exception("emulator has no " + service_name + " resource")
+    return s3
+
+  def client(service_name=None, **kwargs):
+    if service_name == "comprehend":
+      return comprehend
+    if service_name == "s3":
+      return FakeS3Client(s3)
+    if service_name == "lambda" and lambda_client is not None:
+      return lambda_client
+    raise Exception("emulator has no " + str(service_name) + " client")
+
+  class Session:
+    def __init__(self, **kwargs):
+      pass
+
+    def resource(self, service_name, **kwargs):
+      return resource(service_name, **kwargs)
+
+    def client(self, service_name=None, **kwargs):
+      return client(service_name, **kwargs)
+
+  module.setup_default_session = setup_default_session
+  module.resource = resource
+  module.client = client
+  module.Session = Session
+
+  return module
+
+
+############################################################
+#
+# RDS, as SQLite
+#
+def translate(sql):
+  """
+  Rewrites the MySQL the lambda functions use into SQLite.
+  """
+  sql = sql.replace("%s", "?")
+  sql = re.sub(r"NOW\(3\)\s*-\s*INTERVAL\s+\?\s+(SECOND|DAY)",
+               lambda m: "strftime('%Y-%m-%d %H:%M:%f', 'now', '-' || ? || ' " + m.group(1).lower() + "s')",
+               sql, flags=re.IGNORECASE)
+  sql = re.sub(r"NOW\(3\)", "strftime('%Y-%m-%d %H:%M:%f', 'now')", sql, flags=re.IGNORECASE)
+  sql = re.sub(r"UTC_TIMESTAMP\(\)", "datetime('now')", sql, flags=re.IGNORECASE)
+  sql = re.sub(r"LAST_INSERT_ID\(\)", "last_insert_rowid()", sql, flags=re.IGNORECASE)
+  sql = re.sub(r"FROM_UNIXTIME\(\?\)", "datetime(?, 'unixepoch')", sql, flags=re.IGNORECASE)
+  sql = re.sub(r"INSERT\s+IGNORE", "INSERT OR IGNORE", sql, flags=re.IGNORECASE)
+
+  #
+  # SQLite has no row locks or isolation levels; instead a
+  # locking read starts a write transaction (see make_datatier),
+  # which serializes the scheduler's claims:
+  #
+  sql = re.sub(r"FOR\s+UPDATE(\s+OF\s+\w+)?(\s+SKIP\s+LOCKED)?", "", sql, flags=re.IGNORECASE)
+  sql = re.sub(r"^\s*SET\s+SESSION\s+TRANSACTION\b.*$", "SELECT 1;", sql, flags=re.IGNORECASE)
+  return sql
+
+
+FULLTEXT_MATCH = re.compile(r"MATCH\((\w+)\)\s+AGAINST\s*\(\?\s+IN\s+NATURAL\s+LANGUAGE\s+MODE\)(\s+AS\s+\w+)?",
+                            flags=re.IGNORECASE)
+
+
+def fts_query(text):
+  """
+  "acme corp" => '"acme" OR "corp"', matching any of the words
+  like MySQL's natural language mode does.
+  """
+  words = re.findall(r"\w+", text)
+  if len(words) == 0:
+    return '""'
+  return " OR ".join('"' + word + '"' for word in words)
+
+
+def fulltext(sql, parameters):
+  """
+  Rewrites MySQL's MATCH(col) AGAINST(? IN NATURAL LANGUAGE
+  MODE) for an FTS5 table: in the WHERE clause as "table MATCH
+  ?", and as a relevance score ("... AS score") as bm25, which
+  takes no parameter. Returns (sql, parameters).
+  """
+  matches = list(FULLTEXT_MATCH.finditer(sql))
+  if len(matches) == 0:
+    return (sql, parameters)
+
+  table = re.search(r"FROM\s+(\w+)", sql, flags=re.IGNORECASE).group(1)
+  parameters = list(parameters)
+
+  #
+  # right to left, so the offsets and parameter positions of
+  # the matches still to do don't move:
+  #
+  for m in reversed(matches):
+    index = sql[0:m.start()].count("?")
+    if m.group(2) is not None:
+      replacement = "-bm25(" + table + ")" + m.group(2)
+      del parameters[index]
+    else:
+      replacement = table + " MATCH ?"
+      parameters[index] = fts_query(parameters[index])
+    sql = sql[0:m.start()] + replacement + sql[m.end():]
+
+  return (sql, parameters)
+
+
+def locking(dbConn, sql):
+  """
+  A SELECT ... FOR UPDATE outside a transaction begins one that
+  holds the database's write lock until commit.
+  """
+  if re.search(r"FOR\s+UPDATE", sql, flags=re.IGNORECASE) and not dbConn.in_transaction:
+    dbConn.execute("BEGIN IMMEDIATE;")
+
+
+def make_datatier(database):
+  """
+  Returns a module standing in for datatier, with the same
+  functions, backed by the SQLite database file.
+  """
+  module = types.ModuleType("datatier")
+
+  def get_dbConn(endpoint, portnum, username, pwd, dbname):
+    dbConn = sqlite3.connect(database, timeout=30.0, check_same_thread=False)
+    dbConn.execute("PRAGMA busy_timeout = 30000;")
+    return dbConn
+
+  def retrieve_one_row(dbConn, sql, parameters=[]):
+    locking(dbConn, sql)
+    dbCursor = dbConn.cursor()
+    try:
+      dbCursor.execute(*fulltext(translate(sql), parameters))
+      row = dbCursor.fetchone()
+      return () if row is None else row
+    except Exception:
+      dbConn.rollback()
+      raise
+    finally:
+      dbCursor.close()
+
+  def retrieve_all_rows(dbConn, sql, parameters=[]):
+    locking(dbConn, sql)
+    dbCursor = dbConn.cursor()
+    try:
+      dbCursor.execute(*fulltext(translate(sql), parameters))
+      return dbCursor.fetchall()
+    except Exception:
+      dbConn.rollback()
+      raise
+    finally:
+      dbCursor.close()
+
+  def perform_action(dbConn, sql, parameters=[]):
+    dbCursor = dbConn.cursor()
+    try:
+      dbCursor.execute(translate(sql), parameters)
+      dbConn.commit()
+      return dbCursor.rowcount
+    except Exception:
+      dbConn.rollback()
+      raise
+    finally:
+      dbCursor.close()
+
+  module.get_dbConn = get_dbConn
+  module.retrieve_one_row = retrieve_one_row
+  module.retrieve_all_rows = retrieve_all_rows
+  module.perform_action = perform_action
+
+  return module
+
+
+def create_sqlite_database(database):
+  dbConn = sqlite3.connect(database)
+  dbConn.execute("PRAGMA journal_mode = WAL;")
+  dbConn.executescript(SQLITE_SCHEMA)
+  for (userid, username) in USERS:
+    dbConn.execute("INSERT INTO users(userid, username, pwdhash) VALUES(?, ?, '');",
+                   [userid, username])
+  dbConn.commit()
+  dbConn.close()
+
+
+############################################################
+#
+# lambda invocation
+#
+class FakeContext:
+
+  def __init__(self, function_name, timeout_secs):
+    self.function_name = function_name
+    self.aws_request_id = str(uuid.uuid4())
+    self.deadline = time.monotonic() + timeout_secs
+
+  def get_remaining_time_in_millis(self):
+    return int(max(0.0, self.deadline - time.monotonic()) * 1000)
+
+
+class HandlerOutput(io.TextIOBase):
+  """
+  Replaces sys.stdout: drops what the lambda functions print
+  (their CloudWatch log), unless verbose, and passes everything
+  else through. Only the main thread prints anything else, so
+  output from other threads (e.g. threads a function starts
+  itself) counts as the functions'.
+  """
+
+  def __init__(self, stream, verbose):
+    self.stream = stream
+    self.verbose = verbose
+    self.local = threading.local()
+
+  def write(self, text):
+    in_handler = getattr(self.local, "in_handler", False) or \
+                 threading.current_thread() is not threading.main_thread()
+    if in_handler and not self.verbose:
+      return len(text)
+    return self.stream.write(text)
+
+  def flush(self):
+    self.stream.flush()
+
+
+class Emulator:
+
+  def __init__(self, comprehend_latency=0.05, comprehend_jitter=0.0, compute_workers=8,
+               rds_config=None, verbose=False, seed=0, max_running=None, max_running_per_user=None,
+               comprehend_cache=True):
+    """
+    Parameters
+    ----------
+    comprehend_latency: seconds each fake Comprehend call takes
+    comprehend_jitter: +/- seconds of random variation on that
+    compute_workers: how many proj03_compute invocations can run
+      at once (the lambda's concurrency)
+    rds_config: config file with an [rds] section for a local
+      MySQL server; None to use SQLite
+    verbose: show what the lambda functions print
+    max_running, max_running_per_user: the [scheduler] limits
+      (0 = no limit), None for scheduler.py's defaults
+    comprehend_cache: memoize Comprehend calls (see
+      comprehendcache.py)
+    """
+    self.workdir = tempfile.mkdtemp(prefix="benfordapp-emulator-")
+    self.s3 = FakeS3()
+    self.comprehend = FakeComprehend(comprehend_latency, comprehend_jitter, seed)
+    self.executor = ThreadPoolExecutor(max_workers=compute_workers)
+    self.pending = set()
+    self.pending_lock = threading.Lock()
+    self.output = HandlerOutput(sys.stdout, verbose)
+    self.handlers = {}
+    self.saved = {}
+    self.cwd = None
+
+    self.s3.on_created = self.dispatch
+
+    #
+    # config file the functions read from their working directory:
+    #
+    config = configparser.ConfigParser()
+    config["s3"] = {"bucket_name": BUCKET_NAME}
+
+    config["scheduler"] = {}
+    if max_running is not None:
+      config["scheduler"]["max_running"] = str(max_running)
+    if max_running_per_user is not None:
+      config["scheduler"]["max_running_per_user"] = str(max_running_per_user)
+
+    config["comprehend_cache"] = {"enabled": "true" if comprehend_cache else "false"}
+
+    config["auth"] = {"secret": AUTH_SECRET, "required": "false"}
+
+    if rds_config is None:
+      self.database = os.path.join(self.workdir, "benfordapp.db")
+      create_sqlite_database(self.database)
+      config["rds"] = {"endpoint": "sqlite", "port_number": "0", "user_name": "",
+                       "user_pwd": "", "db_name": self.database}
+      self.datatier = make_datatier(self.database)
+    else:
+      real = configparser.ConfigParser()
+      real.read(rds_config)
+      config["rds"] = dict(real["rds"])
+      self.datatier = None  # the real one
+
+    outfile = open(os.path.join(self.workdir, "benfordapp-config.ini"), "w")
+    config.write(outfile)
+    outfile.close()
+
+  def start(self):
+    """
+    Installs the fakes and imports the lambda functions.
+    """
+    fakes = {"boto3": make_boto3(self.s3, self.comprehend, FakeLambda(self))}
+    if self.datatier is not None:
+      fakes["datatier"] = self.datatier
+
+    #
+    # scheduler.py and comprehendcache.py import datatier too,
+    # so they're re-imported along with the functions:
+    #
+    shared = ["scheduler", "comprehendcache", "entitystore", "textsearch"]
+    functions = ["proj03_upload", "proj03_compute", "proj03_download", "proj03_digits",
+                 "proj03_entities", "proj03_search", "proj03_export", "proj03_claimer"]
+    for name in list(fakes) + shared + functions:
+      self.saved[name] = sys.modules.get(name)
+
+    sys.modules.update(fakes)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    for name in shared:
+      sys.modules.pop(name, None)
+    for name in functions:
+      sys.modules.pop(name, None)
+      self.handlers[name] = importlib.import_module(name)
+
+    self.cwd = os.getcwd()
+    os.chdir(self.workdir)
+    sys.stdout = self.output
+
+    return self
+
+  def stop(self):
+    """
+    Waits for outstanding compute invocations, then undoes start().
+    """
+    self.drain()
+    self.executor.shutdown()
+
+    sys.stdout = self.output.stream
+    if self.cwd is not None:
+      os.chdir(self.cwd)
+
+    for (name, module) in self.saved.items():
+      if module is None:
+        sys.modules.pop(name, None)
+      else:
+        sys.modules[name] = module
+
+    shutil.rmtree(self.workdir, ignore_errors=True)
+
+  def __enter__(self):
+    return self.start()
+
+  def __exit__(self, *exc):
+    self.stop()
+
+  def invoke(self, name, event, timeout_secs=30):
+    """
+    Calls a lambda function's handler with the given event, and
+    returns its response.
+    """
+    self.output.local.in_handler = True
+    try:
+      return self.handlers[name].lambda_handler(event, FakeContext(name, timeout_secs))
+    finally:
+      self.output.local.in_handler = False
+
+  def dispatch(self, bucket, key, size):
+    """
+    The S3 trigger: a new .pdf, .csv or .xlsx invokes
+    proj03_compute, async.
+    """
+    if os.path.splitext(key)[1] not in [".pdf"] + tabular.EXTENSIONS:
+      return
+
+    self.submit("proj03_compute", s3_event(bucket, key, size))
+
+  def submit(self, name, event):
+    """
+    Invokes a lambda function asynchronously, on the worker pool.
+    """
+    future = self.executor.submit(self.invoke, name, event, 900)
+
+    with self.pending_lock:
+      self.pending.add(future)
+    future.add_done_callback(self.finished)
+
+  def finished(self, future):
+    with self.pending_lock:
+      self.pending.discard(future)
+
+  def drain(self):
+    """
+    Waits until no compute invocations are queued or running.
+    """
+    while True:
+      with self.pending_lock:
+        futures = list(self.pending)
+      if len(futures) == 0:
+        return
+      for future in futures:
+        future.result()
+
+  ##########################################################
+  #
+  # API Gateway calls
+  #
+  def upload(self, userid, jobtype, filename, data, columns=None):
+    """
+    POST /pdf/<userid>/<jobtype> with a binary body. Returns
+    the response.
+    """
+    content_type = tabular.CONTENT_TYPES.get(os.path.splitext(filename)[1], "application/pdf")
+
+    params = {"filename": filename}
+    if columns is not None:
+      params["columns"] = ",".join(columns)
+
+    event = {
+      "pathParameters": {"userid": str(userid), "jobtype": jobtype},
+      "queryStringParameters": params,
+      "headers": {"Content-Type": content_type},
+      "body": base64.b64encode(data).decode(),
+      "isBase64Encoded": True
+    }
+    return self.invoke("proj03_upload", event)
+
+  def results(self, jobid, wait=0):
+    """
+    GET /results/<jobid>?wait=N asking for raw results. Returns
+    the response.
+    """
+    event = {
+      "pathParameters": {"jobid": str(jobid)},
+      "queryStringParameters": {"wait": str(wait)},
+      "headers": {"Accept": "text/plain"}
+    }
+    return self.invoke("proj03_download", event)
+
+  def authorization(self, userid):
+    """
+    The Authorization header of a request logged in as userid.
+    """
+    (token, expiry) = authtoken.issue(userid, AUTH_SECRET)
+    return {"Authorization": "Bearer " + token}
+
+  def entities(self, userid, params):
+    """
+    GET /entities with the given query parameters, as userid.
+    Returns the response.
+    """
+    event = {
+      "queryStringParameters": {name: str(value) for (name, value) in params.items()},
+      "headers": self.authorization(userid)
+    }
+    return self.invoke("proj03_entities", event)
+
+  def search(self, userid, params):
+    """
+    GET /search with the given query parameters, as userid.
+    Returns the response.
+    """
+    event = {
+      "queryStringParameters": {name: str(value) for (name, value) in params.items()},
+      "headers": self.authorization(userid)
+    }
+    return self.invoke("proj03_search", event)
+
+  def export(self, userid, params):
+    """
+    GET /export with the given query parameters, as userid.
+    Returns the response.
+    """
+    event = {
+      "queryStringParameters": {name: str(value) for (name, value) in params.items()},
+      "headers": self.authorization(userid)
+    }
+    return self.invoke("proj03_export", event)
+
+  def download(self, url):
+    """
+    The object a presigned URL from the fake S3 client names.
+    """
+    parsed = urllib.parse.urlparse(url)
+    return self.s3.get(parsed.netloc.split(".")[0], urllib.parse.unquote(parsed.path[1:]))
+
+  def queue_waits(self):
+    """
+    {userid: [secs from upload to start, per started job]}, from
+    the SQLite database; None when using MySQL.
+    """
+    if self.datatier is None:
+      return None
+
+    dbConn = sqlite3.connect(self.database, timeout=30.0)
+    rows = dbConn.execute("""
+      SELECT userid, (julianday(started_at) - julianday(created_at)) * 86400.0
+        FROM jobs
+       WHERE started_at IS NOT NULL;
+    """).fetchall()
+    dbConn.close()
+
+    waits = {}
+    for (userid, secs) in rows:
+      waits.setdefault(userid, []).append(max(0.0, secs))
+    return waits
+
+  def duplicate_events(self):
+    """
+    {jobid: (status, duplicate_events)}, from the SQLite database;
+    None when using MySQL.
+    """
+    if self.datatier is None:
+      return None
+
+    dbConn = sqlite3.connect(self.database, timeout=30.0)
+    rows = dbConn.execute("SELECT jobid, status, duplicate_events FROM jobs;").fetchall()
+    dbConn.close()
+
+    return {jobid: (status, n) for (jobid, status, n) in rows}
+
+
+def s3_event(bucket, key, size):
+  """
+  The ObjectCreated event S3 sends for a new object.
+  """
+  return {
+    "Records": [{
+      "eventSource": "aws:s3",
+      "eventName": "ObjectCreated:Put",
+      "s3": {
+        "bucket": {"name": bucket},
+        "object": {"key": urllib.parse.quote_plus(key), "size": size}
+      }
+    }]
+  }
+
+
+############################################################
+#
+# load generator
+#
+def parse_mix(mix):
+  """
+  "benford=2,ner=1" => [("benford", 2.0), ("ner", 1.0)]
+
+  A multi-analysis job type joins its analyses with +, e.g.
+  "benford+ner+pii=1" => [("benford,ner,pii", 1.0)]
+  """
+  weights = []
+  for part in mix.split(","):
+    (jobtype, sep, weight) = part.partition("=")
+    weights.append((jobtype.strip().replace("+", ","), float(weight) if sep == "=" else 1.0))
+  return weights
+
+
+def percentile(samples, p):
+  samples = sorted(samples)
+  return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+def run_job(emu, userid, jobtype, filename, data, wait):
+  """
+  Uploads one PDF and long-polls until its results are ready.
+  Returns (ok, seconds from upload to results, message).
+  """
+  start = time.perf_counter()
+
+  res = emu.upload(userid, jobtype, filename, data)
+  if res["statusCode"] != 200:
+    return (False, time.perf_counter() - start, json.loads(res["body"]))
+
+  jobid = json.loads(res["body"])
+
+  while True:
+    res = emu.results(jobid, wait)
+    if res["statusCode"] == 200:
+      return (True, time.perf_counter() - start, None)
+
+    msg = json.loads(res["body"])
+    if not (msg.startswith("uploaded") or msg.startswith("queued") or msg.startswith("processing")):
+      return (False, time.perf_counter() - start, msg)
+
+
+def run_load(emu, jobs=100, clients=8, mix="benford", pages=5, documents=10, wait=5, seed=0,
+             skew=0.0):
+  """
+  Runs jobs uploads from the given number of concurrent clients,
+  each job of a type picked from mix, over a corpus of random
+  documents with the given number of pages. Jobs go round-robin
+  to the users, except that a skew fraction of them all come from
+  the first user (a bulk uploader).
+
+  Returns
+  -------
+  (elapsed secs, {jobtype: [(ok, latency secs, message), ...]})
+  """
+  rng = random.Random(seed)
+  weights = parse_mix(mix)
+
+  corpus = [pdfgen.random_pdf(rng, pages) for i in range(documents)]
+
+  work = []
+  for i in range(jobs):
+    jobtype = rng.choices([w[0] for w in weights], weights=[w[1] for w in weights])[0]
+    if rng.random() < skew:
+      userid = USERS[0][0]
+    else:
+      userid = USERS[i % len(USERS)][0]
+    work.append((userid, jobtype, "doc" + str(i) + ".pdf", corpus[i % len(corpus)]))
+
+  outcomes = {}
+  lock = threading.Lock()
+
+  def client(item):
+    (userid, jobtype, filename, data) = item
+    outcome = run_job(emu, userid, jobtype, filename, data, wait)
+    with lock:
+      outcomes.setdefault(jobtype, []).append(outcome)
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=clients) as pool:
+    list(pool.map(client, work))
+  elapsed = time.perf_counter() - start
+
+  return (elapsed, outcomes)
+
+
+def run_replay(emu, jobs=6, copies=8, mix="benford", pages=5, seed=0):
+  """
+  Uploads jobs documents with the S3 trigger held back, then
+  delivers each one's event copies times at once, as S3 may when
+  it repeats an event. Once they're done, delivers each event
+  again, and as a hand-off of a claimed job, as late duplicates.
+
+  Returns
+  -------
+  [(jobid, [compute response bodies, concurrent], [late bodies])]
+  """
+  rng = random.Random(seed)
+  weights = parse_mix(mix)
+
+  created = []
+  emu.s3.on_created = lambda bucket, key, size: created.append((bucket, key, size))
+
+  jobids = []
+  try:
+    for i in range(jobs):
+      jobtype = rng.choices([w[0] for w in weights], weights=[w[1] for w in weights])[0]
+      res = emu.upload(USERS[i % len(USERS)][0], jobtype, "replay" + str(i) + ".pdf",
+                       pdfgen.random_pdf(rng, pages))
+      if res["statusCode"] != 200:
+        raise Exception("upload failed: " + json.loads(res["body"]))
+      jobids.append(int(json.loads(res["body"])))
+  finally:
+    emu.s3.on_created = emu.dispatch
+
+  events = [s3_event(*args) for args in created if args[1].endswith(".pdf")]
+
+  def deliver(events, barrier):
+    def one(event):
+      if barrier is not None:
+        barrier.wait()
+      return json.loads(emu.invoke("proj03_compute", event, 900)["body"])
+
+    with ThreadPoolExecutor(max_workers=len(events)) as pool:
+      return list(pool.map(one, events))
+
+  concurrent = []
+  for event in events:
+    concurrent.append(deliver([event] * copies, threading.Barrier(copies)))
+  emu.drain()
+
+  late = []
+  for (jobid, event) in zip(jobids, events):
+    late.append(deliver([event, dict(event, claimed=jobid)], None))
+  emu.drain()
+
+  return list(zip(jobids, concurrent, late))
+
+
+def print_replay(replayed, duplicates):
+  """
+  Prints what each delivery of each job's event did. Returns
+  True if every job ran exactly once and counted the rest.
+  """
+  print("%-8s %-10s %8s %10s %6s %10s" % ("jobid", "status", "success", "duplicate", "other", "counted"))
+
+  ok = True
+  for (jobid, concurrent, late) in replayed:
+    bodies = concurrent + late
+    successes = sum(1 for body in bodies if body == "success")
+    ignored = sum(1 for body in bodies if body == "duplicate")
+    other = len(bodies) - successes - ignored
+
+    (status, counted) = duplicates[jobid] if duplicates is not None else ("-", ignored)
+
+    print("%-8s %-10s %8d %10d %6d %10s" % (jobid, status, successes, ignored, other, counted))
+
+    if successes != 1 or other != 0 or counted != ignored or status not in ["-", "completed"]:
+      ok = False
+
+  print("**PASSED**" if ok else "**FAILED**")
+  return ok
+
+
+def print_report(elapsed, outcomes, comprehend=None):
+  total = sum(len(o) for o in outcomes.values())
+
+  print("%-16s %6s %6s %8s %10s %10s" % ("jobtype", "jobs", "failed", "jobs/s", "p50 ms", "p99 ms"))
+
+  for jobtype in sorted(outcomes):
+    results = outcomes[jobtype]
+    latencies = [latency for (ok, latency, msg) in results if ok]
+    failed = len(results) - len(latencies)
+    if len(latencies) > 0:
+      p50 = "%10.1f" % (percentile(latencies, 0.50) * 1000.0)
+      p99 = "%10.1f" % (percentile(latencies, 0.99) * 1000.0)
+    else:
+      p50 = p99 = "%10s" % "-"
+    print("%-16s %6d %6d %8.2f %s %s" % (jobtype, len(results), failed, len(results) / elapsed, p50, p99))
+
+  print("total: %d jobs in %.2f secs, %.2f jobs/s" % (total, elapsed, total / elapsed))
+
+  for jobtype in sorted(outcomes):
+    for (ok, latency, msg) in outcomes[jobtype]:
+      if not ok:
+        print("first failure (" + jobtype + "):", msg)
+        break
+
+  if comprehend is not None and len(comprehend.calls) > 0:
+    print("comprehend calls:", comprehend.calls, "billed units:", comprehend.units)
+
+
+def print_queue_waits(waits):
+  print("%-10s %6s %14s %14s" % ("userid", "jobs", "p50 wait ms", "max wait ms"))
+  for userid in sorted(waits):
+    samples = waits[userid]
+    print("%-10s %6d %14.1f %14.1f" % (userid, len(samples), percentile(samples, 0.50) * 1000.0,
+                                       max(samples) * 1000.0))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Load test the benford app against local fakes.")
+  parser.add_argument("--jobs", type=int, default=100, help="jobs to run")
+  parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+  parser.add_argument("--mix", default="benford=2,sentiment=1,ner=1,pii=1",
+                      help="jobtype weights, e.g. benford=2,ner=1,benford+ner+pii=1")
+  parser.add_argument("--pages", type=int, default=5, help="pages per document")
+  parser.add_argument("--documents", type=int, default=10, help="distinct documents to upload")
+  parser.add_argument("--wait", type=float, default=5, help="long-poll wait per /results call")
+  parser.add_argument("--compute-workers", type=int, default=8, help="proj03_compute concurrency")
+  parser.add_argument("--comprehend-latency", type=float, default=0.05, help="secs per Comprehend call")
+  parser.add_argument("--comprehend-jitter", type=float, default=0.0, help="+/- secs on that")
+  parser.add_argument("--rds-config", default=None, help="use the local MySQL in this config's [rds]")
+  parser.add_argument("--skew", type=float, default=0.0,
+                      help="fraction of jobs that all come from one user, e.g. 0.7")
+  parser.add_argument("--max-running", type=int, default=None,
+                      help="[scheduler] max_running, 0 = no limit")
+  parser.add_argument("--max-running-per-user", type=int, default=None,
+                      help="[scheduler] max_running_per_user, 0 = no limit")
+  parser.add_argument("--no-comprehend-cache", action="store_true",
+                      help="call Comprehend for every chunk, see comprehendcache.py")
+  parser.add_argument("--replay", type=int, default=None, metavar="N",
+                      help="deliver each job's S3 event N times at once, and check it runs once")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--verbose", action="store_true", help="show the lambda functions' output")
+  parser.add_argument("--profile", action="store_true",
+                      help="profile every invocation (they then run one at a time), see profiling.py")
+  args = parser.parse_args()
+
+  if args.profile:
+    os.environ["BENFORDAPP_PROFILE"] = "1"
+
+  emu = Emulator(args.comprehend_latency, args.comprehend_jitter, args.compute_workers,
+                 args.rds_config, args.verbose, args.seed, args.max_running,
+                 args.max_running_per_user, not args.no_comprehend_cache)
+
+  if args.replay is not None:
+    with emu:
+      print("**Replaying each of", args.jobs, "jobs' events", args.replay, "times at once**")
+      replayed = run_replay(emu, args.jobs, args.replay, args.mix, args.pages, args.seed)
+      duplicates = emu.duplicate_events()
+
+    sys.exit(0 if print_replay(replayed, duplicates) else 1)
+
+  with emu:
+    print("**Running", args.jobs, "jobs from", args.clients, "clients,",
+          args.compute_workers, "compute workers**")
+    (elapsed, outcomes) = run_load(emu, args.jobs, args.clients, args.mix, args.pages,
+                                   args.documents, args.wait, args.seed, args.skew)
+    waits = emu.queue_waits()
+
+  print_report(elapsed, outcomes, emu.comprehend)
+
+  if waits is not None:
+    print()
+    print_queue_waits(waits)
+
+  profiles = [key for (bucket, key) in emu.s3.objects if "/profiles/" in key]
+  if len(profiles) > 0:
+    print("profiles saved:", len(profiles), "e.g.", sorted(profiles)[0])
@@ -0,0 +1,86 @@
+#
+# Stores the entities found by a job's NER and PII analyses in
+# the entities table, so they can be searched across jobs
+# (proj03_entities) instead of by reading every results file.
+# Like datatier.py, this file is deployed alongside the lambda
+# functions that need it.
+#
+# Each entity is a row: the job and its user, the analysis (ner
+# or pii), the entity type, its text normalized for lookup
+# (see normalize), the score, and where it was found: the page,
+# and the offsets Comprehend gave within that page's text.
+#
+# PII entities are stored without their text, as in the results
+# document: "which jobs contain an SSN" is a query on type, and
+# the table never holds the SSNs themselves.
+#
+# Offsets are always into this page's own text, even when the
+# response came from the cache for a page that differed in
+# whitespace (see comprehendcache.py).
+#
+
+import datatier
+
+#
+# entity rows per multi-row INSERT:
+#
+ROWS_PER_INSERT = 500
+
+#
+# the text column's length (varchar):
+#
+MAX_TEXT_CHARS = 255
+
+
+def normalize(text):
+  """
+  "  ACME   Corp. " => "acme corp.", the form entities are stored
+  and looked up in.
+  """
+  return " ".join(text.split()).casefold()[0:MAX_TEXT_CHARS]
+
+
+def entity_rows(jobid, userid, found):
+  """
+  The table's rows for found, {analysis: [(page index, entity)]}.
+  """
+  rows = []
+  for (analysis, paged) in sorted(found.items()):
+    for (page, entity) in paged:
+      text = None
+      if analysis != "pii" and "Text" in entity:
+        text = normalize(entity["Text"])
+
+      rows.append([jobid, userid, analysis, entity["Type"], text, float(entity["Score"]),
+                   page + 1, entity.get("BeginOffset"), entity.get("EndOffset")])
+  return rows
+
+
+def save(dbConn, jobid, userid, found):
+  """
+  Replaces the job's entities with found, {analysis: [(page
+  index, entity)]}, a batch of rows per INSERT. Returns the
+  number of rows stored.
+  """
+  #
+  # a job that's run again (e.g. a retried invocation) replaces
+  # what it stored before:
+  #
+  sql = "DELETE FROM entities WHERE jobid = %s;"
+  datatier.perform_action(dbConn, sql, [jobid])
+
+  rows = entity_rows(jobid, userid, found)
+
+  for i in range(0, len(rows), ROWS_PER_INSERT):
+    batch = rows[i:i + ROWS_PER_INSERT]
+
+    values = []
+    for row in batch:
+      values.extend(row)
+
+    sql = """
+      INSERT INTO entities(jobid, userid, analysis, type, text, score, page, begin_offset, end_offset)
+             VALUES """ + ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(batch)) + ";"
+    datatier.perform_action(dbConn, sql, values)
+
+  return len(rows)
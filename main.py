@@ -1,10 +1,32 @@
-5#
+#
 # Client-side python app for benford app, which is calling
 # a set of lambda functions in AWS through API Gateway.
 # The overall purpose of the app is to process a PDF and
 # see if the numeric values in the PDF adhere to Benford's
 # law.
 #
+# Run with no arguments for the interactive menu, or with a
+# command for scripting, e.g.
+#
+#   python main.py users
+#   python main.py jobs --userid 80001 --status completed
+#   python main.py upload report.pdf --userid 80001 --jobtype benford
+#   python main.py upload report.pdf --userid 80001 --jobtype benford,ner,pii
+#   python main.py upload ledger.csv --userid 80001 --columns Amount,Quantity
+#   python main.py download 1001 -o report.txt
+#   python main.py wait 1001
+#   python main.py search "acme corp"
+#   python main.py export --userid 80001 -o results.zip
+#   python main.py batch reports/ --userid 80001 --jobtype benford,ner
+#
+# The config file comes from --config, else the environment
+# variable BENFORDAPP_CONFIG, else client_config.ini. Only sys
+# and os are imported up front; everything else (requests,
+# asyncio, transport, logging, the batch and cache code) is
+# imported once a command needs it, so "python main.py --help"
+# runs in under 100 ms (checked by "python benchmark.py --only
+# cli").
+#
 # Authors:
 #   Rohit Katakam, Anitej Siluveru, Dhruv Saoji
 #
@@ -14,18 +36,8 @@
 #   CS 310
 #
 
-import requests
-import jsons
-
-import uuid
-import pathlib
-import logging
 import sys
 import os
-import base64
-import time
-
-from configparser import ConfigParser
 
 
 ############################################################
@@ -46,9 +58,124 @@ class Job:
     self.jobid = row[0]
     self.userid = row[1]
     self.status = row[2]
-    self.originaldatafile = row[3]
-    self.datafilekey = row[4]
-    self.resultsfilekey = row[5]
+    self.jobtype = row[3]
+    self.originaldatafile = row[4]
+    self.datafilekey = row[5]
+    self.resultsfilekey = row[6]
+    self.created_at = row[7]
+
+
+############################################################
+#
+# login
+#
+def login_prompt(client):
+  """
+  Prompts the user for their username and password, and logs
+  in. The session token is then attached to every request, and
+  renewed with the same credentials when it expires.
+
+  Parameters
+  ----------
+  client: ApiClient for the web service
+
+  Returns
+  -------
+  nothing
+  """
+  print("Enter username>")
+  username = input()
+
+  import getpass
+  password = getpass.getpass("Enter password> ")
+
+  try:
+    res = client.login(username, password)
+
+    if res.status_code != 200:
+      print("Login failed with status code:", res.status_code)
+      print("Error message:", res.json())
+      return
+
+    #
+    # remember the credentials so we can log in again when
+    # the token expires:
+    #
+    client.username = username
+    client.password = password
+
+    print("Logged in until", res.json()["expires"])
+    return
+
+  except Exception as e:
+    import logging
+    logging.error("login() failed:")
+    logging.error("url: " + client.baseurl + '/login')
+    logging.error(e)
+    return
+
+
+############################################################
+#
+# pagination
+#
+class RequestFailed(Exception):
+
+  def __init__(self, url, res):
+    super().__init__("request failed with status code " + str(res.status_code))
+    self.url = url
+    self.res = res
+
+
+def page_through(client, api, params=None, pagesize=100):
+  """
+  Generator over the rows of a paginated listing (/users or
+  /jobs). Pages are fetched lazily, only once the caller has
+  consumed the rows of the previous page.
+
+  Parameters
+  ----------
+  client: ApiClient for the web service
+  api: the listing, e.g. '/jobs'
+  params: filters to pass in the query string
+  pagesize: rows to ask for per request
+
+  Returns
+  -------
+  yields one row (a list) at a time; raises RequestFailed if
+  the web service returns an error
+  """
+  params = dict(params or {})
+  params["limit"] = pagesize
+
+  while True:
+    res = client.request("GET", api, params=params)
+
+    if res.status_code != 200:
+      raise RequestFailed(client.baseurl + api, res)
+
+    body = res.json()
+
+    for row in body["rows"]:
+      yield row
+
+    if body["next"] is None:
+      break
+
+    params["after"] = body["next"]
+
+
+def print_failure(err):
+  """
+  Prints out a RequestFailed error the way the other commands
+  report failures.
+  """
+  print("Failed with status code:", err.res.status_code)
+  print("url: " + err.url)
+  if err.res.status_code == 400:
+    # we'll have an error message
+    body = err.res.json()
+    print("Error message:", body)
 
 
 ############################################################
@@ -76,6 +203,11 @@ def prompt():
   print("   4 => upload pdf")
   print("   5 => download results")
   print("   6 => upload and poll")
+  print("   7 => status of jobs")
+  print("   8 => login")
+  print("   9 => batch upload a directory")
+  print("  10 => search the text of jobs")
+  print("  11 => export results as a zip")
 
   cmd = input()
 
@@ -93,161 +225,157 @@ def prompt():
 #
 # users
 #
-def users(baseurl):
+def users(client):
   """
   Prints out all the users in the database
 
   Parameters
   ----------
-  baseurl: baseurl for web service
+  client: ApiClient for the web service
 
   Returns
   -------
-  nothing
+  True on success, False if the web service call failed
   """
 
   try:
     #
-    # call the web service:
+    # call the web service, a page at a time:
     #
     api = '/users'
-    url = baseurl + api
-
-    res = requests.get(url)
-
-    #
-    # let's look at what we got back:
-    #
-    if res.status_code != 200:
-      # failed:
-      print("Failed with status code:", res.status_code)
-      print("url: " + url)
-      if res.status_code == 400:
-        # we'll have an error message
-        body = res.json()
-        print("Error message:", body)
-      #
-      return
+    url = client.baseurl + api
 
     #
-    # deserialize and extract users:
+    # let's map each row into a User object as it arrives:
     #
-    body = res.json()
-
-    #
-    # let's map each row into a User object:
-    #
-    users = []
-    for row in body:
+    count = 0
+    for row in page_through(client, api):
       user = User(row)
-      users.append(user)
-    #
-    # Now we can think OOP:
-    #
-    if len(users) == 0:
-      print("no users...")
-      return
+      count += 1
 
-    for user in users:
       print(user.userid)
       print(" ", user.username)
       print(" ", user.pwdhash)
+
+    if count == 0:
+      print("no users...")
     #
-    return
+    return True
+
+  except RequestFailed as err:
+    print_failure(err)
+    return False
 
   except Exception as e:
+    import logging
     logging.error("users() failed:")
     logging.error("url: " + url)
     logging.error(e)
-    return
+    return False
 
 
 ############################################################
 #
 # jobs
 #
-def jobs(baseurl):
+def jobs(client):
   """
-  Prints out all the jobs in the database
+  Prompts for optional filters and prints out the matching
+  jobs in the database, fetching them a page at a time.
 
   Parameters
   ----------
-  baseurl: baseurl for web service
+  client: ApiClient for the web service
 
   Returns
   -------
   nothing
   """
 
-  try:
-    #
-    # call the web service:
-    #
-    api = '/jobs'
-    url = baseurl + api
+  #
+  # filters, ENTER to skip each one:
+  #
+  params = {}
+  for (name, label) in [("userid", "user id"),
+                        ("status", "status (uploaded, queued, processing, completed, error)"),
+                        ("jobtype", "analyses run (benford, sentiment, ner, pii, or several: ner,pii)"),
+                        ("since", "created since (UTC, YYYY-MM-DD HH:MM:SS)"),
+                        ("until", "created before (UTC, YYYY-MM-DD HH:MM:SS)")]:
+    print("Filter on " + label + ", or press ENTER>")
+    value = input()
+    if value.strip() != "":
+      params[name] = value.strip()
 
-    res = requests.get(url)
+  list_jobs(client, params)
 
-    #
-    # let's look at what we got back:
-    #
-    if res.status_code != 200:
-      # failed:
-      print("Failed with status code:", res.status_code)
-      print("url: " + url)
-      if res.status_code == 400:
-        # we'll have an error message
-        body = res.json()
-        print("Error message:", body)
-      #
-      return
 
+def list_jobs(client, params):
+  """
+  Prints out the jobs in the database matching the given
+  filters, fetching them a page at a time.
+
+  Parameters
+  ----------
+  client: ApiClient for the web service
+  params: filters (userid, status, jobtype, since, until)
+
+  Returns
+  -------
+  True on success, False if the web service call failed
+  """
+
+  try:
     #
-    # deserialize and extract jobs:
+    # call the web service, a page at a time:
     #
-    body = res.json()
+    api = '/jobs'
+    url = client.baseurl + api
+
     #
-    # let's map each row into an Job object:
+    # let's map each row into a Job object as it arrives:
     #
-    jobs = []
-    for row in body:
+    count = 0
+    for row in page_through(client, api, params):
       job = Job(row)
-      jobs.append(job)
-    #
-    # Now we can think OOP:
-    #
-    if len(jobs) == 0:
-      print("no jobs...")
-      return
+      count += 1
 
-    for job in jobs:
       print(job.jobid)
       print(" ", job.userid)
       print(" ", job.status)
+      print(" ", job.jobtype)
       print(" ", job.originaldatafile)
       print(" ", job.datafilekey)
       print(" ", job.resultsfilekey)
+      print(" ", job.created_at)
+
+    if count == 0:
+      print("no jobs...")
     #
-    return
+    return True
+
+  except RequestFailed as err:
+    print_failure(err)
+    return False
 
   except Exception as e:
+    import logging
     logging.error("jobs() failed:")
     logging.error("url: " + url)
     logging.error(e)
-    return
+    return False
 
 
 ############################################################
 #
 # reset
 #
-def reset(baseurl):
+def reset(client):
   """
   Resets the database back to initial state.
 
   Parameters
   ----------
-  baseurl: baseurl for web service
+  client: ApiClient for the web service
 
   Returns
   -------
@@ -259,9 +387,9 @@ def reset(baseurl):
     # call the web service:
     #
     api = '/reset'
-    url = baseurl + api
+    url = client.baseurl + api
 
-    res = requests.delete(url)
+    res = client.request("DELETE", api)
 
     #
     # let's look at what we got back:
@@ -288,6 +416,7 @@ def reset(baseurl):
     return
 
   except Exception as e:
+    import logging
     logging.error("reset() failed:")
     logging.error("url: " + url)
     logging.error(e)
@@ -296,138 +425,418 @@ def reset(baseurl):
 
 ############################################################
 #
-# upload
+# transport
+#
+# wire format for PDFs and results, set from the config file:
+#   "binary" => raw bytes, compressed with upload_encoding
+#   "json"   => base64 string inside JSON (original format)
+#
+wire_format = "binary"
+upload_encoding = "gzip"
+
+#
+# how long we ask the server to hold a /results request
+# open while the job is still running:
+#
+POLL_WAIT_SECS = 20
+
+#
+# on-disk cache of completed results, set up from the config
+# file ([client] cache_dir, cache_max_mb; cache_max_mb = 0
+# turns it off):
 #
-def upload(baseurl):
+results_cache = None
+
+
+def post_pdf(client, local_filename, userid, jobtype, columns=None):
   """
-  Prompts the user for a local filename and user id, 
-  and uploads that asset (PDF) to S3 for processing. 
+  Uploads a PDF (or a .csv/.xlsx ledger) to the web service
+  using the configured wire format, and prints the bytes sent
+  and time spent encoding.
 
   Parameters
   ----------
-  baseurl: baseurl for web service
+  client: ApiClient for the web service
+  local_filename: PDF to upload
+  userid: user id that owns the job
+  jobtype: benford, sentiment, ner or pii, or several
+    separated by commas
+  columns: for a ledger, the columns to analyze, or None for
+    every numeric column
 
   Returns
   -------
-  nothing
+  (url, response object)
   """
+  infile = open(local_filename, "rb")
+  bytes = infile.read()
+  infile.close()
 
-  jobs = {1:"benford", 2:"sentiment", 3:"ner", 4:"pii"}
-  print("Enter PDF filename>")
-  local_filename = input()
+  api = "/pdf/" + userid + "/" + jobtype
+  url = client.baseurl + api
 
-  print("Enter type of job>")
+  extension = os.path.splitext(local_filename)[1].lower()
+  if extension == ".pdf":
+    content_type = "application/pdf"
+  else:
+    import tabular
+    content_type = tabular.CONTENT_TYPES.get(extension, "application/octet-stream")
+
+  import time
+  import json
+  import base64
+
+  start = time.perf_counter()
+
+  if wire_format == "binary":
+    import transport
+    data = transport.compress(bytes, upload_encoding)
+    headers = {"Content-Type": content_type}
+    if upload_encoding != "identity":
+      headers["Content-Encoding"] = upload_encoding
+    params = {"filename": local_filename}
+    if columns is not None:
+      params["columns"] = ",".join(columns)
+    fmt = "binary+" + upload_encoding
+  else:
+    #
+    # encode the pdf as base64. Note b64encode returns
+    # a bytes object, not a string. So then we have to convert
+    # (decode) the bytes -> string, and then we can serialize
+    # the string as JSON for upload to server:
+    #
+    datastr = base64.b64encode(bytes).decode()
+    body = {"filename": local_filename, "data": datastr}
+    if columns is not None:
+      body["columns"] = columns
+    data = json.dumps(body).encode()
+    headers = {"Content-Type": "application/json"}
+    params = None
+    fmt = "json+base64"
 
-  print("1 => Benford")
-  print("2 => Sentiment Analysis")
-  print("3 => Named Entity Recognition")
-  print("4 => Personally Identifiable Entities")
+  encode_secs = time.perf_counter() - start
 
-  jobtype = int(input())
-  if jobtype != 1 and jobtype != 2 and jobtype != 3 and jobtype != 4:
-    print("Invalid Choice")
-    return
+  print("upload:", fmt, len(bytes), "bytes ->", len(data),
+        "bytes on the wire, encoded in", "%.2f" % (encode_secs * 1000.0), "ms")
 
-  jobchoice = jobs[jobtype] if jobtype in jobs else -1
-  if jobchoice == -1:
-    print("Invalid Choice")
-    return
+  res = client.request("POST", api, params=params, data=data, headers=headers)
 
-  if not pathlib.Path(local_filename).is_file():
-    print("PDF file '", local_filename, "' does not exist...")
-    return
+  return (url, res)
 
-  print("Enter user id>")
-  userid = input()
 
-  try:
-    #
-    # build the data packet:
-    #
-    infile = open(local_filename, "rb")
-    bytes = infile.read()
-    infile.close()
+def get_results(client, jobid, params=None, timeout=None):
+  """
+  Calls /results for a job using the configured wire format.
+  On success the results are decoded, and the bytes received
+  and decode time are printed.
 
-    #
-    # now encode the pdf as base64. Note b64encode returns
-    # a bytes object, not a string. So then we have to convert
-    # (decode) the bytes -> string, and then we can serialize
-    # the string as JSON for upload to server:
-    #
-    data = base64.b64encode(bytes)
-    datastr = data.decode()
+  Completed results are cached on disk. If we have the job
+  cached, we send its ETag and the server answers 304 when our
+  copy is current, without sending the results again.
 
-    data = {"filename": local_filename, "data": datastr}
+  Parameters
+  ----------
+  client: ApiClient for the web service
+  jobid: job whose results we want
+  params: query string, e.g. {"wait": 20}
+  timeout: (connect, read) timeout, if not the client's default
 
-    #
-    # call the web service:
-    #
+  Returns
+  -------
+  (response object, body) where body is the results text if
+  the status code is 200 (or 304), and the JSON message otherwise
+  """
+  api = '/results/' + str(jobid)
 
-    api = '/pdf'
+  import time
+  import json
+  import base64
+  import transport
 
-    url = baseurl + api + "/" + userid + "/" + jobchoice
-    res = requests.post(url, json=data)
+  headers = {}
+  if wire_format == "binary":
+    headers["Accept"] = "text/plain"
+    headers["Accept-Encoding"] = transport.accept_encoding_header()
 
-    #
-    # let's look at what we got back:
-    #
-    if res.status_code != 200:
-      # failed:
-      print("Failed with status code:", res.status_code)
-      print("url: " + url)
-      if res.status_code == 400:
-        # we'll have an error message
-        body = res.json()
-        print("Error message:", body)
+  etag = None
+  if results_cache is not None:
+    etag = results_cache.etag(jobid)
+    if etag is not None:
+      headers["If-None-Match"] = etag
+
+  #
+  # read the body as it came over the wire so we can count
+  # the bytes, then undo any Content-Encoding ourselves:
+  #
+  res = client.request("GET", api, params=params, headers=headers, timeout=timeout, stream=True)
+  wire = res.raw.read(decode_content=False)
+
+  if res.status_code == 304:
+    cached = results_cache.get(jobid)
+    if cached is not None:
+      print("download: not modified, using cached results")
       #
-      return
+      # callers only look for 200 vs. everything else:
+      #
+      res.status_code = 200
+      return (res, cached.decode())
 
     #
-    # success, extract jobid:
+    # evicted between the two calls, so ask again without it:
     #
-    body = res.json()
+    del headers["If-None-Match"]
+    res = client.request("GET", api, params=params, headers=headers, timeout=timeout, stream=True)
+    wire = res.raw.read(decode_content=False)
 
-    jobid = body
+  encoding = res.headers.get("Content-Encoding", "identity")
 
-    print("PDF uploaded, job id =", jobid)
-    return
+  start = time.perf_counter()
+  body = transport.decompress(wire, encoding)
 
-  except Exception as e:
-    logging.error("upload() failed:")
-    logging.error("url: " + url)
-    logging.error(e)
-    return
+  if res.status_code != 200:
+    return (res, json.loads(body))
+
+  if res.headers.get("Content-Type", "").startswith("application/json"):
+    datastr = json.loads(body)
+    data = base64.b64decode(datastr.encode())
+    fmt = "json+base64"
+  else:
+    data = body
+    fmt = "binary+" + encoding
+
+  results = data.decode()
+
+  decode_secs = time.perf_counter() - start
+
+  print("download:", fmt, len(wire), "bytes on the wire ->", len(body),
+        "bytes, decoded in", "%.2f" % (decode_secs * 1000.0), "ms")
+
+  #
+  # keep completed results, which the server sends with an
+  # ETag to revalidate them by:
+  #
+  if results_cache is not None and "ETag" in res.headers \
+     and "no-store" not in res.headers.get("Cache-Control", ""):
+    results_cache.put(jobid, res.headers["ETag"], data)
+
+  return (res, results)
 
 
 ############################################################
 #
-# download
+# upload
 #
-def download(baseurl):
+JOBTYPES = ["benford", "sentiment", "ner", "pii"]
+
+
+def parse_jobtype(jobtype):
   """
-  Prompts the user for the job id, and downloads
-  that asset (PDF).
+  Checks a job type: one of JOBTYPES, or several separated by
+  commas, which run as one job over a single parse of the PDF.
+  Returns it in canonical order, e.g. "pii,benford" =>
+  "benford,pii", or None if it names an unknown analysis.
+  """
+  names = [name.strip().lower() for name in jobtype.split(",") if name.strip() != ""]
+
+  if len(names) == 0 or any(name not in JOBTYPES for name in names):
+    return None
+
+  return ",".join(name for name in JOBTYPES if name in names)
+
+
+def jobtype_arg(value):
+  """
+  argparse type for --jobtype.
+  """
+  import argparse
+
+  jobtype = parse_jobtype(value)
+  if jobtype is None:
+    raise argparse.ArgumentTypeError("expecting one or more of " + ",".join(JOBTYPES) +
+                                     ", separated by commas")
+  return jobtype
+
+
+def prompt_jobtype():
+  """
+  Prompts for the type of job, and returns its name, or None
+  if the choice is invalid. Several choices, e.g. 1,3,4, make
+  a job that runs each of those analyses.
+  """
+  print("Enter type of job (or several, e.g. 1,3,4)>")
+
+  print("1 => Benford")
+  print("2 => Sentiment Analysis")
+  print("3 => Named Entity Recognition")
+  print("4 => Personally Identifiable Entities")
+
+  choices = [choice.strip() for choice in input().split(",")]
+  for choice in choices:
+    if not choice.isnumeric() or int(choice) < 1 or int(choice) > len(JOBTYPES):
+      print("Invalid Choice")
+      return None
+
+  return parse_jobtype(",".join(JOBTYPES[int(choice) - 1] for choice in choices))
+
+
+def upload(client):
+  """
+  Prompts the user for a local filename and user id, 
+  and uploads that asset (PDF) to S3 for processing. 
 
   Parameters
   ----------
-  baseurl: baseurl for web service
+  client: ApiClient for the web service
 
   Returns
   -------
   nothing
   """
 
-  print("Enter job id>")
-  jobid = input()
+  print("Enter PDF (or .csv/.xlsx) filename>")
+  local_filename = input()
 
-  try:
+  columns = None
+  if os.path.splitext(local_filename)[1].lower() in [".csv", ".xlsx"]:
     #
-    # call the web service:
+    # ledgers are Benford only:
     #
-    api = '/results'
-    url = baseurl + api + '/' + jobid
+    jobtype = "benford"
+    print("Enter columns to analyze, separated by commas (blank => every numeric column)>")
+    columns = parse_columns(input())
+  else:
+    jobtype = prompt_jobtype()
+    if jobtype is None:
+      return
+
+  if not os.path.isfile(local_filename):
+    print("PDF file '", local_filename, "' does not exist...")
+    return
+
+  print("Enter user id>")
+  userid = input()
+
+  upload_pdf(client, local_filename, userid, jobtype, columns)
+
+
+def parse_columns(value):
+  """
+  "Amount, Quantity" => ["Amount", "Quantity"], "" => None
+  """
+  columns = [name.strip() for name in value.split(",") if name.strip() != ""]
+  return columns if len(columns) > 0 else None
+
+
+def upload_pdf(client, local_filename, userid, jobtype, columns=None):
+  """
+  Uploads a local PDF (or .csv/.xlsx ledger) to S3 for
+  processing as a new job.
+
+  Parameters
+  ----------
+  client: ApiClient for the web service
+  local_filename: PDF to upload
+  userid: user id that owns the job
+  jobtype: benford, sentiment, ner or pii, or several
+    separated by commas
+  columns: for a ledger, the columns to analyze, or None for
+    every numeric column
+
+  Returns
+  -------
+  the new job id, or None if the upload failed
+  """
+
+  url = client.baseurl + "/pdf"
+
+  try:
+    #
+    # call the web service:
+    #
+    (url, res) = post_pdf(client, local_filename, userid, jobtype, columns)
+
+    #
+    # let's look at what we got back:
+    #
+    if res.status_code != 200:
+      # failed:
+      print("Failed with status code:", res.status_code)
+      print("url: " + url)
+      if res.status_code == 400:
+        # we'll have an error message
+        body = res.json()
+        print("Error message:", body)
+      #
+      return None
+
+    #
+    # success, extract jobid:
+    #
+    body = res.json()
+
+    jobid = body
+
+    print("PDF uploaded, job id =", jobid)
+    return jobid
+
+  except Exception as e:
+    import logging
+    logging.error("upload() failed:")
+    logging.error("url: " + url)
+    logging.error(e)
+    return None
+
+
+############################################################
+#
+# download
+#
+def download(client):
+  """
+  Prompts the user for the job id, and downloads
+  that asset (PDF).
 
-    res = requests.get(url)
+  Parameters
+  ----------
+  client: ApiClient for the web service
+
+  Returns
+  -------
+  nothing
+  """
+
+  print("Enter job id>")
+  jobid = input()
+
+  results = download_results(client, jobid)
+
+  if results is not None:
+    print(results)
+
+
+def download_results(client, jobid):
+  """
+  Downloads the results of a job, without waiting. If the job
+  has not finished, its status is printed instead.
+
+  Parameters
+  ----------
+  client: ApiClient for the web service
+  jobid: job whose results we want
+
+  Returns
+  -------
+  the results text, or None if there are none (yet)
+  """
+
+  try:
+    #
+    # call the web service:
+    #
+    api = '/results/' + str(jobid)
+    url = client.baseurl + api
+
+    (res, body) = get_results(client, jobid)
 
     #
     # let's look at what we got back:
@@ -437,246 +846,505 @@ def download(baseurl):
       # failed: but "failure" with download is how status
       # is returned, so let's look at what we got back
       #
-      msg = res.json()
+      msg = body
 
       if msg.startswith("uploaded"):
         print("No results available yet...")
         print("Job status:", msg)
-        return
+        return None
 
       if msg.startswith("processing"):
         print("No results available yet...")
         print("Job status:", msg)
-        return
+        return None
+
+      if msg.startswith("queued"):
+        print("No results available yet, job is queued...")
+        print("Job status:", msg)
+        return None
 
       print("Failed with status code:", res.status_code)
       print("url: " + url)
       if res.status_code == 400:
         # we'll have an error message
-        body = res.json()
         print("Error message:", body)
       #
-      return
+      return None
 
     #
     # if we get here, status code was 200, so we
-    # have results to deserialize and display:
+    # have results:
     #
-    body = res.json()
+    return body
 
-    datastr = body
+  except Exception as e:
+    import logging
+    logging.error("download() failed:")
+    logging.error("url: " + url)
+    logging.error(e)
+    return None
 
-    base64_bytes = datastr.encode()
-    bytes = base64.b64decode(base64_bytes)
-    results = bytes.decode()
 
-    print(results)
+############################################################
+#
+# status
+#
+def status(client):
+  """
+  Prompts for a list of job ids, or a user id and a starting
+  time, and prints the status of those jobs with one call to
+  the web service. No results are downloaded.
+
+  Parameters
+  ----------
+  client: ApiClient for the web service
+
+  Returns
+  -------
+  nothing
+  """
+
+  print("Enter job ids separated by commas, or press ENTER to query by user>")
+  jobids = input()
+
+  params = {}
+  if jobids.strip() != "":
+    params["jobids"] = jobids.replace(" ", "")
+  else:
+    print("Enter user id>")
+    params["userid"] = input()
+    print("Enter starting time (UTC, YYYY-MM-DD HH:MM:SS)>")
+    params["since"] = input()
+
+  try:
+    #
+    # call the web service:
+    #
+    api = '/status'
+    url = client.baseurl + api
+
+    res = client.request("GET", api, params=params)
+
+    #
+    # let's look at what we got back:
+    #
+    if res.status_code != 200:
+      # failed:
+      print("Failed with status code:", res.status_code)
+      print("url: " + url)
+      if res.status_code == 400:
+        # we'll have an error message
+        body = res.json()
+        print("Error message:", body)
+      #
+      return
+
+    body = res.json()
+
+    if len(body) == 0:
+      print("no jobs...")
+      return
+
+    for job in body:
+      print(job["jobid"])
+      print(" ", job["status"])
+      if job["progress"] is not None:
+        print("  page", job["progress"]["pages_done"], "of", job["progress"]["pages_total"])
+      if job.get("analyses") is not None and len(job["analyses"]) > 1:
+        for (name, status) in job["analyses"].items():
+          print("  " + name + ":", status)
+      print(" ", job["resultsfilekey"])
+      print(" ", job["updated_at"])
+    #
     return
 
   except Exception as e:
-    logging.error("download() failed:")
+    import logging
+    logging.error("status() failed:")
     logging.error("url: " + url)
     logging.error(e)
     return
 
 
-def upload_and_poll(baseurl):
+def upload_and_poll(client):
+  """
+  Prompts for a PDF, user id and job type, uploads the PDF, and
+  waits for the job's results.
+
+  Parameters
+  ----------
+  client: ApiClient for the web service
+
+  Returns
+  -------
+  nothing
+  """
   print("Enter PDF filename>")
   local_filename = input()
 
-  if not pathlib.Path(local_filename).is_file():
+  if not os.path.isfile(local_filename):
     print("PDF file '", local_filename, "' does not exist...")
     return
 
   print("Enter user id>")
   userid = input()
 
-  print("Enter type of job>")
+  jobtype = prompt_jobtype()
+  if jobtype is None:
+    return
 
-  print("1 => Benford")
-  print("2 => Sentiment Analysis")
-  print("3 => Named Entity Recognition")
-  print("4 => Personally Identifiable Entities")
+  jobid = upload_pdf(client, local_filename, userid, jobtype)
+  if jobid is None:
+    return
 
-  jobtype = int(input())
+  results = wait_for_results(client, jobid)
 
-  if jobtype != 1 and jobtype != 2 and jobtype != 3 and jobtype != 4:
-    print("Invalid choice")
-    return
+  if results is not None:
+    print(results)
 
-  try:
-    #
-    # build the data packet:
-    #
-    infile = open(local_filename, "rb")
-    bytes = infile.read()
-    infile.close()
 
-    #
-    # now encode the pdf as base64. Note b64encode returns
-    # a bytes object, not a string. So then we have to convert
-    # (decode) the bytes -> string, and then we can serialize
-    # the string as JSON for upload to server:
-    #
-    data = base64.b64encode(bytes)
-    datastr = data.decode()
+def wait_for_results(client, jobid):
+  """
+  Waits for a job to finish, and downloads its results.
 
-    data = {"filename": local_filename, "data": datastr}
+  Parameters
+  ----------
+  client: ApiClient for the web service
+  jobid: job whose results we want
 
+  Returns
+  -------
+  the results text, or None if the job failed
+  """
+
+  try:
     #
-    # call the web service:
+    # long-poll for the results: the server holds each request
+    # until the job finishes or the wait expires, so we don't
+    # need to sleep between requests:
     #
+    api = '/results/' + str(jobid)
+    url = client.baseurl + api
 
-    # NEED THE /pdf to start anytime
-    if jobtype == 1:
-      api = '/benford'
-
-    elif jobtype == 2:
-      api = '/sentiment'
-
-    elif jobtype == 3:
-      api = '/ner'
+    params = {"wait": POLL_WAIT_SECS}
+    timeout = (3.05, POLL_WAIT_SECS + 15.0)  # allow for the server-side wait
 
-    elif jobtype == 4:
-      api = '/pii'
+    (res, msg) = get_results(client, jobid, params, timeout)
 
-    url = baseurl + "/pdf/" + userid + api
-    res = requests.post(url, json=data)
+    while res.status_code != 200 and (msg.startswith("processing") or msg.startswith("uploaded")
+                                      or msg.startswith("queued")):
+      print("Job status:", msg)
+      (res, msg) = get_results(client, jobid, params, timeout)
 
-    #
-    # let's look at what we got back:
-    #
     if res.status_code != 200:
       # failed:
       print("Failed with status code:", res.status_code)
       print("url: " + url)
       if res.status_code == 400:
         # we'll have an error message
-        body = res.json()
-        print("Error message:", body)
+        print("Error message:", msg)
       #
-      return
+      return None
 
     #
-    # success, extract jobid:
+    # if we get here, status code was 200, so we
+    # have results:
     #
-    body = res.json()
+    return msg
 
-    jobid = body
-    print("PDF uploaded, job id =", jobid)
+  except Exception as e:
+    import logging
+    logging.error("wait() failed:")
+    logging.error("url: " + url)
+    logging.error(e)
+    return None
 
-    api = '/results'
-    url = baseurl + api + '/' + jobid
 
-    res = requests.get(url)
+############################################################
+#
+# search
+#
+def search(client):
+  """
+  Prompts for words to search for, and an optional job id, and
+  prints the matching jobs and pages. Only the logged in user's
+  jobs are searched.
 
-    msg = res.json()
+  Parameters
+  ----------
+  client: ApiClient for the web service
 
-    while msg.startswith("processing") or msg.startswith("uploaded"):
-      print("Job status:", msg)
-      time.sleep(1)
-      res = requests.get(url)
-      msg = res.json()
+  Returns
+  -------
+  nothing
+  """
+  print("Enter words to search for>")
+  query = input()
 
-    if res.status_code != 200:
-      # failed:
-      print("Failed with status code:", res.status_code)
-      print("url: " + url)
-      if res.status_code == 400:
-        # we'll have an error message
-        body = res.json()
-        print("Error message:", body)
-      #
-      return
+  print("Filter on job id, or press ENTER>")
+  jobid = input().strip()
 
+  params = {}
+  if jobid != "":
+    params["jobid"] = jobid
+
+  search_text(client, query, params)
+
+
+def search_text(client, query, params):
+  """
+  Searches the text of the jobs' PDFs, and prints the best
+  matching jobs, then pages with a snippet of each.
+
+  Parameters
+  ----------
+  client: ApiClient for the web service
+  query: the words to search for
+  params: filter (jobid) and limit
+
+  Returns
+  -------
+  True on success, False if the web service call failed
+  """
+
+  try:
     #
-    # let's look at what we got back:
+    # call the web service:
     #
-    # if res.status_code != 200:
-    #   #
-    #   # failed: but "failure" with download is how status
-    #   # is returned, so let's look at what we got back
-    #   #
-    #   msg = res.json()
-
-    #   if msg.startswith("uploaded"):
-    #     print("No results available yet...")
-    #     print("Job status:", msg)
-    #     return
-
-    #   if msg.startswith("processing"):
-    #     print("No results available yet...")
-    #     print("Job status:", msg)
-    #     return
-
-    #   print("Failed with status code:", res.status_code)
-    #   print("url: " + url)
-    #   if res.status_code == 400:
-    #     # we'll have an error message
-    #     body = res.json()
-    #     print("Error message:", body)
-    #   #
-    #   return
+    api = '/search'
+    url = client.baseurl + api
+
+    params = dict(params)
+    params["q"] = query
+
+    res = client.request("GET", api, params=params)
 
+    if res.status_code != 200:
+      raise RequestFailed(url, res)
+
+    body = res.json()
+
+    if len(body["pages"]) == 0:
+      print("no matches...")
+      return True
+
+    print("Jobs:")
+    for job in body["jobs"]:
+      print(" ", job["jobid"], job["originaldatafile"], "(user " + str(job["userid"]) + "):",
+            job["pages"], "pages, score", job["score"])
+
+    print("Pages:")
+    for hit in body["pages"]:
+      print(" ", "job", hit["jobid"], "page", hit["page"], "score", hit["score"])
+      print("   ", hit["snippet"])
     #
-    # if we get here, status code was 200, so we
-    # have results to deserialize and display:
+    return True
+
+  except RequestFailed as err:
+    print_failure(err)
+    return False
+
+  except Exception as e:
+    import logging
+    logging.error("search() failed:")
+    logging.error("url: " + url)
+    logging.error(e)
+    return False
+
+
+############################################################
+#
+# export
+#
+EXPORT_CHUNK_BYTES = 1024 * 1024
+
+
+def export(client):
+  """
+  Prompts for a user id or a list of job ids, and the file to
+  save the zip of their results to.
+
+  Parameters
+  ----------
+  client: ApiClient for the web service
+
+  Returns
+  -------
+  nothing
+  """
+  print("Enter user id, or press ENTER to list job ids>")
+  userid = input().strip()
+
+  params = {}
+  if userid != "":
+    params["userid"] = userid
+  else:
+    print("Enter job ids, separated by commas>")
+    params["jobids"] = input().strip()
+
+  print("Save the zip as>")
+  output = input().strip()
+
+  export_results(client, params, output)
+
+
+def export_results(client, params, output):
+  """
+  Asks the web service to archive the results of completed jobs
+  (a user's, or a list of job ids), then streams the archive
+  from S3 straight into the output file.
+
+  Parameters
+  ----------
+  client: ApiClient for the web service
+  params: userid or jobids, and optionally after
+  output: file to save the zip as
+
+  Returns
+  -------
+  True on success, False if the web service call failed
+  """
+
+  try:
+    #
+    # call the web service:
     #
+    api = '/export'
+    url = client.baseurl + api
+
+    res = client.request("GET", api, params=params)
+
+    if res.status_code != 200:
+      raise RequestFailed(url, res)
+
     body = res.json()
 
-    datastr = body
+    #
+    # the archive is in S3, behind a presigned URL: download it
+    # a chunk at a time, into a temporary file renamed once
+    # it's complete:
+    #
+    url = body["url"]
 
-    base64_bytes = datastr.encode()
-    bytes = base64.b64decode(base64_bytes)
-    results = bytes.decode()
+    res = client.session.get(url, stream=True, timeout=client.timeout)
 
-    print(results)
-    return
+    if res.status_code != 200:
+      raise RequestFailed(url, res)
+
+    partial = output + ".part"
+
+    outfile = open(partial, "wb")
+    try:
+      for chunk in res.iter_content(chunk_size=EXPORT_CHUNK_BYTES):
+        outfile.write(chunk)
+    finally:
+      outfile.close()
+      res.close()
+
+    os.replace(partial, output)
+
+    print(body["jobs"], "jobs' results written to '" + output + "'")
+
+    if len(body["missing"]) > 0:
+      print("results missing for jobs:", body["missing"])
+    if body["next"] is not None:
+      print("more jobs remain, export them with --after", body["next"])
+    #
+    return True
+
+  except RequestFailed as err:
+    print_failure(err)
+    return False
 
   except Exception as e:
-    logging.error("upload_and_poll() failed:")
+    import logging
+    logging.error("export() failed:")
     logging.error("url: " + url)
     logging.error(e)
+    return False
+
+
+############################################################
+#
+# batch
+#
+def batch_upload(client):
+  """
+  Prompts for a directory (or glob), job type, user id and
+  concurrency limit, then uploads every matching PDF, waits for
+  all the jobs to finish, and writes each job's results next to
+  its PDF. See batch.py.
+
+  Parameters
+  ----------
+  client: ApiClient for the web service
+
+  Returns
+  -------
+  nothing
+  """
+  import batch
+
+  print("Enter directory or glob of PDFs>")
+  pattern = input()
+
+  jobtype = prompt_jobtype()
+  if jobtype is None:
+    return
+
+  print("Enter user id>")
+  userid = input()
+
+  print("Enter max jobs in flight (ENTER for 8)>")
+  limit = input()
+  limit = int(limit) if limit.isnumeric() and int(limit) > 0 else 8
+
+  try:
+    batch.run_batch(client, pattern, jobtype, userid, limit, upload_encoding)
+    return
+
+  except Exception as e:
+    import logging
+    logging.error("batch_upload() failed:")
+    logging.error(e)
     return
 
 
 ############################################################
-# main
 #
-try:
-  print('** Welcome to RadNews **')
-  print('We are the place for all of your news needs!')
-  print('Upload PDFs, have Multiple Users, and let us do comprehensive analysis for you!')
-  print()
+# setup
+#
+DEFAULT_CONFIG_FILE = 'client_config.ini'
+CONFIG_ENV_VAR = 'BENFORDAPP_CONFIG'
 
-  # eliminate traceback so we just get error message:
-  sys.tracebacklimit = 0
 
-  #
-  # what config file should we use for this session?
-  #
-  config_file = 'client_config.ini'
+def load_config(config_file):
+  """
+  Reads the client config file, sets the transport and cache
+  settings, and returns an ApiClient for the web service.
 
-  print("Config file to use for this session?")
-  print("Press ENTER to use default, or")
-  print("enter config file name>")
-  s = input()
+  Parameters
+  ----------
+  config_file: path to the client config file
 
-  if s == "":  # use default
-    pass  # already set
-  else:
-    config_file = s
+  Returns
+  -------
+  ApiClient, or None if the config file is missing or invalid
+  (after printing why)
+  """
+  global wire_format, upload_encoding, results_cache
 
   #
   # does config file exist?
   #
-  if not pathlib.Path(config_file).is_file():
+  if not os.path.isfile(config_file):
     print("**ERROR: config file '", config_file, "' does not exist, exiting")
-    sys.exit(0)
+    return None
 
   #
   # setup base URL to web service:
   #
+  from configparser import ConfigParser
   configur = ConfigParser()
   configur.read(config_file)
   baseurl = configur.get('client', 'webservice')
@@ -686,20 +1354,96 @@ try:
   #
   if len(baseurl) < 16:
     print("**ERROR: baseurl '", baseurl, "' is not nearly long enough...")
-    sys.exit(0)
+    return None
 
   if baseurl == "https://YOUR_GATEWAY_API.amazonaws.com":
     print("**ERROR: update config file with your gateway endpoint")
-    sys.exit(0)
+    return None
 
   if baseurl.startswith("http:"):
     print("**ERROR: your URL starts with 'http', it should start with 'https'")
-    sys.exit(0)
+    return None
 
   lastchar = baseurl[len(baseurl) - 1]
   if lastchar == "/":
     baseurl = baseurl[:-1]
 
+  #
+  # wire format for PDFs and results, defaults to compressed
+  # binary; set transport = json to use the base64 fallback:
+  #
+  wire_format = configur.get('client', 'transport', fallback=wire_format)
+  upload_encoding = configur.get('client', 'upload_encoding', fallback=upload_encoding)
+
+  if wire_format not in ["binary", "json"]:
+    print("**ERROR: transport '", wire_format, "' must be binary or json")
+    return None
+
+  import transport
+  if upload_encoding not in transport.available_encodings():
+    print("**ERROR: upload_encoding '", upload_encoding, "' is not available, use one of",
+          transport.available_encodings())
+    return None
+
+  cache_max_mb = float(configur.get('client', 'cache_max_mb', fallback='100'))
+  if cache_max_mb > 0:
+    import resultscache
+
+    cache_dir = configur.get('client', 'cache_dir', fallback=resultscache.default_directory(baseurl))
+    results_cache = resultscache.ResultsCache(cache_dir, int(cache_max_mb * 1024 * 1024))
+
+  #
+  # all calls go through one client, which pools connections,
+  # retries and times requests. Credentials are optional, and
+  # let the client log in automatically:
+  #
+  import apiclient
+
+  client = apiclient.ApiClient(baseurl)
+  client.username = configur.get('client', 'username', fallback=None)
+  client.password = configur.get('client', 'password', fallback=None)
+
+  return client
+
+
+############################################################
+#
+# interactive
+#
+def interactive(config_file):
+  """
+  The original menu-driven client. Prompts for the config file
+  unless one was given, then loops over commands until 0.
+
+  Returns
+  -------
+  exit code
+  """
+  print('** Welcome to RadNews **')
+  print('We are the place for all of your news needs!')
+  print('Upload PDFs, have Multiple Users, and let us do comprehensive analysis for you!')
+  print()
+
+  #
+  # what config file should we use for this session?
+  #
+  if config_file is None:
+    config_file = DEFAULT_CONFIG_FILE
+
+    print("Config file to use for this session?")
+    print("Press ENTER to use default, or")
+    print("enter config file name>")
+    s = input()
+
+    if s == "":  # use default
+      pass  # already set
+    else:
+      config_file = s
+
+  client = load_config(config_file)
+  if client is None:
+    return 1
+
   #
   # main processing loop:
   #
@@ -708,30 +1452,242 @@ try:
   while cmd != 0:
     #
     if cmd == 1:
-      users(baseurl)
+      users(client)
     elif cmd == 2:
-      jobs(baseurl)
+      jobs(client)
     elif cmd == 3:
-      reset(baseurl)
+      reset(client)
     elif cmd == 4:
-      upload(baseurl)
+      upload(client)
     elif cmd == 5:
-      download(baseurl)
+      download(client)
     elif cmd == 6:
-      upload_and_poll(baseurl)
+      upload_and_poll(client)
+    elif cmd == 7:
+      status(client)
+    elif cmd == 8:
+      login_prompt(client)
+    elif cmd == 9:
+      batch_upload(client)
+    elif cmd == 10:
+      search(client)
+    elif cmd == 11:
+      export(client)
     else:
       print("** Unknown command, try again...")
     #
     cmd = prompt()
 
   #
-  # done
+  # done, report how long our requests took:
   #
+  print()
+  client.print_latency_report()
+  client.close()
+
   print()
   print('** done **')
-  sys.exit(0)
+  return 0
+
+
+############################################################
+#
+# command line
+#
+def build_parser():
+  """
+  Returns the argparse parser for the command-line client.
+  """
+  import argparse
+
+  parser = argparse.ArgumentParser(
+    prog="main.py",
+    description="Client for the benford app web service. "
+                "With no command, runs the interactive menu.")
+  parser.add_argument("--config", default=None,
+                      help="client config file (default: $" + CONFIG_ENV_VAR +
+                           ", else " + DEFAULT_CONFIG_FILE + ")")
+
+  commands = parser.add_subparsers(dest="command", metavar="command")
+
+  commands.add_parser("users", help="list the users")
+
+  p = commands.add_parser("jobs", help="list the jobs, optionally filtered")
+  p.add_argument("--userid")
+  p.add_argument("--status", choices=["uploaded", "queued", "processing", "completed", "error"])
+  p.add_argument("--jobtype", type=jobtype_arg,
+                 help="jobs running these analyses, e.g. ner or benford,pii")
+  p.add_argument("--since", help="created since (UTC, YYYY-MM-DD HH:MM:SS)")
+  p.add_argument("--until", help="created before (UTC, YYYY-MM-DD HH:MM:SS)")
+
+  p = commands.add_parser("upload", help="upload a PDF (or .csv/.xlsx ledger), printing the job id")
+  p.add_argument("filename")
+  p.add_argument("--userid", required=True)
+  p.add_argument("--jobtype", type=jobtype_arg, default="benford",
+                 help="benford, sentiment, ner, pii, or several, e.g. benford,ner,pii")
+  p.add_argument("--columns", type=parse_columns, default=None,
+                 help="for a .csv/.xlsx ledger, the columns to analyze, e.g. Amount,Quantity "
+                      "(default: every numeric column)")
+  p.add_argument("--wait", action="store_true", help="wait for the results and print them")
+
+  p = commands.add_parser("download", help="download a job's results, if finished")
+  p.add_argument("jobid")
+  p.add_argument("-o", "--output", help="write the results to this file")
+
+  p = commands.add_parser("wait", help="wait for a job to finish, then download its results")
+  p.add_argument("jobid")
+  p.add_argument("-o", "--output", help="write the results to this file")
+
+  p = commands.add_parser("search", help="search the text of your jobs' PDFs (requires login)")
+  p.add_argument("query", help="words to search for")
+  p.add_argument("--jobid")
+  p.add_argument("--limit", type=int, help="pages to show (default 20)")
+
+  p = commands.add_parser("export", help="save the results of completed jobs as one zip")
+  which = p.add_mutually_exclusive_group(required=True)
+  which.add_argument("--userid")
+  which.add_argument("--jobids", help="comma-separated, e.g. 1001,1002")
+  p.add_argument("--after", help="only jobs after this job id, to continue an export")
+  p.add_argument("-o", "--output", required=True, help="file to save the zip as")
+
+  p = commands.add_parser("batch", help="upload every PDF in a directory (or glob), writing "
+                                        "each one's results next to it")
+  p.add_argument("pattern", help="directory of PDFs, or a glob, e.g. 'reports/*.pdf'")
+  p.add_argument("--userid", required=True)
+  p.add_argument("--jobtype", type=jobtype_arg, default="benford",
+                 help="benford, sentiment, ner, pii, or several, e.g. benford,ner,pii")
+  p.add_argument("--limit", type=int, default=8, help="max jobs in flight (default 8)")
+  p.add_argument("--timeout", type=float, default=None,
+                 help="give up on jobs unfinished after this many seconds (default 3600)")
+
+  return parser
+
+
+def write_results(results, output):
+  """
+  Prints results, or writes them to the output file if given.
+  """
+  if output is None:
+    print(results)
+    return
+
+  outfile = open(output, "w")
+  outfile.write(results)
+  outfile.close()
+
+  print("results written to '" + output + "'")
+
+
+def run_command(args, client):
+  """
+  Runs one command-line command.
+
+  Returns
+  -------
+  exit code, 0 on success
+  """
+  if args.command == "users":
+    return 0 if users(client) else 1
+
+  if args.command == "jobs":
+    params = {}
+    for name in ["userid", "status", "jobtype", "since", "until"]:
+      if getattr(args, name) is not None:
+        params[name] = getattr(args, name)
+    return 0 if list_jobs(client, params) else 1
+
+  if args.command == "upload":
+    jobid = upload_pdf(client, args.filename, args.userid, args.jobtype, args.columns)
+    if jobid is None:
+      return 1
+    if args.wait:
+      results = wait_for_results(client, jobid)
+      if results is None:
+        return 1
+      print(results)
+    return 0
+
+  if args.command in ["download", "wait"]:
+    if args.command == "download":
+      results = download_results(client, args.jobid)
+    else:
+      results = wait_for_results(client, args.jobid)
+    if results is None:
+      return 1
+    write_results(results, args.output)
+    return 0
+
+  if args.command == "search":
+    params = {}
+    for name in ["jobid", "limit"]:
+      if getattr(args, name) is not None:
+        params[name] = getattr(args, name)
+    return 0 if search_text(client, args.query, params) else 1
+
+  if args.command == "export":
+    params = {}
+    for name in ["userid", "jobids", "after"]:
+      if getattr(args, name) is not None:
+        params[name] = getattr(args, name)
+    return 0 if export_results(client, params, args.output) else 1
+
+  if args.command == "batch":
+    import batch
+
+    timeout_secs = args.timeout if args.timeout is not None else batch.DEFAULT_TIMEOUT_SECS
+    jobs = batch.run_batch(client, args.pattern, args.jobtype, args.userid, max(1, args.limit),
+                           upload_encoding, timeout_secs)
+    if len(jobs) == 0:
+      return 1
+    return 0 if all(job.status == "completed" for job in jobs) else 1
+
+  raise Exception("unknown command '" + args.command + "'")
+
+
+def main(argv=None):
+  """
+  Entry point: parses the command line, and either runs one
+  command or the interactive menu.
+
+  Returns
+  -------
+  exit code
+  """
+  parser = build_parser()
+  args = parser.parse_args(argv)
+
+  # eliminate traceback so we just get error message:
+  sys.tracebacklimit = 0
+
+  config_file = args.config or os.environ.get(CONFIG_ENV_VAR)
+
+  try:
+    if args.command is None:
+      return interactive(config_file)
+
+    #
+    # check what we can before loading the config, so bad
+    # arguments fail fast without any network setup:
+    #
+    if args.command == "upload" and not os.path.isfile(args.filename):
+      print("PDF file '", args.filename, "' does not exist...")
+      return 1
+
+    client = load_config(config_file or DEFAULT_CONFIG_FILE)
+    if client is None:
+      return 1
+
+    try:
+      return run_command(args, client)
+    finally:
+      client.close()
+
+  except Exception as e:
+    import logging
+    logging.error("**ERROR: main() failed:")
+    logging.error(e)
+    return 1
+
 
-except Exception as e:
-  logging.error("**ERROR: main() failed:")
-  logging.error(e)
-  sys.exit(0)
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,144 @@
+#
+# Generates synthetic PDFs for load tests and benchmarks of the
+# benford app, so we don't need a folder of real documents.
+#
+# Each page is lines of plain text in Helvetica, mixing words,
+# numbers drawn from Benford's distribution (log-uniform, so the
+# benford jobs have something realistic to count), capitalized
+# names for the ner jobs, and the odd email address and phone
+# number for the pii jobs. The PDF itself is written by hand:
+# one content stream per page, no compression, which pypdf (and
+# any other reader) can extract text from.
+#
+# Run "python pdfgen.py out.pdf 10" to write a 10 page document.
+#
+
+import random
+import sys
+
+WORDS = ["revenue", "increased", "by", "the", "quarter", "total", "of", "cost",
+         "reported", "in", "fiscal", "year", "net", "income", "was", "and",
+         "operating", "expenses", "for", "sales", "growth", "assets", "units"]
+
+NAMES = ["Alice Johnson", "Northwind Traders", "Chicago", "Bob Smith", "Evanston",
+         "Contoso Ltd", "Maria Garcia", "Lake Michigan", "Acme Corporation"]
+
+LINES_PER_PAGE = 45
+WORDS_PER_LINE = 10
+
+
+def benford_number(rng, max_digits=7):
+  """
+  A positive integer whose leading digit follows Benford's law.
+  """
+  return int(10 ** rng.uniform(0, max_digits))
+
+
+def random_line(rng, words=WORDS_PER_LINE, numeric=0.35):
+  """
+  One line of text: words, with about the given fraction of
+  numbers, and sometimes a name, an email address or a phone
+  number.
+  """
+  parts = []
+  for i in range(words):
+    r = rng.random()
+    if r < numeric:
+      parts.append(str(benford_number(rng)))
+    elif r < numeric + 0.07:
+      parts.append(rng.choice(NAMES))
+    elif r < numeric + 0.08:
+      parts.append(rng.choice(["jdoe", "asmith", "mgarcia"]) + "@example.com")
+    elif r < numeric + 0.09:
+      parts.append("(312) 555-%04d" % rng.randrange(10000))
+    else:
+      parts.append(rng.choice(WORDS))
+  return " ".join(parts)
+
+
+def random_pages(rng, pages, lines=LINES_PER_PAGE, words=WORDS_PER_LINE, numeric=0.35):
+  """
+  Returns a list of pages, each a list of lines of text.
+  """
+  return [[random_line(rng, words, numeric) for i in range(lines)] for p in range(pages)]
+
+
+def escape(text):
+  """
+  Escapes a string for use inside a PDF literal string (...).
+  """
+  return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages):
+  """
+  Builds a PDF with one page per entry of pages (a list of lines
+  of text), and returns its bytes.
+  """
+  #
+  # objects 1-3 are the catalog, page tree and font; then each
+  # page is a page object followed by its content stream:
+  #
+  objects = []
+
+  kids = " ".join(str(4 + 2 * i) + " 0 R" for i in range(len(pages)))
+
+  objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+  objects.append(("<< /Type /Pages /Kids [" + kids + "] /Count " + str(len(pages)) + " >>").encode())
+  objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+  for (i, lines) in enumerate(pages):
+    content = ["BT", "/F1 10 Tf", "12 TL", "40 750 Td"]
+    for line in lines:
+      content.append("(" + escape(line) + ") Tj T*")
+    content.append("ET")
+    stream = "\n".join(content).encode("latin-1", errors="replace")
+
+    objects.append(("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                    "/Resources << /Font << /F1 3 0 R >> >> "
+                    "/Contents " + str(5 + 2 * i) + " 0 R >>").encode())
+    objects.append(b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" +
+                   stream + b"\nendstream")
+
+  #
+  # write the objects, remembering where each starts for the
+  # cross-reference table:
+  #
+  out = bytearray(b"%PDF-1.4\n")
+  offsets = []
+
+  for (i, obj) in enumerate(objects):
+    offsets.append(len(out))
+    out += str(i + 1).encode() + b" 0 obj\n" + obj + b"\nendobj\n"
+
+  xref = len(out)
+  out += b"xref\n0 " + str(len(objects) + 1).encode() + b"\n"
+  out += b"0000000000 65535 f \n"
+  for offset in offsets:
+    out += ("%010d 00000 n \n" % offset).encode()
+
+  out += b"trailer\n<< /Size " + str(len(objects) + 1).encode() + b" /Root 1 0 R >>\n"
+  out += b"startxref\n" + str(xref).encode() + b"\n%%EOF\n"
+
+  return bytes(out)
+
+
+def random_pdf(rng, pages, lines=LINES_PER_PAGE, words=WORDS_PER_LINE, numeric=0.35):
+  """
+  Returns the bytes of a random document with the given number
+  of pages, lines per page, words per line and fraction of
+  numeric words.
+  """
+  return make_pdf(random_pages(rng, pages, lines, words, numeric))
+
+
+if __name__ == "__main__":
+  if len(sys.argv) < 3:
+    print("usage: python pdfgen.py out.pdf pages [seed]")
+    sys.exit(1)
+
+  seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+  outfile = open(sys.argv[1], "wb")
+  outfile.write(random_pdf(random.Random(seed), int(sys.argv[2])))
+  outfile.close()
@@ -0,0 +1,312 @@
+#
+# Opt-in profiling for the lambda functions. Like datatier.py,
+# this file is deployed alongside each lambda function.
+#
+# A handler decorated with @profiling.profiled runs under cProfile
+# and tracemalloc when either
+#
+#   - the environment variable BENFORDAPP_PROFILE is 1 / true, or
+#   - the event asks for it: "profile": true at the top level
+#     (e.g. a re-invoked S3 event for proj03_compute), a
+#     ?profile=1 query parameter, or an "X-Profile: 1" header.
+#
+# The call stats (a pstats file) and the top allocations (text)
+# are then uploaded to S3 next to the job's PDF, under
+#
+#   <datafilekey without .pdf>/profiles/<function>-<UTC time>.pstats
+#   <datafilekey without .pdf>/profiles/<function>-<UTC time>.alloc.txt
+#
+# once the handler has called note_job() with the bucket and key.
+# Otherwise they go under benfordapp/profiles/. When profiling is
+# off, the only cost is checking those flags.
+#
+# To fetch and render a job's profiles (uses the [s3] and [rds]
+# sections of the config file):
+#
+#   python profiling.py 1001
+#   python profiling.py benfordapp/p_sarkar/report-<uuid>.pdf --sort tottime
+#   python profiling.py --file local.pstats
+#
+
+import datetime
+import functools
+import io
+import os
+import sys
+import threading
+
+ENV_VAR = "BENFORDAPP_PROFILE"
+S3_PROFILE = "s3readwrite"
+DEFAULT_PREFIX = "benfordapp/profiles"
+TOP_ALLOCATIONS = 25
+TOP_FUNCTIONS = 30
+
+_local = threading.local()
+
+#
+# cProfile and tracemalloc are per process, so profiled
+# invocations take turns (this only matters when several run in
+# one process, as in the emulator):
+#
+_active = threading.Lock()
+
+
+def is_true(value):
+  return value is not None and str(value).strip().lower() in ["1", "true", "yes", "on"]
+
+
+def requested(event):
+  """
+  True if this invocation should be profiled.
+  """
+  if is_true(os.environ.get(ENV_VAR)):
+    return True
+
+  if not isinstance(event, dict):
+    return False
+
+  if is_true(event.get("profile")):
+    return True
+
+  params = event.get("queryStringParameters") or {}
+  if is_true(params.get("profile")):
+    return True
+
+  headers = event.get("headers") or {}
+  for key in headers:
+    if key.lower() == "x-profile":
+      return is_true(headers[key])
+
+  return False
+
+
+class Session:
+  """
+  One profiled invocation.
+  """
+
+  def __init__(self, function_name, context):
+    self.function_name = function_name
+    self.request_id = getattr(context, "aws_request_id", None)
+    self.bucketname = None
+    self.datafilekey = None
+    self.profiler = None
+
+  def start(self):
+    import cProfile
+    import tracemalloc
+
+    tracemalloc.start()
+    self.profiler = cProfile.Profile()
+    self.profiler.enable()
+
+  def stop(self):
+    import pstats
+    import tracemalloc
+
+    self.profiler.disable()
+
+    snapshot = tracemalloc.take_snapshot()
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    lines = []
+    lines.append(self.function_name + " request " + str(self.request_id))
+    lines.append("traced memory: current %.1f KiB, peak %.1f KiB" % (current / 1024.0, peak / 1024.0))
+    lines.append("")
+    lines.append("top " + str(TOP_ALLOCATIONS) + " allocations by line:")
+    for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+      lines.append("  " + str(stat))
+    self.allocations = "\n".join(lines) + "\n"
+
+    out = io.StringIO()
+    stats = pstats.Stats(self.profiler, stream=out)
+    stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+    self.summary = out.getvalue()
+
+  def save(self):
+    """
+    Logs the profile, and uploads it to S3 if we know the bucket.
+    """
+    import marshal
+
+    print("**PROFILE**")
+    print(self.summary)
+    print(self.allocations)
+
+    if self.bucketname is None:
+      print("**PROFILE not saved: no bucket noted**")
+      return
+
+    if self.datafilekey is not None and self.datafilekey.endswith(".pdf"):
+      prefix = self.datafilekey[0:-4] + "/profiles/"
+    else:
+      prefix = DEFAULT_PREFIX + "/"
+
+    stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S.%fZ")
+    basekey = prefix + self.function_name + "-" + stamp
+
+    #
+    # pstats reads the marshalled stats dict, which is what
+    # Profile.dump_stats() writes:
+    #
+    self.profiler.create_stats()
+    data = marshal.dumps(self.profiler.stats)
+
+    #
+    # the download function only has read access, so upload
+    # with our own read-write session:
+    #
+    import boto3
+
+    session = boto3.Session(profile_name=S3_PROFILE)
+    bucket = session.resource('s3').Bucket(self.bucketname)
+
+    bucket.put_object(Key=basekey + ".pstats", Body=data, ContentType="application/octet-stream")
+    bucket.put_object(Key=basekey + ".alloc.txt", Body=self.allocations.encode(),
+                      ContentType="text/plain")
+
+    print("**PROFILE saved to", basekey + ".pstats", "**")
+
+
+def profiled(handler):
+  """
+  Decorator for a lambda_handler: profiles the invocation when
+  requested(event), otherwise just calls the handler.
+  """
+  function_name = handler.__module__
+
+  @functools.wraps(handler)
+  def wrapper(event, context):
+    if not requested(event):
+      return handler(event, context)
+
+    _active.acquire()
+    try:
+      session = Session(function_name, context)
+      _local.session = session
+      session.start()
+      try:
+        return handler(event, context)
+      finally:
+        _local.session = None
+        try:
+          session.stop()
+          session.save()
+        except Exception as err:
+          # never fail the request because of its profile:
+          print("**PROFILE not saved:", str(err), "**")
+    finally:
+      _active.release()
+
+  return wrapper
+
+
+def note_job(bucketname, datafilekey):
+  """
+  Tells the current profile (if any) which job this invocation
+  is for, so it's saved under the job's key prefix.
+  """
+  session = getattr(_local, "session", None)
+  if session is not None:
+    session.bucketname = bucketname
+    session.datafilekey = datafilekey
+
+
+############################################################
+#
+# fetching and rendering (run locally)
+#
+def render(data, sort="cumulative", limit=TOP_FUNCTIONS):
+  """
+  Returns the text of a pstats report from marshalled stats.
+  """
+  import pstats
+  import tempfile
+
+  #
+  # pstats only loads stats from a file:
+  #
+  (fd, filename) = tempfile.mkstemp(suffix=".pstats")
+  try:
+    with os.fdopen(fd, "wb") as outfile:
+      outfile.write(data)
+    out = io.StringIO()
+    pstats.Stats(filename, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+  finally:
+    os.remove(filename)
+
+
+def lookup_datafilekey(configur, jobid):
+  import datatier
+
+  dbConn = datatier.get_dbConn(configur.get('rds', 'endpoint'),
+                               int(configur.get('rds', 'port_number')),
+                               configur.get('rds', 'user_name'),
+                               configur.get('rds', 'user_pwd'),
+                               configur.get('rds', 'db_name'))
+
+  row = datatier.retrieve_one_row(dbConn, "SELECT datafilekey FROM jobs WHERE jobid = %s;", [jobid])
+  if row == ():
+    raise Exception("no such job " + str(jobid))
+  return row[0]
+
+
+def fetch(configur, job, sort="cumulative", limit=TOP_FUNCTIONS):
+  """
+  Downloads and prints every profile saved for a job, given its
+  job id or datafilekey.
+  """
+  import boto3
+
+  datafilekey = lookup_datafilekey(configur, job) if str(job).isnumeric() else job
+  if datafilekey.endswith(".pdf"):
+    datafilekey = datafilekey[0:-4]
+
+  prefix = datafilekey + "/profiles/"
+
+  session = boto3.Session(profile_name='s3readonly')
+  bucket = session.resource('s3').Bucket(configur.get('s3', 'bucket_name'))
+
+  count = 0
+  for obj in sorted(bucket.objects.filter(Prefix=prefix), key=lambda o: o.key):
+    body = obj.get()["Body"].read()
+    print("**", obj.key, "**")
+    if obj.key.endswith(".pstats"):
+      print(render(body, sort, limit))
+    else:
+      print(body.decode())
+    count += 1
+
+  if count == 0:
+    print("no profiles under '" + prefix + "'...")
+
+
+if __name__ == "__main__":
+  import argparse
+  from configparser import ConfigParser
+
+  parser = argparse.ArgumentParser(description="Fetch and render a job's saved profiles.")
+  parser.add_argument("job", nargs="?", help="job id, or the job's datafilekey")
+  parser.add_argument("--file", default=None, help="render a local .pstats file instead")
+  parser.add_argument("--config", default="benfordapp-config.ini")
+  parser.add_argument("--sort", default="cumulative", help="pstats sort key, e.g. tottime")
+  parser.add_argument("--limit", type=int, default=TOP_FUNCTIONS)
+  args = parser.parse_args()
+
+  if args.file is not None:
+    infile = open(args.file, "rb")
+    print(render(infile.read(), args.sort, args.limit))
+    infile.close()
+    sys.exit(0)
+
+  if args.job is None:
+    parser.error("give a job id, a datafilekey or --file")
+
+  os.environ['AWS_SHARED_CREDENTIALS_FILE'] = args.config
+
+  configur = ConfigParser()
+  configur.read(args.config)
+
+  fetch(configur, args.job, args.sort, args.limit)
@@ -0,0 +1,72 @@
+#
+# Periodic claimer for the fair-share scheduler, run on a
+# schedule (e.g. an EventBridge rule every minute). Requeues
+# jobs whose compute invocation died while processing them, and
+# starts queued jobs that no finishing job handed off, so no
+# queued job waits forever (see scheduler.py).
+#
+
+import json
+import boto3
+import os
+import datatier
+import scheduler
+
+from configparser import ConfigParser
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_claimer**")
+
+    #
+    # setup AWS based on config file:
+    #
+    config_file = 'benfordapp-config.ini'
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+    configur = ConfigParser()
+    configur.read(config_file)
+
+    bucketname = configur.get('s3', 'bucket_name')
+
+    limits = scheduler.get_limits(configur)
+    stale_secs = scheduler.get_stale_secs(configur)
+    function_name = configur.get('scheduler', 'compute_function', fallback='proj03_compute')
+
+    #
+    # configure for RDS access
+    #
+    rds_endpoint = configur.get('rds', 'endpoint')
+    rds_portnum = int(configur.get('rds', 'port_number'))
+    rds_username = configur.get('rds', 'user_name')
+    rds_pwd = configur.get('rds', 'user_pwd')
+    rds_dbname = configur.get('rds', 'db_name')
+
+    print("**Opening connection**")
+
+    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+
+    lambda_client = boto3.client('lambda')
+
+    (requeued, started) = scheduler.tick(dbConn, limits, stale_secs, bucketname,
+                                         function_name, lambda_client)
+
+    msg = "requeued " + str(requeued) + " stale jobs, started " + str(len(started)) + " queued jobs"
+
+    print("**DONE,", msg, started, "**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps(msg)
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
@@ -9,6 +9,13 @@
 # https://en.wikipedia.org/wiki/Benford%27s_law
 # https://chance.amstat.org/2021/04/benfords-law/
 #
+# A job can instead (or also) ask for sentiment, named entity or
+# PII analysis by AWS Comprehend; a job with several analyses
+# parses the PDF once and runs them all. See analyses.py.
+#
+# Ledgers can also arrive as .csv or .xlsx, for Benford analysis
+# overall and per column, without a PDF; see tabular.py.
+#
 
 import json
 import boto3
@@ -19,10 +26,508 @@ import pathlib
 import datatier
 import urllib.parse
 import string
-
+import time
+import hashlib
+import profiling
+import scheduler
+import analyses
+import comprehendcache
+import sampling
+import tabular
+import entitystore
+import textsearch
+import math
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from configparser import ConfigParser
 from pypdf import PdfReader
 
+#
+# minimum time between writes of pages_done while processing:
+#
+PROGRESS_INTERVAL_SECS = 1.0
+
+#
+# translation table that strips punctuation from a word, built
+# once rather than per word:
+#
+PUNCTUATION = str.maketrans('', '', string.punctuation)
+
+
+def start_queued_jobs(dbConn, limits, bucketname, context):
+  """
+  Our job has finished, freeing a slot: start queued jobs in it
+  (round-robin across users), each in a new invocation of this
+  function. Failing here never fails the finished job.
+  """
+  try:
+    function_name = getattr(context, "function_name", "proj03_compute")
+    lambda_client = boto3.client('lambda')
+
+    started = scheduler.hand_off(dbConn, limits, bucketname, function_name, lambda_client)
+
+    if len(started) > 0:
+      print("**Started queued jobs:", started, "**")
+
+  except Exception as err:
+    print("**Could not start queued jobs:", str(err), "**")
+
+
+def new_digit_counts():
+  return {'1': 0, '2': 0, '3': 0, '4': 0, '5': 0, '6': 0, '7': 0, '8': 0, '9': 0}
+
+
+def tally_first_digits(text, digits):
+  """
+  Counts the first significant (non-zero) digit of each numeric
+  word in text, adding to digits ('1'..'9' => count). Returns
+  the number of words in text.
+  """
+  words = text.split()
+  for word in words:
+    word = word.translate(PUNCTUATION)
+    if word.isnumeric():
+      #
+      # find the first non-zero digit and count it:
+      #
+      for d in word:
+        if d != '0':
+          digits[d] += 1
+          break
+  return len(words)
+
+
+def save_analyses(dbConn, jobid, status):
+  """
+  Records the status of each of the job's analyses (analysis =>
+  "pending", "completed" or "error").
+  """
+  sql = "update jobs set analyses=%s where jobid=%s;"
+  datatier.perform_action(dbConn, sql, [json.dumps(status), jobid])
+
+
+############################################################
+#
+# the analyses, each returning its section of the results
+# document (without the heading)
+#
+def benford_section(number_of_pages, digits):
+  lines = []
+  lines.append(str(number_of_pages) + " pages\n")
+
+  #
+  # TODO #6 of 8: Write the 10 counts to the file:
+  #
+  lines.append("0 0\n")
+
+  for d in digits.keys():
+    lines.append(str(d) + " " + str(digits[d]) + "\n")
+
+  return "".join(lines)
+
+
+#
+# the Comprehend API each analysis calls:
+#
+COMPREHEND_APIS = {
+  "sentiment": "detect_sentiment",
+  "ner": "detect_entities",
+  "pii": "detect_pii_entities",
+}
+
+
+class PageTexts:
+  """
+  The text of each page of a document, extracted on first use
+  (texts[i]), and how long extraction took.
+  """
+
+  def __init__(self, reader):
+    self.reader = reader
+    self.texts = [None] * len(reader.pages)
+    self.extracted = 0
+    self.extract_secs = 0.0
+    self.lock = threading.Lock()
+
+  def __len__(self):
+    return len(self.texts)
+
+  def __getitem__(self, i):
+    with self.lock:
+      if self.texts[i] is None:
+        start = time.perf_counter()
+        self.texts[i] = self.reader.pages[i].extract_text()
+        self.extract_secs += time.perf_counter() - start
+        self.extracted += 1
+      return self.texts[i]
+
+  def __iter__(self):
+    for i in range(len(self.texts)):
+      yield self[i]
+
+  def cached(self, i):
+    """
+    The page's text if it's been extracted, else None.
+    """
+    with self.lock:
+      return self.texts[i]
+
+
+def comprehend_chunks(name, texts):
+  """
+  The texts an entity analysis sends to Comprehend, one call
+  each, and memoized each (see comprehendcache.py): every page
+  with text, as (page index, text). Sentiment picks its own
+  pages, see sampling.py.
+  """
+  return [(i, text) for (i, text) in enumerate(texts) if text.strip() != ""]
+
+
+def sentiment_section(memo, comprehend, texts, settings):
+  """
+  Sentiment of a sample of the pages (see sampling.py), and what
+  sampling saved over analyzing every page.
+  """
+  def detect(text):
+    return memo.call(comprehend, "detect_sentiment", text)
+
+  summary = sampling.sample_sentiment(detect, texts, settings)
+
+  print("**detect_sentiment:", summary.pages_sampled, "of", summary.pages_total, "pages sampled,",
+        summary.api_calls, "calls**")
+
+  lines = []
+  lines.append("Sentiment: " + summary.sentiment + "\n")
+
+  scores = summary.scores
+  lines.append("Sentiment scores:" + "\n")
+  lines.append("Positive: " + str(scores["Positive"]) + "\n")
+  lines.append("Negative: " + str(scores["Negative"]) + "\n")
+  lines.append("Neutral: " + str(scores["Neutral"]) + "\n")
+  lines.append("Mixed: " + str(scores["Mixed"]) + "\n")
+
+  #
+  # what we saved: the estimates assume the pages we skipped
+  # would cost what the ones we sampled did:
+  #
+  lines.append("Pages sampled: " + str(summary.pages_sampled) + " of " + str(summary.pages_total) + "\n")
+
+  if math.isinf(summary.halfwidth):
+    lines.append("Score margin (95%): n/a\n")
+  else:
+    lines.append("Score margin (95%): +/- " + ("%.3f" % summary.halfwidth) + "\n")
+
+  calls_saved = max(0, summary.pages_total - summary.api_calls)
+  api_saved = 0.0
+  if summary.api_calls > 0:
+    api_saved = calls_saved * summary.api_secs / summary.api_calls
+  lines.append("API calls: " + str(summary.api_calls) + ", saved " + str(calls_saved) +
+               " (est. " + ("%.2f" % api_saved) + " secs)\n")
+
+  pages_skipped = len(texts) - texts.extracted
+  extract_saved = 0.0
+  if texts.extracted > 0:
+    extract_saved = pages_skipped * texts.extract_secs / texts.extracted
+  lines.append("Pages not extracted: " + str(pages_skipped) +
+               " (est. " + ("%.2f" % extract_saved) + " secs saved)\n")
+
+  return "".join(lines)
+
+
+def chunk_entities(memo, comprehend, name, texts, found):
+  """
+  The entities found in each of the analysis's chunks, in page
+  order. They're also kept in found[name], as (page index,
+  entity), for the entities table.
+  """
+  chunks = comprehend_chunks(name, texts)
+
+  responses = memo.call_all(comprehend, COMPREHEND_APIS[name], [text for (i, text) in chunks])
+
+  entities = []
+  paged = []
+  for ((i, text), comprehend_json_obj) in zip(chunks, responses):
+    for entity in comprehend_json_obj['Entities']:
+      entities.append(entity)
+      paged.append((i, entity))
+
+  found[name] = paged
+
+  print("**" + COMPREHEND_APIS[name] + ":", len(chunks), "chunks,", len(entities), "entities**")
+
+  return entities
+
+
+def ner_section(memo, comprehend, texts, found):
+  lines = []
+  for entity in chunk_entities(memo, comprehend, "ner", texts, found):
+    lines.append("Type: " + entity["Type"] + "\n")
+    lines.append("Text: " + entity["Text"] + "\n")
+    lines.append("Score: " + str(entity["Score"]) + "\n\n")
+
+  return "".join(lines)
+
+
+def pii_section(memo, comprehend, texts, found):
+  lines = []
+  for entity in chunk_entities(memo, comprehend, "pii", texts, found):
+    lines.append("Type: " + entity["Type"] + "\n")
+    lines.append("Score: " + str(entity["Score"]) + "\n\n")
+
+  return "".join(lines)
+
+
+COMPREHEND_SECTIONS = {
+  "sentiment": sentiment_section,
+  "ner": ner_section,
+  "pii": pii_section,
+}
+
+
+def remove_local_files(*filenames):
+  """
+  Deletes this invocation's files from /tmp, which is only
+  512MB and survives between invocations of a container.
+  """
+  for filename in filenames:
+    if os.path.exists(filename):
+      os.remove(filename)
+
+
+def analyze_table(local_data, extension, local_results_file, names, input_columns, dbConn, jobid):
+  """
+  Benford analysis of a .csv or .xlsx file, streamed a row at a
+  time (see tabular.py), overall and per column. Writes the
+  results document to local_results_file, and returns the
+  overall digit counts.
+  """
+  print("**PROCESSING local", extension, "**")
+
+  if names != ["benford"]:
+    raise Exception("only benford analysis is supported for " + extension + " files")
+
+  status = {"benford": "pending"}
+  save_analyses(dbConn, jobid, status)
+
+  start = time.perf_counter()
+  table = tabular.tally_file(local_data, extension, input_columns)
+  secs = time.perf_counter() - start
+
+  print("**Tallied", table.rows, "rows in", "%.2f" % secs, "secs,",
+        len(table.picked), "of", len(table.tallies), "columns**")
+
+  #
+  # for a table, the "pages" are its rows:
+  #
+  sql = "update jobs set pages_total=%s where jobid=%s;"
+  datatier.perform_action(dbConn, sql, [table.rows, jobid])
+
+  status["benford"] = "completed"
+  save_analyses(dbConn, jobid, status)
+
+  outfile = open(local_results_file, "w")
+
+  outfile.write("**RESULTS**\n")
+  outfile.write("**" + analyses.TITLES["benford"] + "**\n")
+  outfile.write(tabular.results_section(table))
+
+  outfile.close()
+
+  return table.overall()
+
+
+def analyze_pdf(local_pdf, local_results_file, names, configur, dbConn, jobid, userid):
+  """
+  Runs the job's analyses over a PDF, and writes the results
+  document to local_results_file. Returns the Benford digit
+  counts, or None if the job didn't ask for benford.
+  """
+  #
+  # open LOCAL pdf file:
+  #
+  print("**PROCESSING local PDF**")
+
+  reader = PdfReader(local_pdf)
+  number_of_pages = len(reader.pages)
+
+  #
+  # admission already marked the job as started; record how
+  # many pages there are, so progress is just pages_done, and
+  # that each analysis is pending:
+  #
+  status = {}
+  for name in names:
+    status[name] = "pending"
+
+  sql = "update jobs set pages_total=%s, analyses=%s where jobid=%s;"
+  datatier.perform_action(dbConn, sql, [number_of_pages, json.dumps(status), jobid])
+
+  #
+  # extract each page's text once, for every analysis the job
+  # asked for (see analyses.py). Sentiment samples pages, and
+  # extracts them as it goes, so a sentiment-only job skips
+  # the pages it doesn't sample:
+  #
+  pages_needed = number_of_pages
+  if names == ["sentiment"]:
+    pages_needed = 0
+
+  digits = new_digit_counts()
+  texts = PageTexts(reader)
+  last_progress = time.monotonic()
+
+  #
+  # each page's text is kept for /search as it's extracted,
+  # inserted in batches, except for pii jobs (see textsearch.py):
+  #
+  indexer = textsearch.Indexer(dbConn, jobid, userid, textsearch.should_index(configur, names))
+  indexer.clear()
+
+  for i in range(0, pages_needed):
+    text = texts[i]
+    indexer.add(i, text)
+
+    if "benford" in names:
+      num_words = tally_first_digits(text, digits)
+      print("** Page", i+1, ", text length", len(text), ", num words", num_words)
+    #
+    # now that page has been processed, let's update database to
+    # show progress...
+    #
+    # progress is a single integer column keyed by jobid, and
+    # we write it at most once per PROGRESS_INTERVAL_SECS so
+    # large documents don't turn into a write per page. The
+    # Benford counts so far ride along in the same update, so
+    # /results can show a partial distribution:
+    #
+    now = time.monotonic()
+    if now - last_progress >= PROGRESS_INTERVAL_SECS:
+      partial = json.dumps(digits) if "benford" in names else None
+      sql = "update jobs set pages_done=%s, digits=%s where jobid=%s;"
+      datatier.perform_action(dbConn, sql, [i + 1, partial, jobid])
+      last_progress = now
+
+  sections = {}
+  errors = {}
+
+  if "benford" in names:
+    sections["benford"] = benford_section(number_of_pages, digits)
+    status["benford"] = "completed"
+    save_analyses(dbConn, jobid, status)
+
+  #
+  # the Comprehend analyses are network bound, so run them at
+  # the same time; one failing doesn't fail the others:
+  #
+  comprehend_names = [name for name in names if name in analyses.COMPREHEND_ANALYSES]
+
+  if len(comprehend_names) > 0:
+    comprehend = boto3.client(service_name='comprehend', region_name='us-east-2')
+
+    #
+    # Comprehend calls are memoized per chunk; look up every
+    # chunk the analyses will send, in one query:
+    #
+    memo = comprehendcache.Memo(comprehendcache.get_settings(configur))
+
+    requests = []
+    for name in comprehend_names:
+      if name == "sentiment":
+        continue  # its pages aren't known until it samples them
+      for (i, text) in comprehend_chunks(name, texts):
+        requests.append((COMPREHEND_APIS[name], text))
+
+    try:
+      memo.prefetch(dbConn, requests)
+    except Exception as err:
+      print("**Comprehend cache unavailable:", str(err), "**")
+
+    #
+    # the entity analyses leave their entities here, by
+    # analysis, to be stored once they're all done:
+    #
+    found = {}
+
+    with ThreadPoolExecutor(max_workers=len(comprehend_names)) as pool:
+      futures = {}
+      for name in comprehend_names:
+        args = [memo, comprehend, texts]
+        if name == "sentiment":
+          args.append(sampling.get_settings(configur))
+        else:
+          args.append(found)
+        futures[pool.submit(COMPREHEND_SECTIONS[name], *args)] = name
+
+      for future in as_completed(futures):
+        name = futures[future]
+        try:
+          sections[name] = future.result()
+          status[name] = "completed"
+        except Exception as err:
+          print("**ERROR in", name, "analysis:", str(err), "**")
+          errors[name] = err
+          sections[name] = "error: " + str(err) + "\n"
+          status[name] = "error"
+        save_analyses(dbConn, jobid, status)
+
+    #
+    # a cache we can't write to never fails the job:
+    #
+    try:
+      memo.flush(dbConn)
+    except Exception as err:
+      print("**Comprehend cache not updated:", str(err), "**")
+
+    report = memo.report()
+    print("**COMPREHEND CACHE**", json.dumps(report))
+
+    if len(found) > 0:
+      stored = entitystore.save(dbConn, jobid, userid, found)
+      print("**Stored", stored, "entities**")
+
+    sql = "update jobs set comprehend_report=%s where jobid=%s;"
+    datatier.perform_action(dbConn, sql, [json.dumps(report), jobid])
+
+  #
+  # and the pages extracted since, i.e. those sentiment sampled:
+  #
+  for i in range(pages_needed, number_of_pages):
+    text = texts.cached(i)
+    if text is not None:
+      indexer.add(i, text)
+
+  indexer.flush()
+
+  print("**Indexed", indexer.pages, "pages,", indexer.chars, "chars in", indexer.inserts,
+        "inserts,", "%.2f" % indexer.secs, "secs**")
+
+  #
+  # the job fails only if every analysis did:
+  #
+  if len(errors) == len(names):
+    if len(names) == 1:
+      raise errors[names[0]]
+    raise Exception("every analysis failed: " +
+                    "; ".join(name + ": " + str(errors[name]) for name in names))
+
+  #
+  # analysis complete, write the results to local results file,
+  # a section per analysis:
+  #
+  outfile = open(local_results_file, "w")
+
+  outfile.write("**RESULTS**\n")
+  for name in names:
+    outfile.write("**" + analyses.TITLES[name] + "**\n")
+    outfile.write(sections[name])
+
+  outfile.close()
+
+  return digits if "benford" in names else None
+
+
+@profiling.profiled
 def lambda_handler(event, context):
   try:
     print("**STARTING**")
@@ -33,6 +538,16 @@ def lambda_handler(event, context):
     # so we can write an error message if need be:
     #
     bucketkey_results_file = ""
+    limits = None
+
+    #
+    # local files are named per invocation, so invocations
+    # sharing /tmp (a reused container, or the local emulator)
+    # never clash:
+    #
+    workid = str(uuid.uuid4())
+    local_data = "/tmp/data-" + workid
+    local_results_file = "/tmp/results-" + workid + ".txt"
 
     #
     # setup AWS based on config file:
@@ -64,44 +579,25 @@ def lambda_handler(event, context):
     rds_dbname = configur.get('rds', 'db_name')
 
     #
-    # this function is event-driven by a PDF being
-    # dropped into S3. The bucket key is sent to 
-    # us and obtain as follows:
+    # this function is event-driven by a PDF (or a .csv or
+    # .xlsx, see tabular.py) being dropped into S3. The
+    # bucket key is sent to us and obtain as follows:
     #
     bucketkey = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
 
     print("bucketkey:", bucketkey)
 
+    profiling.note_job(bucketname, bucketkey)
+
     extension = pathlib.Path(bucketkey).suffix
 
-    if extension != ".pdf" : 
-      raise Exception("expecting S3 document to have .pdf extension")
+    if extension != ".pdf" and extension not in tabular.EXTENSIONS:
+      raise Exception("expecting S3 document to have .pdf, .csv or .xlsx extension")
 
-    bucketkey_results_file = bucketkey[0:-4] + ".txt"
+    bucketkey_results_file = bucketkey[0:-len(extension)] + ".txt"
 
     print("bucketkey results file:", bucketkey_results_file)
 
-    #
-    # download PDF from S3 to LOCAL file system:
-    #
-    print("**DOWNLOADING '", bucketkey, "'**")
-
-    #
-    # TODO #1 of 8: where do we write local files? Replace
-    # the ??? with the local directory where we have access.
-    #
-    local_pdf = "/tmp/data.pdf"
-
-    bucket.download_file(bucketkey, local_pdf)
-
-    #
-    # open LOCAL pdf file:
-    #
-    print("**PROCESSING local PDF**")
-
-    reader = PdfReader(local_pdf)
-    number_of_pages = len(reader.pages)
-
     #
     # TODO #2 of 8: update status column in DB for this job,
     # change the value to "processing - starting". Use the
@@ -117,166 +613,88 @@ def lambda_handler(event, context):
     # ???
     #
 
-    sql = "select jobtype from jobs where datafilekey =%s;"
-    jobtype = datatier.retrieve_one_row(dbConn, sql, [bucketkey])[0]
-
-    sql = "update jobs set status=%s where datafilekey=%s;"
-    datatier.perform_action(dbConn, sql, ["processing - starting", bucketkey])
-
+    sql = "select jobid, jobtype, userid, input_columns, status, claimid from jobs where datafilekey =%s;"
+    row = datatier.retrieve_one_row(dbConn, sql, [bucketkey])
+    jobid = row[0]
+    jobtype = row[1]
+    userid = row[2]
+    status = row[4]
 
-    local_results_file = "/tmp/results.txt"
+    names = analyses.parse_jobtype(jobtype)
 
-    outfile = open(local_results_file, "w")
+    #
+    # for .csv and .xlsx, the columns the user asked for, if any:
+    #
+    input_columns = None
+    if row[3] is not None:
+      input_columns = json.loads(row[3])
 
     #
-    # for each page, extract text, split into words,
-    # and see which words are numeric values:
+    # fair-share admission (see scheduler.py): the job only
+    # starts if its user, and the system, have a free slot;
+    # otherwise it's queued, and a later invocation claims it
+    # when a slot frees up. A claimed job arrives already
+    # marked as processing.
     #
-    comprehend = boto3.client(service_name='comprehend', region_name='us-east-2')
-    if jobtype == "sentiment":
-      # text = ""
-      # for i in range(0, number_of_pages):
-      #   page = reader.pages[i]
-      #   text = text + page.extract_text()
-      text = reader.pages[0].extract_text()
-      words = text.split()
-      res = ""
-      for word in words:
-        res += word + " "
-
-      outfile.write("**RESULTS**\n")
-      outfile.write("**Sentiment Analysis**\n")
-
-      comprehend_json_obj = comprehend.detect_sentiment(Text = text, LanguageCode= 'en')
-      json_text = json.dumps(comprehend_json_obj, indent=4)
-      print("json_text:", json_text)
-      sentiment = comprehend_json_obj['Sentiment']
-
-      outfile.write("Sentiment: " + sentiment + "\n")
-
-      scores = comprehend_json_obj['SentimentScore']
-      outfile.write("Sentiment scores:" + "\n")
-      outfile.write("Positive: " + str(scores["Positive"]) + "\n")
-      outfile.write("Negative: " + str(scores["Negative"]) + "\n")
-      outfile.write("Neutral: " + str(scores["Neutral"]) + "\n")
-      outfile.write("Mixed: " + str(scores["Mixed"]) + "\n")
-
-      outfile.close()
-
-
-
-      ## run from here, text = full block. 
-
-    elif jobtype == "ner":
-      text = ""
-      for i in range(0, number_of_pages):
-        page = reader.pages[i]
-        text = text + page.extract_text()
-
-      ## run analysis here
-
-
-
-      ## only take entities above certain threshold?
-
-      outfile.write("**RESULTS**\n")
-      outfile.write("**Name Entity Recognition**\n")
-
-      ## run from here, text = full block. 
-      comprehend_json_obj = comprehend.detect_entities(Text = text, LanguageCode= 'en')
-      json_text = json.dumps(comprehend_json_obj, indent=4)
-      print("json_text:", json_text)
-      entities = comprehend_json_obj['Entities']
-      for entity in entities:
-        outfile.write("Type: " + entity["Type"] + "\n")
-        outfile.write("Text: " + entity["Text"] + "\n")
-        outfile.write("Score: " + str(entity["Score"]) + "\n\n")
-      
-      outfile.close()
-      
-
-    elif jobtype == "pii":
-      text = ""
-      for i in range(0, number_of_pages):
-        page = reader.pages[i]
-        text = text + page.extract_text()
-
-      outfile.write("**RESULTS**\n")
-      outfile.write("**Personally Identifiable Entities**\n")
-
-      ## run from here, text = full block.  
-      comprehend_json_obj = comprehend.detect_pii_entities(Text = text, LanguageCode= 'en')
-      json_text = json.dumps(comprehend_json_obj, indent=4)
-      print("json_text:", json_text)
-      entities = comprehend_json_obj['Entities']
-      for entity in entities:
-        outfile.write("Type: " + entity["Type"] + "\n")
-        outfile.write("Score: " + str(entity["Score"]) + "\n\n")
-        
-      outfile.close()
-      
+    # Events can arrive more than once, so the job is only ours
+    # if our conditional update wins it (uploaded -> processing,
+    # or taking a claimed job); a late duplicate, for a job that
+    # has already left that state, is ignored before any locks:
+    #
+    limits = scheduler.get_limits(configur)
+    scheduler.prepare(dbConn)
+
+    if event.get("claimed") is None:
+      admitted = None
+      if status == "uploaded":
+        admitted = scheduler.admit(dbConn, jobid, userid, limits, workid)
+
+      if admitted == "queued":
+        print("**No free slot, job", jobid, "queued, returning...**")
+        return {
+          'statusCode': 200,
+          'body': json.dumps("queued")
+        }
+
+      ours = admitted == "processing"
     else:
-      digits = {'1': 0, '2': 0, '3': 0, '4': 0, '5': 0, '6': 0, '7': 0, '8': 0, '9': 0}
-      for i in range(0, number_of_pages):
-        page = reader.pages[i]
-        text = page.extract_text()
-        words = text.split()
-        print("** Page", i+1, ", text length", len(text), ", num words", len(words))
-        for word in words:
-          word = word.translate(str.maketrans('', '', string.punctuation))
-          if word.isnumeric():
-            #
-            # find the first non-zero digit and count it:
-            #
-            # TODO #3 of 8: add code to do the counting of digits 1..9
-            #
-            # ???
-            #
-            for d in word:
-              if d is not '0':
-                dig = d
-                digits[dig] += 1
-                break
-        #
-        # now that page has been processed, let's update database to
-        # show progress...
-        #
-        # TODO #4 of 8: update status column in DB for this job,
-        # change the value to "processing - page x of y completed".
-        # Use the bucketkey --- stored as datafilekey in table ---
-        # to identify the row to update. Use the datatier.
-        #
-        # ???
-        #
-        sql = "update jobs set status=%s where datafilekey=%s;"
-        stat = "processing - page " + str(i) + " of " + str(number_of_pages) + " completed"
-        datatier.perform_action(dbConn, sql, [stat, bucketkey])
+      ours = status == "processing" and row[5] is None and scheduler.take(dbConn, jobid, workid)
 
+    if not ours:
+      scheduler.note_duplicate(dbConn, jobid)
+      print("**Job", jobid, "is", status, "and not ours, duplicate event ignored, returning...**")
+      return {
+        'statusCode': 200,
+        'body': json.dumps("duplicate")
+      }
 
-      #
-      # analysis complete, write the results to local results file:
-      #
-      # TODO #5 of 8: where do we write local files? Replace
-      # the ??? with the local directory where we have access.
-      #
+    print("**Job", jobid, "processing**")
 
-      outfile.write("**RESULTS**\n")
-      outfile.write("**Benford Analysis**\n")
-      outfile.write(str(number_of_pages))
-      outfile.write(" pages\n")
+    #
+    # download the PDF (or table) from S3 to LOCAL file system:
+    #
+    print("**DOWNLOADING '", bucketkey, "'**")
 
-      #
-      # TODO #6 of 8: Write the 10 counts to the file:
-      #
-      # ???
-      #
+    #
+    # TODO #1 of 8: where do we write local files? Replace
+    # the ??? with the local directory where we have access.
+    #
+    # local_data = "/tmp/data-<workid>", see above
 
-      outfile.write("0 0\n")
+    bucket.download_file(bucketkey, local_data)
 
-      for d in digits.keys():
-        outfile.write(str(d) + " " + str(digits[d]) + "\n")
+    if extension in tabular.EXTENSIONS:
+      digits = analyze_table(local_data, extension, local_results_file, names, input_columns, dbConn, jobid)
+    else:
+      digits = analyze_pdf(local_data, local_results_file, names, configur, dbConn, jobid, userid)
 
-      outfile.close()
+    #
+    # completed results never change, so their hash makes an
+    # ETag that /results can check without reading S3:
+    #
+    infile = open(local_results_file, "rb")
+    etag = '"' + hashlib.md5(infile.read()).hexdigest() + '"'
+    infile.close()
 
     #
     # upload the results file to S3:
@@ -304,11 +722,25 @@ def lambda_handler(event, context):
     #
     # ???
     #
-    sql = "update jobs set status=%s where datafilekey=%s;"
-    datatier.perform_action(dbConn, sql, ["completed", bucketkey])
-    sql = "update jobs set resultsfilekey=%s where datafilekey=%s;"
-    datatier.perform_action(dbConn, sql, [bucketkey_results_file, bucketkey])
+    # The final Benford counts are stored with the job; the
+    # jobs_digit_counts trigger adds them to the user's totals
+    # in digit_counts as part of this same update. It only
+    # applies while the job is still ours:
+    #
+    sql = """
+      update jobs set status='completed', resultsfilekey=%s, resultsetag=%s,
+                      pages_done=pages_total, digits=%s, finished_at=NOW(3)
+       where jobid=%s and status='processing' and claimid=%s;
+    """
+    modified = datatier.perform_action(dbConn, sql, [bucketkey_results_file, etag,
+                                                     json.dumps(digits) if digits is not None else None,
+                                                     jobid, workid])
+    if modified != 1:
+      print("**Job", jobid, "is no longer ours, not marked completed**")
+
+    remove_local_files(local_data, local_results_file)
 
+    start_queued_jobs(dbConn, limits, bucketname, context)
 
     #
     # done!
@@ -330,16 +762,38 @@ def lambda_handler(event, context):
     print("**ERROR**")
     print(str(err))
 
-    local_results_file = "/tmp/results.txt"
     outfile = open(local_results_file, "w")
 
     outfile.write(str(err))
     outfile.write("\n")
     outfile.close()
 
-    if bucketkey_results_file == "": 
+    #
+    # update jobs row in database:
+    #
+    # TODO #8 of 8: open connection, update job in database
+    # to reflect that an error has occurred. The job is 
+    # identified by the bucketkey --- datafilekey in the 
+    # table. Set the status column to 'error' and set the
+    # resultsfilekey column to the contents of the variable
+    # bucketkey_results_file.
+    #
+    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+    #
+    # only if the job is ours, or no invocation has it yet (we
+    # failed before claiming it): a duplicate that fails must
+    # not mark another invocation's job, or a completed one, as
+    # an error:
+    #
+    sql = """
+      update jobs set status='error', resultsfilekey=%s, finished_at=NOW(3)
+       where datafilekey=%s and status<>'completed' and (claimid is null or claimid=%s);
+    """
+    modified = datatier.perform_action(dbConn, sql, [bucketkey_results_file, bucketkey, workid])
+
+    if bucketkey_results_file == "" or modified != 1: 
       #
-      # we can't upload the error file:
+      # we can't (or mustn't) upload the error file:
       #
       pass
     else:
@@ -355,24 +809,10 @@ def lambda_handler(event, context):
                            'ContentType': 'text/plain'
                          })
 
-    #
-    # update jobs row in database:
-    #
-    # TODO #8 of 8: open connection, update job in database
-    # to reflect that an error has occurred. The job is 
-    # identified by the bucketkey --- datafilekey in the 
-    # table. Set the status column to 'error' and set the
-    # resultsfilekey column to the contents of the variable
-    # bucketkey_results_file.
-    #
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
-    #
-    # ???
-    #
-    sql = "update jobs set status=%s where datafilekey=%s;"
-    datatier.perform_action(dbConn, sql, ["error", bucketkey])
-    sql = "update jobs set resultsfilekey=%s where datafilekey=%s;"
-    datatier.perform_action(dbConn, sql, [bucketkey_results_file, bucketkey])
+    remove_local_files(local_data, local_results_file)
+
+    if limits is not None:
+      start_queued_jobs(dbConn, limits, bucketname, context)
 
     #
     # done, return:
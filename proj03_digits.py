@@ -0,0 +1,135 @@
+#
+# Returns Benford digit counts summed over users' completed
+# benford jobs, from the digit_counts table (one row per user
+# per day, kept up to date as jobs complete; see
+# database_creation.sql), so no results file is ever read.
+#
+# Query parameters (all optional):
+#
+#   userid  only this user
+#   since   jobs finished on or after this day (YYYY-MM-DD)
+#   until   jobs finished before this day (YYYY-MM-DD)
+#   by      user (the default): one entry per user over the
+#           window; or day: one entry per user per day
+#
+# Days are DATE(finished_at), and finished_at is NOW(3) when the
+# job finished, so they're days in the database session's time
+# zone (UTC unless configured otherwise).
+#
+# Each entry is {"userid": ..., "day": ... (by day only),
+# "jobs": N, "numbers": N, "digits": {"1": N, ..., "9": N}}.
+# Either way it's one query, reading at most a row per user per
+# day in the window.
+#
+
+import json
+import os
+import datatier
+
+from configparser import ConfigParser
+
+DIGITS = ['1', '2', '3', '4', '5', '6', '7', '8', '9']
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_digits**")
+
+    #
+    # setup AWS based on config file:
+    #
+    config_file = 'benfordapp-config.ini'
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+    configur = ConfigParser()
+    configur.read(config_file)
+
+    #
+    # configure for RDS access
+    #
+    rds_endpoint = configur.get('rds', 'endpoint')
+    rds_portnum = int(configur.get('rds', 'port_number'))
+    rds_username = configur.get('rds', 'user_name')
+    rds_pwd = configur.get('rds', 'user_pwd')
+    rds_dbname = configur.get('rds', 'db_name')
+
+    params = event.get("queryStringParameters") or {}
+
+    by = params.get("by", "user")
+
+    print("params:", params)
+
+    if by not in ["user", "day"]:
+      raise Exception("by must be user or day")
+
+    #
+    # build the WHERE clause from the filters given:
+    #
+    conditions = []
+    values = []
+
+    if params.get("userid") is not None:
+      conditions.append("userid = %s")
+      values.append(int(params["userid"]))
+
+    if params.get("since") is not None:
+      conditions.append("day >= %s")
+      values.append(params["since"])
+
+    if params.get("until") is not None:
+      conditions.append("day < %s")
+      values.append(params["until"])
+
+    where = ""
+    if len(conditions) > 0:
+      where = "WHERE " + " AND ".join(conditions)
+
+    group = "userid" if by == "user" else "userid, day"
+
+    sql = """
+      SELECT """ + group + """, SUM(jobs),
+             SUM(d1), SUM(d2), SUM(d3), SUM(d4), SUM(d5), SUM(d6), SUM(d7), SUM(d8), SUM(d9)
+        FROM digit_counts
+      """ + where + """
+       GROUP BY """ + group + """
+       ORDER BY """ + group + """;
+    """
+
+    print("**Opening connection**")
+
+    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+
+    print("**Summing digit counts**")
+
+    rows = datatier.retrieve_all_rows(dbConn, sql, values)
+
+    result = []
+    for row in rows:
+      entry = {"userid": row[0]}
+      if by == "day":
+        entry["day"] = str(row[1])
+        row = row[1:]
+
+      counts = [int(n) for n in row[2:11]]
+
+      entry["jobs"] = int(row[1])
+      entry["numbers"] = sum(counts)
+      entry["digits"] = dict(zip(DIGITS, counts))
+      result.append(entry)
+
+    print("**DONE, returning", len(result), "entries**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps(result)
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
@@ -1,21 +1,123 @@
 #
 # Downloads the requested job from the BenfordApp DB, checks
 # the status, and based on the status returns results
-# to the client. The status can be: uploaded, processing,
-# completed, or error. In the case of completed, the 
+# to the client. The status can be: uploaded, queued,
+# processing, completed, or error. In the case of completed, the 
 # analysis results are returned as a list. In the case
 # of error, the error message from the results file is
 # returned.
 #
+# Completed results are returned base64 encoded inside JSON by
+# default. Clients that send "Accept: text/plain" get the raw
+# results instead, compressed per their Accept-Encoding header
+# (see transport.py).
+#
+# Completed results carry an ETag (computed by proj03_compute and
+# stored in the jobs table). A request with a matching
+# If-None-Match header gets a 304 straight from the database,
+# without reading the results from S3.
+#
+# Passing ?wait=N long-polls: if the job is still uploaded or
+# processing, the function keeps checking the job's row until
+# it finishes or N seconds pass, and only then responds.
+#
+# While a Benford job is processing, the status message is
+# followed by the digit counts so far (jobs.digits, written by
+# compute with its progress), in the same form as the results,
+# e.g.
+#
+#   processing - page 120 of 800 completed
+#   **PARTIAL RESULTS**
+#   **Benford Analysis**
+#   120 pages
+#   0 0
+#   1 5120
+#   ...
+#
 
 import json
 import boto3
 import os
+import uuid
 import base64
+import time
 import datatier
+import transport
+import authtoken
+import profiling
 
 from configparser import ConfigParser
 
+#
+# long-poll limits: API Gateway times out at 29 seconds, so
+# never wait longer than this, and re-check the job row with
+# a backoff between these two delays:
+#
+MAX_WAIT_SECS = 25.0
+MIN_POLL_SECS = 0.1
+MAX_POLL_SECS = 1.0
+
+
+def is_pending(status):
+  """
+  True if the job has not finished yet, i.e. no results.
+  """
+  return status == "uploaded" or status == "queued" or status == "processing"
+
+
+def describe_status(status, pages_done, pages_total, digits=None):
+  """
+  Formats a pending job's status for the client, e.g.
+  "processing - page 3 of 40 completed", followed by the Benford
+  counts so far if there are any (digits, as JSON).
+  """
+  if status != "processing":
+    return status
+  if pages_total == 0:
+    return "processing - starting"
+
+  msg = "processing - page " + str(pages_done) + " of " + str(pages_total) + " completed"
+
+  if digits is None:
+    return msg
+
+  digits = json.loads(digits)
+
+  lines = [msg + "\n"]
+  lines.append("**PARTIAL RESULTS**\n")
+  lines.append("**Benford Analysis**\n")
+  lines.append(str(pages_done) + " pages\n")
+  lines.append("0 0\n")
+  for d in sorted(digits.keys()):
+    lines.append(str(d) + " " + str(digits[d]) + "\n")
+
+  return "".join(lines)
+
+
+def get_wait_secs(event, context):
+  """
+  Returns how long the caller is willing to wait for the job
+  to finish (the "wait" query parameter), capped by the API
+  Gateway limit and the time this invocation has left.
+  """
+  params = event.get("queryStringParameters") or {}
+
+  try:
+    wait = float(params.get("wait", 0))
+  except ValueError:
+    raise Exception("wait parameter must be a number of seconds")
+
+  wait = max(0.0, min(wait, MAX_WAIT_SECS))
+
+  if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+    # leave a couple of seconds to download and return results:
+    remaining = context.get_remaining_time_in_millis() / 1000.0 - 2.0
+    wait = max(0.0, min(wait, remaining))
+
+  return wait
+
+
+@profiling.profiled
 def lambda_handler(event, context):
   try:
     print("**STARTING**")
@@ -80,7 +182,12 @@ def lambda_handler(event, context):
     #
     print("**Checking if jobid is valid**")
 
-    sql = "SELECT * FROM jobs WHERE jobid = %s;"
+    sql = """
+      SELECT status, datafilekey, resultsfilekey, pages_done, pages_total, userid, resultsetag,
+             digits
+        FROM jobs
+       WHERE jobid = %s;
+    """
 
     row = datatier.retrieve_one_row(dbConn, sql, [jobid])
 
@@ -91,20 +198,66 @@ def lambda_handler(event, context):
         'body': json.dumps("no such job...")
       }
 
+    profiling.note_job(bucketname, row[1])
+
+    #
+    # if the caller sent a session token (see authtoken.py), it
+    # must be valid and issued to the job's owner:
+    #
+    try:
+      token_userid = authtoken.authenticate(event, configur, dbConn)
+    except authtoken.AuthError as err:
+      print("**Not authorized, returning...**")
+      return authtoken.unauthorized(err)
+
+    if token_userid is not None and token_userid != row[5]:
+      print("**Token is for a different user, returning...**")
+      return authtoken.unauthorized("job " + str(jobid) + " belongs to another user")
+
+    #
+    # long-poll while the job is pending, if asked to. We only
+    # re-read the job's row by primary key, backing off between
+    # checks. Committing ends the read snapshot, otherwise we
+    # would keep seeing the status from our first query:
+    #
+    wait = get_wait_secs(event, context)
+
+    if wait > 0 and is_pending(row[0]):
+      print("**Waiting up to", wait, "secs for job to finish**")
+
+      deadline = time.monotonic() + wait
+      delay = MIN_POLL_SECS
+
+      while is_pending(row[0]):
+        now = time.monotonic()
+        if now >= deadline:
+          break
+
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * 2, MAX_POLL_SECS)
+
+        dbConn.commit()
+        row = datatier.retrieve_one_row(dbConn, sql, [jobid])
+
     print(row)
 
-    status = row[2]
-    original_data_file = row[4]
-    results_file_key = row[6]
+    status = row[0]
+    original_data_file = row[1]
+    results_file_key = row[2]
+    pages_done = row[3]
+    pages_total = row[4]
+    results_etag = row[6]
+    digits = row[7]
 
     print("job status:", status)
     print("original data file:", original_data_file)
     print("results file key:", results_file_key)
 
     #
-    # what's the status of the job? There should be 4 cases:
+    # what's the status of the job? There should be 5 cases:
     #   uploaded
-    #   processing - ...
+    #   queued (waiting for a free slot, see scheduler.py)
+    #   processing (with pages_done of pages_total)
     #   completed
     #   error
     #
@@ -116,14 +269,22 @@ def lambda_handler(event, context):
         'body': json.dumps(status)
       }
 
-    if status.startswith("processing"):
-      print("**No results yet, returning...**")
+    if status == "queued":
+      print("**No results yet, job is waiting for a free slot, returning...**")
       #
       return {
         'statusCode': 400,
         'body': json.dumps(status)
       }
 
+    if status == "processing":
+      print("**No results yet, returning...**")
+      #
+      return {
+        'statusCode': 400,
+        'body': json.dumps(describe_status(status, pages_done, pages_total, digits))
+      }
+
     #
     # completed or error, these should have results:
     #
@@ -141,7 +302,7 @@ def lambda_handler(event, context):
           'body': json.dumps("error: unknown")
         }
 
-      local_filename = "/tmp/results.txt"
+      local_filename = "/tmp/results-" + str(uuid.uuid4()) + ".txt"
       #
       print("**Job status 'error', downloading error results from S3**")
       #
@@ -150,6 +311,7 @@ def lambda_handler(event, context):
       infile = open(local_filename, "r")
       lines = infile.readlines()
       infile.close()
+      os.remove(local_filename)
       #
       if len(lines) == 0:
         print("**Job status 'unknown error', given empty results file, returning...**")
@@ -184,10 +346,34 @@ def lambda_handler(event, context):
       }
 
     #
-    # if we get here, the job completed. So we should have results
-    # to download and return to the user:
-    #      
-    local_filename = "/tmp/results.txt"
+    # if we get here, the job completed. If the client already
+    # has this version we can say so without touching S3. Caches
+    # may keep the results but must revalidate every time
+    # (no-cache): job ids start over after /reset, so the same
+    # URL can later name a different job's results:
+    #
+    cache_headers = {}
+    if results_etag is not None:
+      cache_headers = {
+        "ETag": results_etag,
+        "Cache-Control": "private, no-cache"
+      }
+
+      if transport.get_header(event, "If-None-Match") == results_etag:
+        print("**DONE, client has current results, returning 304**")
+        #
+        return {
+          'statusCode': 304,
+          'headers': cache_headers,
+          'body': ""
+        }
+
+    #
+    # otherwise we have results to download and return to the
+    # user. The local file is named per invocation, so
+    # invocations sharing /tmp never clash:
+    #
+    local_filename = "/tmp/results-" + str(uuid.uuid4()) + ".txt"
 
     print("**Downloading results from S3**")
 
@@ -211,12 +397,22 @@ def lambda_handler(event, context):
     infile = open(local_filename, "rb")
     bytes = infile.read()
     infile.close()
+    os.remove(local_filename)
+
+    #
+    # does the client accept raw (possibly compressed) results?
+    #
+    if transport.wants_binary(event):
+      print("**DONE, returning binary results**")
+      #
+      return transport.binary_response(bytes, event, extra_headers=cache_headers)
 
     #
-    # now encode the data as base64. Note b64encode returns
-    # a bytes object, not a string. So then we have to convert
-    # (decode) the bytes -> string, and then we can serialize
-    # the string as JSON for download:
+    # otherwise fall back to JSON, and encode the data as
+    # base64. Note b64encode returns a bytes object, not a
+    # string. So then we have to convert (decode) the bytes ->
+    # string, and then we can serialize the string as JSON for
+    # download:
     #
     data = base64.b64encode(bytes)
     datastr = data.decode()
@@ -229,6 +425,7 @@ def lambda_handler(event, context):
     #
     return {
       'statusCode': 200,
+      'headers': cache_headers,
       'body': json.dumps(datastr)
     }
 
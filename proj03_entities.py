@@ -0,0 +1,197 @@
+#
+# Searches the entities found by jobs' NER and PII analyses (the
+# entities table, see entitystore.py), one page at a time using
+# keyset pagination, e.g. which jobs mention ACME Corp, or which
+# jobs contained SSNs:
+#
+#   GET /entities?text=acme corp
+#   GET /entities?analysis=pii&type=SSN&userid=80001
+#
+# Query parameters (all optional):
+#
+#   text         entity text, matched after normalizing (case
+#                and whitespace), e.g. "ACME  corp" = "acme corp"
+#   prefix       entity text starting with this, normalized
+#   type         entity type, e.g. ORGANIZATION, PERSON, SSN
+#   analysis     ner or pii
+#   jobid
+#   userid       the caller's userid (must match the token)
+#   min_score    only entities scored at least this
+#   after        return entities with entityid > after, i.e. the
+#                "next" value of the previous page
+#   limit        page size, default 100, at most 1000
+#
+# A session token is required (see authtoken.py), and only the
+# token's user's entities are returned.
+#
+# Returns {"rows": [...], "next": entityid or null}. Each row is
+# {"entityid", "jobid", "userid", "analysis", "type", "text",
+# "score", "page", "begin_offset", "end_offset"}.
+#
+# Each of text, type, jobid and userid (with or without type)
+# leads an index ending in entityid, so a page costs the same
+# however many entities there are. A prefix match reads every
+# matching entity before ordering them, so it's best kept
+# specific, or paired with a jobid.
+#
+
+import json
+import os
+import datatier
+import authtoken
+import entitystore
+
+from configparser import ConfigParser
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+COLUMNS = ["entityid", "jobid", "userid", "analysis", "type", "text",
+           "score", "page", "begin_offset", "end_offset"]
+
+
+def get_limit(params):
+  """
+  Returns the page size requested in the query string, within
+  1..MAX_LIMIT.
+  """
+  try:
+    limit = int(params.get("limit", DEFAULT_LIMIT))
+  except ValueError:
+    raise Exception("limit must be an integer")
+
+  return max(1, min(limit, MAX_LIMIT))
+
+
+def like_prefix(prefix):
+  """
+  "10%" => "10!%%", a LIKE pattern (escaped with !) matching
+  strings that start with prefix.
+  """
+  escaped = prefix.replace("!", "!!").replace("%", "!%").replace("_", "!_")
+  return escaped + "%"
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_entities**")
+
+    #
+    # setup AWS based on config file:
+    #
+    config_file = 'benfordapp-config.ini'
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+    configur = ConfigParser()
+    configur.read(config_file)
+
+    #
+    # configure for RDS access
+    #
+    rds_endpoint = configur.get('rds', 'endpoint')
+    rds_portnum = int(configur.get('rds', 'port_number'))
+    rds_username = configur.get('rds', 'user_name')
+    rds_pwd = configur.get('rds', 'user_pwd')
+    rds_dbname = configur.get('rds', 'db_name')
+
+    params = event.get("queryStringParameters") or {}
+
+    print("params:", params)
+
+    limit = get_limit(params)
+
+    print("**Opening connection**")
+
+    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+
+    #
+    # the caller must be logged in, and only sees their own
+    # jobs' entities:
+    #
+    try:
+      token_userid = authtoken.require(event, configur, dbConn)
+    except authtoken.AuthError as err:
+      print("**Not authorized, returning...**")
+      return authtoken.unauthorized(err)
+
+    if "userid" in params and str(params["userid"]) != str(token_userid):
+      print("**Token is for a different user, returning...**")
+      return authtoken.unauthorized("token was not issued to user " + str(params["userid"]))
+
+    #
+    # build the WHERE clause from the filters given:
+    #
+    conditions = ["userid = %s"]
+    values = [token_userid]
+
+    if "after" in params:
+      conditions.append("entityid > %s")
+      values.append(int(params["after"]))
+
+    if "text" in params:
+      conditions.append("text = %s")
+      values.append(entitystore.normalize(params["text"]))
+
+    if "prefix" in params:
+      conditions.append("text LIKE %s ESCAPE '!'")
+      values.append(like_prefix(entitystore.normalize(params["prefix"])))
+
+    if "type" in params:
+      conditions.append("type = %s")
+      values.append(params["type"].upper())
+
+    if "analysis" in params:
+      if params["analysis"] not in ["ner", "pii"]:
+        raise Exception("analysis must be ner or pii")
+      conditions.append("analysis = %s")
+      values.append(params["analysis"])
+
+    if "jobid" in params:
+      conditions.append("jobid = %s")
+      values.append(int(params["jobid"]))
+
+    if "min_score" in params:
+      conditions.append("score >= %s")
+      values.append(float(params["min_score"]))
+
+    where = "WHERE " + " AND ".join(conditions)
+
+    #
+    # fetch one extra row to learn if there is another page:
+    #
+    sql = """
+      SELECT """ + ", ".join(COLUMNS) + """
+        FROM entities
+      """ + where + """
+       ORDER BY entityid
+       LIMIT %s;
+    """
+    values.append(limit + 1)
+
+    print("**Retrieving entities**")
+
+    rows = datatier.retrieve_all_rows(dbConn, sql, values)
+
+    next = None
+    if len(rows) > limit:
+      rows = rows[0:limit]
+      next = rows[-1][0]
+
+    result = [dict(zip(COLUMNS, row)) for row in rows]
+
+    print("**DONE, returning", len(result), "rows**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps({"rows": result, "next": next})
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
@@ -0,0 +1,390 @@
+#
+# Exports the results of many completed jobs as one zip archive,
+# instead of a /results call per job:
+#
+#   GET /export?userid=80001
+#   GET /export?jobids=1001,1002,1017
+#
+# Query parameters:
+#
+#   userid  all of this user's completed jobs, or
+#   jobids  these jobs (comma-separated), those completed
+#   after   only jobs with jobid > after, i.e. the "next" value
+#           of a previous export
+#
+# A session token is required (see authtoken.py), and only the
+# token's user's jobs can be exported: another userid, or any
+# jobid of another user's, is refused.
+#
+# The archive holds one entry per job, "<jobid>-<original
+# filename>.txt", with the job's results. It's written straight
+# into an S3 multipart upload as it's built: the results are
+# read from S3 concurrently, a few ahead of the one being
+# compressed, and the zip is uploaded a part at a time, so no
+# file is ever staged in /tmp and memory holds at most a window
+# of results and a few parts. API Gateway can't return a body
+# this size, so the response is a presigned URL the client
+# downloads the archive from:
+#
+#   {"url": ..., "key": ..., "jobs": N, "bytes": N, "missing":
+#    [jobids whose results file was gone], "next": jobid or null}
+#
+# An export covers at most MAX_JOBS jobs; if there are more,
+# "next" is set and the rest can be exported with after=next.
+#
+# Settings come from the [export] section of the config file:
+#
+#   [export]
+#   workers = 16
+#   part_mb = 8
+#   url_expiry_secs = 3600
+#
+# NOTE: exports are written under EXPORT_PREFIX, which should
+# have an S3 lifecycle rule expiring objects after a day or so;
+# nothing else deletes them.
+#
+
+import json
+import boto3
+import os
+import uuid
+import pathlib
+import re
+import zipfile
+import datatier
+import authtoken
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+
+EXPORT_PREFIX = "benfordapp/exports/"
+
+MAX_JOBS = 5000
+MAX_JOBIDS = 1000
+
+DEFAULT_WORKERS = 16
+DEFAULT_PART_MB = 8
+DEFAULT_URL_EXPIRY_SECS = 3600
+
+#
+# S3 rejects parts smaller than this, except the last:
+#
+MIN_PART_BYTES = 5 * 1024 * 1024
+
+#
+# parts being uploaded at once, while the zip carries on:
+#
+MAX_PARTS_IN_FLIGHT = 4
+
+UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+class MultipartWriter:
+  """
+  A write-only stream into an S3 multipart upload. Writes are
+  buffered into parts of part_bytes, each uploaded by the pool
+  while writing carries on; close() uploads the last part and
+  completes the upload, abort() abandons it.
+  """
+
+  def __init__(self, s3client, bucketname, key, part_bytes, pool):
+    self.s3client = s3client
+    self.bucketname = bucketname
+    self.key = key
+    self.part_bytes = max(part_bytes, MIN_PART_BYTES)
+    self.pool = pool
+    self.buffer = bytearray()
+    self.pending = deque()
+    self.parts = []
+    self.bytes = 0
+
+    response = s3client.create_multipart_upload(Bucket=bucketname, Key=key,
+                                                ContentType="application/zip")
+    self.upload_id = response["UploadId"]
+
+  def write(self, data):
+    self.buffer += data
+    self.bytes += len(data)
+
+    while len(self.buffer) >= self.part_bytes:
+      self.upload_part(bytes(self.buffer[0:self.part_bytes]))
+      del self.buffer[0:self.part_bytes]
+
+    return len(data)
+
+  def flush(self):
+    pass
+
+  def upload_part(self, data):
+    #
+    # at most MAX_PARTS_IN_FLIGHT parts in memory, waiting for
+    # the oldest first:
+    #
+    if len(self.pending) >= MAX_PARTS_IN_FLIGHT:
+      self.parts.append(self.pending.popleft().result())
+
+    number = len(self.parts) + len(self.pending) + 1
+    self.pending.append(self.pool.submit(self.put_part, number, data))
+
+  def put_part(self, number, data):
+    response = self.s3client.upload_part(Bucket=self.bucketname, Key=self.key,
+                                         UploadId=self.upload_id, PartNumber=number, Body=data)
+    return {"PartNumber": number, "ETag": response["ETag"]}
+
+  def close(self):
+    """
+    Uploads what's left as the last part, and completes the
+    upload.
+    """
+    if len(self.buffer) > 0 or len(self.parts) + len(self.pending) == 0:
+      self.upload_part(bytes(self.buffer))
+      self.buffer = bytearray()
+
+    while len(self.pending) > 0:
+      self.parts.append(self.pending.popleft().result())
+
+    self.s3client.complete_multipart_upload(Bucket=self.bucketname, Key=self.key,
+                                            UploadId=self.upload_id,
+                                            MultipartUpload={"Parts": self.parts})
+
+  def abort(self):
+    """
+    Abandons the upload, so S3 discards the parts.
+    """
+    for future in self.pending:
+      future.cancel()
+
+    try:
+      self.s3client.abort_multipart_upload(Bucket=self.bucketname, Key=self.key,
+                                           UploadId=self.upload_id)
+    except Exception as err:
+      print("**Could not abort upload of", self.key, ":", str(err), "**")
+
+
+def parse_jobids(value):
+  """
+  "1001, 1002" => [1001, 1002]
+  """
+  try:
+    jobids = [int(jobid) for jobid in value.split(",") if jobid.strip() != ""]
+  except ValueError:
+    raise Exception("jobids must be a comma-separated list of job ids")
+
+  if len(jobids) == 0:
+    raise Exception("jobids must list at least one job id")
+  if len(jobids) > MAX_JOBIDS:
+    raise Exception("at most " + str(MAX_JOBIDS) + " jobids per export")
+
+  return jobids
+
+
+def entry_name(jobid, originaldatafile):
+  """
+  The job's file name in the archive, e.g. 1001-report.txt.
+  """
+  stem = UNSAFE_CHARS.sub("_", pathlib.Path(originaldatafile).stem)
+  return str(jobid) + "-" + stem + ".txt"
+
+
+def read_results(s3client, bucketname, key):
+  """
+  The results file's bytes, or None if it no longer exists.
+  """
+  try:
+    return s3client.get_object(Bucket=bucketname, Key=key)["Body"].read()
+  except s3client.exceptions.NoSuchKey:
+    return None
+
+
+def write_archive(s3client, bucketname, rows, outfile, workers):
+  """
+  Writes a zip of the results of rows, (jobid, originaldatafile,
+  resultsfilekey), in order, into outfile, reading up to workers
+  results files at once.
+
+  Returns
+  -------
+  list of the jobids whose results were missing
+  """
+  missing = []
+
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    with zipfile.ZipFile(outfile, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+      window = deque()
+      rows = iter(rows)
+
+      while True:
+        #
+        # keep a window of reads ahead of the one we're writing:
+        #
+        for row in rows:
+          window.append((row, pool.submit(read_results, s3client, bucketname, row[2])))
+          if len(window) >= 2 * workers:
+            break
+
+        if len(window) == 0:
+          break
+
+        ((jobid, originaldatafile, resultsfilekey), future) = window.popleft()
+
+        data = future.result()
+        if data is None:
+          missing.append(jobid)
+          continue
+
+        archive.writestr(entry_name(jobid, originaldatafile), data)
+
+  return missing
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_export**")
+
+    #
+    # setup AWS based on config file:
+    #
+    config_file = 'benfordapp-config.ini'
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+    configur = ConfigParser()
+    configur.read(config_file)
+
+    #
+    # configure for S3 access:
+    #
+    s3_profile = 's3readwrite'
+    boto3.setup_default_session(profile_name=s3_profile)
+
+    bucketname = configur.get('s3', 'bucket_name')
+
+    s3client = boto3.client('s3')
+
+    workers = int(configur.get('export', 'workers', fallback=DEFAULT_WORKERS))
+    part_bytes = int(configur.get('export', 'part_mb', fallback=DEFAULT_PART_MB)) * 1024 * 1024
+    expiry_secs = int(configur.get('export', 'url_expiry_secs', fallback=DEFAULT_URL_EXPIRY_SECS))
+
+    #
+    # configure for RDS access
+    #
+    rds_endpoint = configur.get('rds', 'endpoint')
+    rds_portnum = int(configur.get('rds', 'port_number'))
+    rds_username = configur.get('rds', 'user_name')
+    rds_pwd = configur.get('rds', 'user_pwd')
+    rds_dbname = configur.get('rds', 'db_name')
+
+    params = event.get("queryStringParameters") or {}
+
+    print("params:", params)
+
+    print("**Opening connection**")
+
+    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+
+    #
+    # the caller must be logged in, and only gets their own jobs:
+    #
+    try:
+      token_userid = authtoken.require(event, configur, dbConn)
+    except authtoken.AuthError as err:
+      print("**Not authorized, returning...**")
+      return authtoken.unauthorized(err)
+
+    #
+    # which jobs: the user's, or a list of them:
+    #
+    conditions = ["status = 'completed'", "userid = %s"]
+    values = [token_userid]
+
+    if "userid" in params:
+      if str(params["userid"]) != str(token_userid):
+        print("**Token is for a different user, returning...**")
+        return authtoken.unauthorized("token was not issued to user " + str(params["userid"]))
+    elif "jobids" in params:
+      jobids = parse_jobids(params["jobids"])
+      placeholders = ", ".join(["%s"] * len(jobids))
+
+      sql = "SELECT jobid FROM jobs WHERE jobid IN (" + placeholders + ") AND userid <> %s;"
+      others = datatier.retrieve_all_rows(dbConn, sql, jobids + [token_userid])
+
+      if len(others) > 0:
+        print("**Jobs of another user requested, returning...**")
+        return authtoken.unauthorized("jobs " + ", ".join(str(row[0]) for row in others) +
+                                      " belong to another user")
+
+      conditions.append("jobid IN (" + placeholders + ")")
+      values.extend(jobids)
+    else:
+      raise Exception("requires userid or jobids parameter")
+
+    if "after" in params:
+      conditions.append("jobid > %s")
+      values.append(int(params["after"]))
+
+    #
+    # fetch one extra row to learn if there are more:
+    #
+    sql = """
+      SELECT jobid, originaldatafile, resultsfilekey
+        FROM jobs
+       WHERE """ + " AND ".join(conditions) + """
+       ORDER BY jobid
+       LIMIT %s;
+    """
+    values.append(MAX_JOBS + 1)
+
+    rows = datatier.retrieve_all_rows(dbConn, sql, values)
+
+    next = None
+    if len(rows) > MAX_JOBS:
+      rows = rows[0:MAX_JOBS]
+      next = rows[-1][0]
+
+    if len(rows) == 0:
+      raise Exception("no completed jobs to export")
+
+    #
+    # build the archive, straight into S3:
+    #
+    key = EXPORT_PREFIX + str(uuid.uuid4()) + ".zip"
+
+    print("**Exporting", len(rows), "jobs to", key, "**")
+
+    with ThreadPoolExecutor(max_workers=MAX_PARTS_IN_FLIGHT) as upload_pool:
+      outfile = MultipartWriter(s3client, bucketname, key, part_bytes, upload_pool)
+      try:
+        missing = write_archive(s3client, bucketname, rows, outfile, workers)
+        outfile.close()
+      except Exception:
+        outfile.abort()
+        raise
+
+    url = s3client.generate_presigned_url('get_object',
+                                          Params={'Bucket': bucketname, 'Key': key},
+                                          ExpiresIn=expiry_secs)
+
+    print("**DONE,", outfile.bytes, "bytes in", len(outfile.parts), "parts,",
+          len(missing), "missing, returning url**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps({
+        "url": url,
+        "key": key,
+        "jobs": len(rows) - len(missing),
+        "bytes": outfile.bytes,
+        "missing": missing,
+        "next": next
+      })
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
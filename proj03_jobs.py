@@ -0,0 +1,196 @@
+#
+# Lists jobs in the BenfordApp database one page at a time,
+# using keyset pagination so every page costs the same no
+# matter how deep into the table the caller is.
+#
+# Query parameters (all optional):
+#
+#   userid, status           filter on the column
+#   jobtype                  jobs running this analysis, e.g. ner
+#                            also matches "benford,ner" jobs; or
+#                            several, "ner,pii", jobs running all
+#                            of them (see analyses.py)
+#   since, until             filter on created_at (UTC), since
+#                            inclusive and until exclusive
+#   after                    the "next" value of the previous page
+#   limit                    page size, default 100, at most 1000
+#
+# Without since/until, jobs come in jobid order and "next" is the
+# last jobid. With either, they come in (created_at, jobid) order,
+# so the jobs_created_at (created_at, jobid) index serves both the
+# range and the order, and "next" is "<created_at>,<jobid>".
+#
+# Returns {"rows": [...], "next": cursor or null}. Each row is
+# [jobid, userid, status, jobtype, originaldatafile,
+#  datafilekey, resultsfilekey, created_at].
+#
+
+import json
+import os
+import datatier
+import analyses
+
+from configparser import ConfigParser
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def get_limit(params):
+  """
+  Returns the page size requested in the query string, within
+  1..MAX_LIMIT.
+  """
+  try:
+    limit = int(params.get("limit", DEFAULT_LIMIT))
+  except ValueError:
+    raise Exception("limit must be an integer")
+
+  return max(1, min(limit, MAX_LIMIT))
+
+
+def parse_after(after, by_created):
+  """
+  The "after" cursor: a jobid, or when paging by created_at,
+  (created_at, jobid).
+  """
+  try:
+    if not by_created:
+      return int(after)
+
+    (created_at, jobid) = str(after).rsplit(",", 1)
+    return (created_at, int(jobid))
+  except ValueError:
+    raise Exception("after must be the 'next' value of the previous page")
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_jobs**")
+
+    #
+    # setup AWS based on config file:
+    #
+    config_file = 'benfordapp-config.ini'
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+    configur = ConfigParser()
+    configur.read(config_file)
+
+    #
+    # configure for RDS access
+    #
+    rds_endpoint = configur.get('rds', 'endpoint')
+    rds_portnum = int(configur.get('rds', 'port_number'))
+    rds_username = configur.get('rds', 'user_name')
+    rds_pwd = configur.get('rds', 'user_pwd')
+    rds_dbname = configur.get('rds', 'db_name')
+
+    params = event.get("queryStringParameters") or {}
+
+    limit = get_limit(params)
+
+    #
+    # build the WHERE clause from the filters given. userid,
+    # status and jobtype pair with a (column, jobid) index in the
+    # schema, so the keyset condition on jobid stays an index
+    # range (one per jobtype); a created_at range pages on
+    # (created_at, jobid) instead, to stay within jobs_created_at:
+    #
+    by_created = "since" in params or "until" in params
+
+    conditions = []
+    values = []
+
+    if "after" in params:
+      after = parse_after(params["after"], by_created)
+      if by_created:
+        conditions.append("(created_at > %s OR (created_at = %s AND jobid > %s))")
+        values.extend([after[0], after[0], after[1]])
+      else:
+        conditions.append("jobid > %s")
+        values.append(after)
+
+    if "userid" in params:
+      conditions.append("userid = %s")
+      values.append(params["userid"])
+
+    if "status" in params:
+      conditions.append("status = %s")
+      values.append(params["status"])
+
+    #
+    # a job's jobtype lists its analyses, "benford,ner", so ask
+    # for every stored jobtype that includes the ones requested
+    # (at most 8), which jobs_jobtype_jobid looks up directly:
+    #
+    if "jobtype" in params:
+      jobtypes = analyses.jobtypes_including(analyses.parse_jobtype(params["jobtype"]))
+      conditions.append("jobtype IN (" + ", ".join(["%s"] * len(jobtypes)) + ")")
+      values.extend(jobtypes)
+
+    if "since" in params:
+      conditions.append("created_at >= %s")
+      values.append(params["since"])
+
+    if "until" in params:
+      conditions.append("created_at < %s")
+      values.append(params["until"])
+
+    where = ""
+    if len(conditions) > 0:
+      where = "WHERE " + " AND ".join(conditions)
+
+    order = "created_at, jobid" if by_created else "jobid"
+
+    #
+    # fetch one extra row to learn if there is another page:
+    #
+    sql = """
+      SELECT jobid, userid, status, jobtype, originaldatafile,
+             datafilekey, resultsfilekey, created_at
+        FROM jobs
+      """ + where + """
+       ORDER BY """ + order + """
+       LIMIT %s;
+    """
+    values.append(limit + 1)
+
+    print("**Opening connection**")
+
+    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+
+    print("**Retrieving jobs**")
+
+    rows = datatier.retrieve_all_rows(dbConn, sql, values)
+
+    next = None
+    if len(rows) > limit:
+      rows = rows[0:limit]
+      if by_created:
+        next = str(rows[-1][7]) + "," + str(rows[-1][0])
+      else:
+        next = rows[-1][0]
+
+    result = []
+    for row in rows:
+      row = list(row)
+      row[7] = str(row[7])  # datetime -> string for JSON
+      result.append(row)
+
+    print("**DONE, returning", len(result), "rows**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps({"rows": result, "next": next})
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
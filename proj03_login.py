@@ -0,0 +1,158 @@
+#
+# Logs a user in: checks the password against users.pwdhash,
+# and returns a signed, expiring session token (see
+# authtoken.py). Other functions verify the token locally, so
+# the password hash is only checked here, once per session.
+#
+#   POST   /login   body {"username": ..., "password": ...}
+#                   returns {"token", "userid", "expires"}
+#   DELETE /login   header "Authorization: Bearer <token>"
+#                   revokes the token (log out)
+#
+
+import json
+import os
+import datetime
+import bcrypt
+import datatier
+import authtoken
+
+from configparser import ConfigParser
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_login**")
+
+    #
+    # setup AWS based on config file:
+    #
+    config_file = 'benfordapp-config.ini'
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+    configur = ConfigParser()
+    configur.read(config_file)
+
+    #
+    # configure for RDS access
+    #
+    rds_endpoint = configur.get('rds', 'endpoint')
+    rds_portnum = int(configur.get('rds', 'port_number'))
+    rds_username = configur.get('rds', 'user_name')
+    rds_pwd = configur.get('rds', 'user_pwd')
+    rds_dbname = configur.get('rds', 'db_name')
+
+    secret = configur.get('auth', 'secret')
+    ttl_secs = int(configur.get('auth', 'ttl_secs', fallback=authtoken.DEFAULT_TTL_SECS))
+
+    print("**Opening connection**")
+
+    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+
+    #
+    # logging out? then record the token as revoked until it
+    # would have expired anyway:
+    #
+    if event.get("httpMethod", "POST") == "DELETE":
+      print("**Revoking token**")
+
+      #
+      # with revocation off a logged out token would still be
+      # accepted everywhere, so don't claim to log out:
+      #
+      if not configur.getboolean('auth', 'revocation', fallback=True):
+        raise Exception("logout is disabled, [auth] revocation is off")
+
+      try:
+        userid = authtoken.authenticate(event, configur)
+      except authtoken.AuthError as err:
+        return authtoken.unauthorized(err)
+
+      if userid is None:
+        return authtoken.unauthorized("requires an authorization token")
+
+      token = authtoken.get_bearer_token(event)
+      (userid, expiry) = authtoken.parse(token)
+
+      #
+      # expiration_utc is UTC, as is_revoked compares it with
+      # UTC_TIMESTAMP(); FROM_UNIXTIME() would give the session's
+      # time zone instead:
+      #
+      expiration_utc = datetime.datetime.fromtimestamp(expiry, datetime.timezone.utc).replace(tzinfo=None)
+
+      sql = """
+        INSERT IGNORE INTO tokens(token, userid, expiration_utc)
+                    VALUES(%s, %s, %s);
+      """
+      datatier.perform_action(dbConn, sql, [token, userid, expiration_utc])
+
+      print("**DONE, token revoked**")
+
+      return {
+        'statusCode': 200,
+        'body': json.dumps("logged out")
+      }
+
+    #
+    # logging in:
+    #
+    print("**Accessing request body**")
+
+    if "body" not in event:
+      raise Exception("event has no body")
+
+    body = json.loads(event["body"])
+
+    if "username" not in body:
+      raise Exception("event has a body but no username")
+    if "password" not in body:
+      raise Exception("event has a body but no password")
+
+    username = body["username"]
+    password = body["password"]
+
+    print("username:", username)
+
+    sql = "SELECT userid, pwdhash FROM users WHERE username = %s;"
+
+    row = datatier.retrieve_one_row(dbConn, sql, [username])
+
+    #
+    # the hashes in the database were generated by PHP, which
+    # labels bcrypt as $2y$; that's the same algorithm as $2b$:
+    #
+    ok = False
+    if row != ():
+      pwdhash = row[1]
+      if pwdhash.startswith("$2y$"):
+        pwdhash = "$2b$" + pwdhash[4:]
+      ok = bcrypt.checkpw(password.encode(), pwdhash.encode())
+
+    if not ok:
+      print("**Bad username or password, returning...**")
+      return authtoken.unauthorized("invalid username or password")
+
+    userid = row[0]
+
+    (token, expiry) = authtoken.issue(userid, secret, ttl_secs)
+
+    print("**DONE, returning token for userid", userid, "**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps({
+        "token": token,
+        "userid": userid,
+        "expires": datetime.datetime.fromtimestamp(expiry, datetime.timezone.utc).isoformat()
+      })
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
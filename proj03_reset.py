@@ -0,0 +1,155 @@
+#
+# Resets the BenfordApp back to its initial state: deletes all
+# jobs from the database, archived ones included (their objects
+# are under benfordapp/ too, and job ids start over at 1001, so
+# none may survive to clash with a new job), and deletes every
+# PDF and results file the app has stored in S3 (everything
+# under benfordapp/). The per-user Benford totals (digit_counts)
+# are then rebuilt, which leaves them empty unless a job
+# completed meanwhile.
+# The S3 objects are removed in batches of 1000 keys spread
+# across concurrent workers (see s3cleanup.py), and the cleanup
+# throughput is reported back to the client.
+#
+
+import json
+import boto3
+import os
+import datatier
+import s3cleanup
+
+from configparser import ConfigParser
+
+DIGIT_SUMS = ", ".join("SUM(digits->>'$.\"" + d + "\"')" for d in "123456789")
+
+
+def rebuild_digit_counts(dbConn):
+  """
+  Recomputes digit_counts from the completed jobs, in jobs and
+  jobs_archive, replacing what was there.
+  """
+  sql = "DELETE FROM digit_counts;"
+  datatier.perform_action(dbConn, sql)
+
+  #
+  # a job completing meanwhile is counted by the trigger and
+  # again by the SELECT, so the rebuild's sums replace rather
+  # than add to any row already there:
+  #
+  sql = """
+    INSERT INTO digit_counts(userid, day, jobs, d1, d2, d3, d4, d5, d6, d7, d8, d9)
+      SELECT userid, DATE(finished_at), COUNT(*), """ + DIGIT_SUMS + """
+        FROM (SELECT userid, finished_at, digits FROM jobs
+               WHERE status = 'completed' AND digits IS NOT NULL
+              UNION ALL
+              SELECT userid, finished_at, digits FROM jobs_archive
+               WHERE status = 'completed' AND digits IS NOT NULL) AS done
+       GROUP BY userid, DATE(finished_at)
+    ON DUPLICATE KEY UPDATE
+         jobs = VALUES(jobs),
+         d1 = VALUES(d1), d2 = VALUES(d2), d3 = VALUES(d3),
+         d4 = VALUES(d4), d5 = VALUES(d5), d6 = VALUES(d6),
+         d7 = VALUES(d7), d8 = VALUES(d8), d9 = VALUES(d9);
+  """
+  return datatier.perform_action(dbConn, sql)
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_reset**")
+
+    #
+    # setup AWS based on config file:
+    #
+    config_file = 'benfordapp-config.ini'
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+    configur = ConfigParser()
+    configur.read(config_file)
+
+    #
+    # configure for S3 access; endpoint_url is optional, and
+    # lets us point at a local S3 stand-in:
+    #
+    s3_profile = 's3readwrite'
+    boto3.setup_default_session(profile_name=s3_profile)
+
+    bucketname = configur.get('s3', 'bucket_name')
+    endpoint_url = configur.get('s3', 'endpoint_url', fallback=None)
+
+    s3client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    workers = int(configur.get('retention', 'workers', fallback=s3cleanup.DEFAULT_WORKERS))
+
+    #
+    # configure for RDS access
+    #
+    rds_endpoint = configur.get('rds', 'endpoint')
+    rds_portnum = int(configur.get('rds', 'port_number'))
+    rds_username = configur.get('rds', 'user_name')
+    rds_pwd = configur.get('rds', 'user_pwd')
+    rds_dbname = configur.get('rds', 'db_name')
+
+    #
+    # clear the database first, so no job points at an object
+    # we are about to delete:
+    #
+    print("**Opening connection**")
+
+    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+
+    print("**Deleting jobs**")
+
+    sql = "DELETE FROM jobs;"
+    datatier.perform_action(dbConn, sql)
+
+    sql = "DELETE FROM jobs_archive;"
+    datatier.perform_action(dbConn, sql)
+
+    #
+    # job ids start over, so no entity or page text may outlive
+    # its job:
+    #
+    sql = "DELETE FROM entities;"
+    datatier.perform_action(dbConn, sql)
+
+    sql = "DELETE FROM page_texts;"
+    datatier.perform_action(dbConn, sql)
+
+    sql = "ALTER TABLE jobs AUTO_INCREMENT = 1001;"
+    datatier.perform_action(dbConn, sql)
+
+    print("**Rebuilding digit counts**")
+
+    rebuild_digit_counts(dbConn)
+
+    #
+    # now delete the app's objects from S3:
+    #
+    print("**Deleting S3 objects under benfordapp/**")
+
+    stats = s3cleanup.delete_prefix(s3client, bucketname, "benfordapp/", workers)
+
+    print(str(stats))
+
+    if len(stats.errors) > 0:
+      for error in stats.errors[0:10]:
+        print("  ", error)
+      raise Exception("reset failed to delete " + str(len(stats.errors)) + " objects")
+
+    print("**DONE, returning**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps("database reset, deleted " + str(stats))
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
@@ -0,0 +1,218 @@
+#
+# Full-text search over the page text of jobs' PDFs (the
+# page_texts table, kept by proj03_compute, see textsearch.py):
+#
+#   GET /search?q=acme corp&userid=80001
+#
+# Query parameters:
+#
+#   q       the words to search for; pages with any of them
+#           match, those with more (and rarer) ones rank higher
+#   userid  the caller's userid (optional, must match the token)
+#   jobid   only this job's pages (optional)
+#   limit   page hits to return, default 20, at most 100
+#
+# A session token is required (see authtoken.py), and only the
+# token's user's jobs are searched. pii jobs' text is never
+# indexed (see textsearch.py).
+#
+# Returns {"pages": [...], "jobs": [...]}: the best matching
+# pages, each {"jobid", "userid", "page", "score", "snippet"},
+# and the jobs among the best MAX_RANKED pages, each {"jobid",
+# "userid", "score" (the sum of its pages'), "pages" (matching),
+# "originaldatafile"}, best first.
+#
+# Three queries: the ranking, on the FULLTEXT index; the text of
+# the returned pages, by primary key, for their snippets; and
+# the jobs' filenames.
+#
+
+import json
+import os
+import datatier
+import authtoken
+import textsearch
+
+from configparser import ConfigParser
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+#
+# pages ranked to find the best jobs:
+#
+MAX_RANKED = 500
+
+
+def get_limit(params):
+  """
+  Returns the number of hits requested in the query string,
+  within 1..MAX_LIMIT.
+  """
+  try:
+    limit = int(params.get("limit", DEFAULT_LIMIT))
+  except ValueError:
+    raise Exception("limit must be an integer")
+
+  return max(1, min(limit, MAX_LIMIT))
+
+
+def search(dbConn, words, userid=None, jobid=None, limit=DEFAULT_LIMIT):
+  """
+  Ranks the pages matching any of words, optionally only the
+  user's or the job's.
+
+  Returns
+  -------
+  {"pages": [...], "jobs": [...]}, see above
+  """
+  query = " ".join(words)
+
+  conditions = ["MATCH(text) AGAINST(%s IN NATURAL LANGUAGE MODE)"]
+  values = [query, query]
+
+  if userid is not None:
+    conditions.append("userid = %s")
+    values.append(int(userid))
+
+  if jobid is not None:
+    conditions.append("jobid = %s")
+    values.append(int(jobid))
+
+  sql = """
+    SELECT jobid, userid, page, MATCH(text) AGAINST(%s IN NATURAL LANGUAGE MODE) AS score
+      FROM page_texts
+     WHERE """ + " AND ".join(conditions) + """
+     ORDER BY score DESC, jobid, page
+     LIMIT %s;
+  """
+  values.append(MAX_RANKED)
+
+  ranked = datatier.retrieve_all_rows(dbConn, sql, values)
+
+  #
+  # the jobs, by the sum of their ranked pages' scores:
+  #
+  jobs = {}
+  for (jobid, userid, page, score) in ranked:
+    if jobid not in jobs:
+      jobs[jobid] = {"jobid": jobid, "userid": userid, "score": 0.0, "pages": 0}
+    jobs[jobid]["score"] += float(score)
+    jobs[jobid]["pages"] += 1
+
+  jobs = sorted(jobs.values(), key=lambda job: (-job["score"], job["jobid"]))
+
+  #
+  # snippets for the best pages:
+  #
+  hits = ranked[0:limit]
+  texts = {}
+
+  if len(hits) > 0:
+    sql = """
+      SELECT jobid, page, text
+        FROM page_texts
+       WHERE """ + " OR ".join(["(jobid = %s AND page = %s)"] * len(hits)) + ";"
+
+    keys = []
+    for (jobid, userid, page, score) in hits:
+      keys.extend([jobid, page])
+
+    for (jobid, page, text) in datatier.retrieve_all_rows(dbConn, sql, keys):
+      texts[(jobid, page)] = text
+
+  pages = []
+  for (jobid, userid, page, score) in hits:
+    pages.append({
+      "jobid": jobid,
+      "userid": userid,
+      "page": page,
+      "score": round(float(score), 6),
+      "snippet": textsearch.snippet(texts.get((jobid, page), ""), words)
+    })
+
+  #
+  # and which files the jobs were:
+  #
+  if len(jobs) > 0:
+    sql = "SELECT jobid, originaldatafile FROM jobs WHERE jobid IN (" + \
+          ", ".join(["%s"] * len(jobs)) + ");"
+    filenames = dict(datatier.retrieve_all_rows(dbConn, sql, [job["jobid"] for job in jobs]))
+
+    for job in jobs:
+      job["score"] = round(job["score"], 6)
+      job["originaldatafile"] = filenames.get(job["jobid"])
+
+  return {"pages": pages, "jobs": jobs}
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_search**")
+
+    #
+    # setup AWS based on config file:
+    #
+    config_file = 'benfordapp-config.ini'
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+    configur = ConfigParser()
+    configur.read(config_file)
+
+    #
+    # configure for RDS access
+    #
+    rds_endpoint = configur.get('rds', 'endpoint')
+    rds_portnum = int(configur.get('rds', 'port_number'))
+    rds_username = configur.get('rds', 'user_name')
+    rds_pwd = configur.get('rds', 'user_pwd')
+    rds_dbname = configur.get('rds', 'db_name')
+
+    params = event.get("queryStringParameters") or {}
+
+    print("params:", params)
+
+    words = textsearch.terms(params.get("q", ""))
+    if len(words) == 0:
+      raise Exception("q must have at least one word to search for")
+
+    limit = get_limit(params)
+
+    print("**Opening connection**")
+
+    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+
+    #
+    # the caller must be logged in, and only searches their own
+    # jobs:
+    #
+    try:
+      token_userid = authtoken.require(event, configur, dbConn)
+    except authtoken.AuthError as err:
+      print("**Not authorized, returning...**")
+      return authtoken.unauthorized(err)
+
+    if params.get("userid") is not None and str(params["userid"]) != str(token_userid):
+      print("**Token is for a different user, returning...**")
+      return authtoken.unauthorized("token was not issued to user " + str(params["userid"]))
+
+    print("**Searching**")
+
+    result = search(dbConn, words, token_userid, params.get("jobid"), limit)
+
+    print("**DONE, returning", len(result["pages"]), "pages from", len(result["jobs"]), "jobs**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps(result)
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
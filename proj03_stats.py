@@ -0,0 +1,177 @@
+#
+# Reports how long jobs wait in the queue (created_at ->
+# started_at, including any time spent 'queued' for a free slot,
+# see scheduler.py) and how long they run (started_at ->
+# finished_at), as p50/p95 per jobtype or per user, over jobs
+# finished in a time window, along with how many repeated S3
+# events (or hand-offs) those jobs had that compute ignored (see
+# scheduler.py).
+#
+# Query parameters (all optional):
+#
+#   since   jobs finished at or after this time, default 24
+#           hours ago
+#   until   jobs finished before this time, default now
+#   by      jobtype (the default) or userid; per user, the
+#           response also has each user's jobs queued and
+#           processing right now, and max queue wait
+#
+# Times are in the database session's time zone (UTC unless
+# configured otherwise), the clock finished_at is written with.
+#
+# The query only reads the jobs_finished_timing index, and the
+# percentiles are computed in the database (nearest rank, via
+# CUME_DIST), so only one row per jobtype (or user) comes back.
+#
+
+import json
+import os
+import datatier
+
+from configparser import ConfigParser
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_stats**")
+
+    #
+    # setup AWS based on config file:
+    #
+    config_file = 'benfordapp-config.ini'
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+    configur = ConfigParser()
+    configur.read(config_file)
+
+    #
+    # configure for RDS access
+    #
+    rds_endpoint = configur.get('rds', 'endpoint')
+    rds_portnum = int(configur.get('rds', 'port_number'))
+    rds_username = configur.get('rds', 'user_name')
+    rds_pwd = configur.get('rds', 'user_pwd')
+    rds_dbname = configur.get('rds', 'db_name')
+
+    params = event.get("queryStringParameters") or {}
+
+    since = params.get("since")
+    until = params.get("until")
+    by = params.get("by", "jobtype")
+
+    print("since:", since)
+    print("until:", until)
+    print("by:", by)
+
+    #
+    # the column is pasted into the SQL, so only allow these:
+    #
+    if by not in ["jobtype", "userid"]:
+      raise Exception("by must be jobtype or userid")
+
+    print("**Opening connection**")
+
+    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+
+    sql = """
+      WITH timings AS (
+        SELECT {by} AS grp,
+               TIMESTAMPDIFF(MICROSECOND, created_at, started_at) AS queue_us,
+               TIMESTAMPDIFF(MICROSECOND, started_at, finished_at) AS run_us,
+               duplicate_events
+          FROM jobs
+         WHERE finished_at >= COALESCE(%s, NOW(3) - INTERVAL 1 DAY)
+           AND finished_at < COALESCE(%s, NOW(3) + INTERVAL 1 SECOND)
+           AND started_at IS NOT NULL
+      ),
+      ranked AS (
+        SELECT grp, queue_us, run_us, duplicate_events,
+               CUME_DIST() OVER (PARTITION BY grp ORDER BY queue_us) AS queue_rank,
+               CUME_DIST() OVER (PARTITION BY grp ORDER BY run_us) AS run_rank
+          FROM timings
+      )
+      SELECT grp,
+             COUNT(*),
+             MIN(CASE WHEN queue_rank >= 0.50 THEN queue_us END),
+             MIN(CASE WHEN queue_rank >= 0.95 THEN queue_us END),
+             MIN(CASE WHEN run_rank >= 0.50 THEN run_us END),
+             MIN(CASE WHEN run_rank >= 0.95 THEN run_us END),
+             MAX(queue_us),
+             SUM(duplicate_events)
+        FROM ranked
+       GROUP BY grp
+       ORDER BY grp;
+    """.format(by=by)
+
+    print("**Computing job timings**")
+
+    rows = datatier.retrieve_all_rows(dbConn, sql, [since, until])
+
+    #
+    # microseconds -> seconds for the response:
+    #
+    stats = []
+    for row in rows:
+      entry = {
+        by: row[0],
+        "jobs": row[1],
+        "queue_wait_p50": row[2] / 1000000.0,
+        "queue_wait_p95": row[3] / 1000000.0,
+        "run_time_p50": row[4] / 1000000.0,
+        "run_time_p95": row[5] / 1000000.0,
+        "duplicate_events": int(row[7])
+      }
+      if by == "userid":
+        entry["queue_wait_max"] = row[6] / 1000000.0
+        entry["queued_now"] = 0
+        entry["processing_now"] = 0
+      stats.append(entry)
+
+    #
+    # per user, add what's waiting and running right now, which
+    # may include users with nothing finished in the window:
+    #
+    if by == "userid":
+      sql = """
+        SELECT userid, SUM(status = 'queued'), SUM(status = 'processing')
+          FROM jobs
+         WHERE status IN ('queued', 'processing')
+         GROUP BY userid;
+      """
+
+      print("**Counting queued and processing jobs**")
+
+      rows = datatier.retrieve_all_rows(dbConn, sql)
+
+      users = {}
+      for entry in stats:
+        users[entry["userid"]] = entry
+
+      for row in rows:
+        if row[0] not in users:
+          users[row[0]] = {"userid": row[0], "jobs": 0,
+                           "queue_wait_p50": None, "queue_wait_p95": None,
+                           "run_time_p50": None, "run_time_p95": None,
+                           "duplicate_events": 0, "queue_wait_max": None}
+          stats.append(users[row[0]])
+        users[row[0]]["queued_now"] = int(row[1])
+        users[row[0]]["processing_now"] = int(row[2])
+
+      stats.sort(key=lambda entry: entry["userid"])
+
+    print("**DONE, returning stats for", len(stats), by + "s**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps(stats)
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
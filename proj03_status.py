@@ -0,0 +1,170 @@
+#
+# Returns the status of many jobs in one call, for dashboards
+# and batch clients. Unlike /results, this never touches S3:
+# each job is answered from its row in the jobs table.
+#
+# Two forms:
+#
+#   POST /status      body {"jobids": [1001, 1002, ...]}
+#   GET  /status?jobids=1001,1002,...
+#   GET  /status?userid=80001&since=2026-10-19 12:00:00
+#
+# The second form returns the user's jobs changed at or after
+# "since" (UTC), oldest change first; pass the largest
+# updated_at seen back as "since" to poll for further changes.
+#
+# Each job's entry includes the status of each of its analyses
+# (see analyses.py), e.g. {"benford": "completed", "ner":
+# "pending"}, or null if compute hasn't started it, and for jobs
+# that called Comprehend, how many calls the cache saved.
+#
+
+import json
+import os
+import datatier
+
+from configparser import ConfigParser
+
+#
+# most rows returned by one call:
+#
+MAX_JOBS = 1000
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_status**")
+
+    #
+    # setup AWS based on config file:
+    #
+    config_file = 'benfordapp-config.ini'
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+    configur = ConfigParser()
+    configur.read(config_file)
+
+    #
+    # configure for RDS access
+    #
+    rds_endpoint = configur.get('rds', 'endpoint')
+    rds_portnum = int(configur.get('rds', 'port_number'))
+    rds_username = configur.get('rds', 'user_name')
+    rds_pwd = configur.get('rds', 'user_pwd')
+    rds_dbname = configur.get('rds', 'db_name')
+
+    #
+    # job ids come from the JSON body or the query string,
+    # otherwise we need a userid and since:
+    #
+    params = event.get("queryStringParameters") or {}
+
+    jobids = None
+    if event.get("body"):
+      body = json.loads(event["body"])
+      if "jobids" not in body:
+        raise Exception("event has a body but no jobids")
+      jobids = body["jobids"]
+    elif "jobids" in params:
+      jobids = [j for j in params["jobids"].split(",") if j.strip() != ""]
+
+    print("**Opening connection**")
+
+    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+
+    if jobids is not None:
+      if len(jobids) == 0:
+        raise Exception("jobids is empty")
+      if len(jobids) > MAX_JOBS:
+        raise Exception("at most " + str(MAX_JOBS) + " jobids per request")
+
+      jobids = [int(j) for j in jobids]
+
+      print("**Retrieving status of", len(jobids), "jobs**")
+
+      #
+      # one primary key lookup per id, in a single query:
+      #
+      sql = """
+        SELECT jobid, status, resultsfilekey, updated_at, pages_done, pages_total, analyses,
+               comprehend_report
+          FROM jobs
+         WHERE jobid IN (""" + ", ".join(["%s"] * len(jobids)) + """)
+         ORDER BY jobid;
+      """
+
+      rows = datatier.retrieve_all_rows(dbConn, sql, jobids)
+
+    elif "userid" in params and "since" in params:
+      userid = params["userid"]
+      since = params["since"]
+
+      print("**Retrieving jobs for user", userid, "changed since", since, "**")
+
+      #
+      # range scan over the (userid, updated_at) index:
+      #
+      sql = """
+        SELECT jobid, status, resultsfilekey, updated_at, pages_done, pages_total, analyses,
+               comprehend_report
+          FROM jobs
+         WHERE userid = %s AND updated_at >= %s
+         ORDER BY updated_at, jobid
+         LIMIT %s;
+      """
+
+      rows = datatier.retrieve_all_rows(dbConn, sql, [userid, since, MAX_JOBS])
+
+    else:
+      raise Exception("requires jobids, or userid and since parameters")
+
+    #
+    # build the response, one entry per job found:
+    #
+    jobs = []
+    for row in rows:
+      progress = None
+      if row[1] == "processing" and row[5] > 0:
+        progress = {"pages_done": row[4], "pages_total": row[5]}
+
+      #
+      # each analysis's status, once compute has started the job:
+      #
+      analyses = None
+      if row[6] is not None:
+        analyses = json.loads(row[6])
+
+      #
+      # for jobs that called Comprehend, the calls the cache
+      # saved (see comprehendcache.py):
+      #
+      comprehend = None
+      if row[7] is not None:
+        comprehend = json.loads(row[7])
+
+      jobs.append({
+        "jobid": row[0],
+        "status": row[1],
+        "progress": progress,
+        "analyses": analyses,
+        "comprehend": comprehend,
+        "resultsfilekey": row[2],
+        "updated_at": str(row[3])
+      })
+
+    print("**DONE, returning", len(jobs), "jobs**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps(jobs)
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
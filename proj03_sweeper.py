@@ -0,0 +1,226 @@
+#
+# Retention sweeper, run on a schedule (e.g. an EventBridge rule
+# once a day). Finds jobs that finished more than max_age_days
+# ago and, depending on the configured action:
+#
+#   expire:  deletes the job's PDF and results from S3 (batched
+#            DeleteObjects, see s3cleanup.py) and deletes the row
+#            and its entities and page texts (entitystore.py,
+#            textsearch.py)
+#   archive: moves the job's objects to a cold storage class and
+#            moves the row into jobs_archive
+#
+# Settings come from the [retention] section of the config file:
+#
+#   [retention]
+#   max_age_days = 30
+#   action = expire
+#   storage_class = GLACIER
+#   workers = 8
+#
+# Old jobs are handled a batch at a time, oldest first, until
+# none are left or the invocation is close to timing out.
+#
+# It also trims the Comprehend cache table, by last use and
+# total size, per the [comprehend_cache] section (see
+# comprehendcache.py).
+#
+
+import json
+import boto3
+import os
+import datatier
+import s3cleanup
+import comprehendcache
+
+from configparser import ConfigParser
+
+#
+# jobs handled per batch (S3 DeleteObjects takes at most 1000
+# keys, and each job has two):
+#
+JOBS_PER_BATCH = 500
+
+#
+# stop starting new batches when this much time is left:
+#
+MIN_REMAINING_MILLIS = 30000
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_sweeper**")
+
+    #
+    # setup AWS based on config file:
+    #
+    config_file = 'benfordapp-config.ini'
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+    configur = ConfigParser()
+    configur.read(config_file)
+
+    #
+    # configure for S3 access; endpoint_url is optional, and
+    # lets us point at a local S3 stand-in:
+    #
+    s3_profile = 's3readwrite'
+    boto3.setup_default_session(profile_name=s3_profile)
+
+    bucketname = configur.get('s3', 'bucket_name')
+    endpoint_url = configur.get('s3', 'endpoint_url', fallback=None)
+
+    s3client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    #
+    # configure for RDS access
+    #
+    rds_endpoint = configur.get('rds', 'endpoint')
+    rds_portnum = int(configur.get('rds', 'port_number'))
+    rds_username = configur.get('rds', 'user_name')
+    rds_pwd = configur.get('rds', 'user_pwd')
+    rds_dbname = configur.get('rds', 'db_name')
+
+    #
+    # retention settings, the event can override them (handy
+    # for one-off runs from the console):
+    #
+    max_age_days = int(event.get("max_age_days", configur.get('retention', 'max_age_days', fallback='30')))
+    action = event.get("action", configur.get('retention', 'action', fallback='expire'))
+    storage_class = configur.get('retention', 'storage_class', fallback='GLACIER')
+    workers = int(configur.get('retention', 'workers', fallback=s3cleanup.DEFAULT_WORKERS))
+
+    if action not in ["expire", "archive"]:
+      raise Exception("retention action must be expire or archive, not '" + action + "'")
+
+    print("max age (days):", max_age_days)
+    print("action:", action)
+
+    print("**Opening connection**")
+
+    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+
+    #
+    # oldest finished jobs first; a range scan over the
+    # jobs_finished_timing index, which leads with finished_at.
+    # NOW(3), the clock compute stamps finished_at with:
+    #
+    sql = """
+      SELECT jobid, datafilekey, resultsfilekey
+        FROM jobs
+       WHERE finished_at < NOW(3) - INTERVAL %s DAY
+       ORDER BY finished_at
+       LIMIT %s;
+    """
+
+    jobs_swept = 0
+    totals = s3cleanup.CleanupStats()
+
+    while True:
+      if context is not None and hasattr(context, "get_remaining_time_in_millis"):
+        if context.get_remaining_time_in_millis() < MIN_REMAINING_MILLIS:
+          print("**Running out of time, stopping early**")
+          break
+
+      dbConn.commit()  # fresh snapshot for each batch
+      rows = datatier.retrieve_all_rows(dbConn, sql, [max_age_days, JOBS_PER_BATCH])
+
+      if len(rows) == 0:
+        break
+
+      jobids = [row[0] for row in rows]
+
+      keys = []
+      for row in rows:
+        keys.append(row[1])
+        if row[2] != "":
+          keys.append(row[2])
+
+      print("**Sweeping", len(jobids), "jobs,", len(keys), "objects**")
+
+      if action == "expire":
+        stats = s3cleanup.delete_keys(s3client, bucketname, keys, workers)
+      else:
+        stats = s3cleanup.archive_keys(s3client, bucketname, keys, storage_class, workers)
+
+      print(str(stats))
+
+      totals.objects += stats.objects
+      totals.requests += stats.requests
+      totals.errors.extend(stats.errors)
+
+      if len(stats.errors) > 0:
+        #
+        # leave the rows in place so the next run retries them:
+        #
+        for error in stats.errors[0:10]:
+          print("  ", error)
+        break
+
+      #
+      # now the rows: archive copies them first, skipping any a
+      # partial earlier run already copied (the same job, by its
+      # unique datafilekey; a different job with the same jobid
+      # fails the insert rather than being dropped), then both
+      # actions delete them from jobs. Archive only deletes rows
+      # now in jobs_archive, so a job is never lost from both:
+      #
+      placeholders = ", ".join(["%s"] * len(jobids))
+
+      sql_delete = "DELETE FROM jobs WHERE jobid IN (" + placeholders + ");"
+
+      if action == "archive":
+        sql_archive = """
+          INSERT INTO jobs_archive
+            SELECT * FROM jobs j
+             WHERE j.jobid IN (""" + placeholders + """)
+               AND NOT EXISTS (SELECT 1 FROM jobs_archive a WHERE a.datafilekey = j.datafilekey);
+        """
+        datatier.perform_action(dbConn, sql_archive, jobids)
+
+        sql_delete = """
+          DELETE FROM jobs
+           WHERE jobid IN (""" + placeholders + """)
+             AND EXISTS (SELECT 1 FROM jobs_archive a
+                          WHERE a.jobid = jobs.jobid AND a.datafilekey = jobs.datafilekey);
+        """
+
+      if action == "expire":
+        sql_entities = "DELETE FROM entities WHERE jobid IN (" + placeholders + ");"
+        datatier.perform_action(dbConn, sql_entities, jobids)
+
+        sql_texts = "DELETE FROM page_texts WHERE jobid IN (" + placeholders + ");"
+        datatier.perform_action(dbConn, sql_texts, jobids)
+
+      datatier.perform_action(dbConn, sql_delete, jobids)
+
+      jobs_swept += len(jobids)
+
+    totals.finish()
+
+    #
+    # and the Comprehend cache:
+    #
+    (aged, trimmed) = comprehendcache.sweep(dbConn, comprehendcache.get_settings(configur))
+
+    print("**Comprehend cache:", aged, "unused responses and", trimmed, "more for size deleted**")
+
+    msg = action + ": " + str(jobs_swept) + " jobs, " + str(totals) + \
+          ", comprehend cache: " + str(aged + trimmed) + " responses"
+
+    print("**DONE,", msg, "**")
+
+    return {
+      'statusCode': 200 if len(totals.errors) == 0 else 400,
+      'body': json.dumps(msg)
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
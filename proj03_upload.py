@@ -3,6 +3,16 @@
 # in the BenfordApp database with a status of 'uploaded'.
 # Sends the job id back to the client.
 #
+# The PDF can arrive either as base64 inside a JSON body (the
+# original format), or as a raw application/pdf body with the
+# filename in the query string, optionally gzip/zstd encoded.
+# See transport.py.
+#
+# Ledgers can be uploaded as .csv or .xlsx instead, for Benford
+# analysis only (see tabular.py), optionally naming the columns
+# to analyze: "columns" in the JSON body (a list), or a columns
+# query parameter (comma-separated).
+#
 
 import json
 import boto3
@@ -11,9 +21,15 @@ import uuid
 import base64
 import pathlib
 import datatier
+import analyses
+import transport
+import tabular
+import authtoken
+import profiling
 
 from configparser import ConfigParser
 
+@profiling.profiled
 def lambda_handler(event, context):
   try:
     print("**STARTING**")
@@ -76,34 +92,63 @@ def lambda_handler(event, context):
     else:
         raise Exception("requires jobtype parameter in event")
 
+    #
+    # one analysis, or several separated by commas, stored in a
+    # canonical order (see analyses.py):
+    #
+    jobtype = analyses.format_jobtype(analyses.parse_jobtype(jobtype))
+
     print("jobtype:", jobtype)
 
     #
     # the user has sent us two parameters:
     #  1. filename of their file
-    #  2. raw file data in base64 encoded string
+    #  2. raw file data
     #
     # The parameters are coming through web server 
-    # (or API Gateway) in the body of the request
-    # in JSON format.
+    # (or API Gateway) either in a JSON body (filename and
+    # base64 encoded string), or as a binary body with the
+    # filename in the query string.
     #
     print("**Accessing request body**")
 
     if "body" not in event:
       raise Exception("event has no body")
 
-    body = json.loads(event["body"]) # parse the json
+    content_type = transport.get_header(event, "Content-Type")
+
+    if content_type is None or content_type.startswith("application/json"):
+      body = json.loads(event["body"]) # parse the json
+
+      if "filename" not in body:
+        raise Exception("event has a body but no filename")
+      if "data" not in body:
+        raise Exception("event has a body but no data")
 
-    if "filename" not in body:
-      raise Exception("event has a body but no filename")
-    if "data" not in body:
-      raise Exception("event has a body but no data")
+      filename = body["filename"]
+      datastr = body["data"]
+      columns = body.get("columns")
 
-    filename = body["filename"]
-    datastr = body["data"]
+      print("filename:", filename)
+      print("datastr (first 10 chars):", datastr[0:10])
 
-    print("filename:", filename)
-    print("datastr (first 10 chars):", datastr[0:10])
+      base64_bytes = datastr.encode()        # string -> base64 bytes
+      bytes = base64.b64decode(base64_bytes) # base64 bytes -> raw bytes
+    else:
+      filename = transport.get_query_param(event, "filename")
+
+      if filename is None:
+        raise Exception("binary upload requires filename query parameter")
+
+      bytes = transport.get_body_bytes(event)
+
+      columns = transport.get_query_param(event, "columns")
+
+      print("filename:", filename)
+      print("content type:", content_type)
+      print("content encoding:", transport.get_header(event, "Content-Encoding"))
+
+    print("data length:", len(bytes))
 
     #
     # open connection to the database:
@@ -112,6 +157,22 @@ def lambda_handler(event, context):
 
     dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
 
+    #
+    # if the caller sent a session token (see authtoken.py), it
+    # must be valid and issued to this user:
+    #
+    print("**Checking token**")
+
+    try:
+      token_userid = authtoken.authenticate(event, configur, dbConn)
+    except authtoken.AuthError as err:
+      print("**Not authorized, returning...**")
+      return authtoken.unauthorized(err)
+
+    if token_userid is not None and str(token_userid) != str(userid):
+      print("**Token is for a different user, returning...**")
+      return authtoken.unauthorized("token was not issued to user " + str(userid))
+
     #
     # first we need to make sure the userid is valid:
     #
@@ -133,11 +194,7 @@ def lambda_handler(event, context):
     username = row[1]
 
     #
-    # at this point the user exists, so safe to upload to S3:
-    #
-    base64_bytes = datastr.encode()        # string -> base64 bytes
-    bytes = base64.b64decode(base64_bytes) # base64 bytes -> raw bytes
-
+    # at this point the user exists, so safe to upload to S3.
     #
     # write raw bytes to local filesystem for upload:
     #
@@ -148,7 +205,10 @@ def lambda_handler(event, context):
     # write the bytes we received from the client, and
     # close the file.
     #
-    local_filename = "/tmp/data.pdf"
+    # a name of our own, so invocations sharing /tmp (a reused
+    # container, or the local emulator) never clash:
+    #
+    local_filename = "/tmp/data-" + str(uuid.uuid4())
     #
     # ???
     #
@@ -164,13 +224,34 @@ def lambda_handler(event, context):
     basename = pathlib.Path(filename).stem
     extension = pathlib.Path(filename).suffix
 
-    if extension != ".pdf" : 
-      raise Exception("expecting filename to have .pdf extension")
+    if extension == ".pdf":
+      content_type = "application/pdf"
+    elif extension in tabular.EXTENSIONS:
+      content_type = tabular.CONTENT_TYPES[extension]
+      if jobtype != "benford":
+        raise Exception("only benford analysis is supported for " + extension + " files")
+    else:
+      raise Exception("expecting filename to have .pdf, .csv or .xlsx extension")
+
+    #
+    # the columns to analyze, for a table; None means every
+    # numeric column:
+    #
+    if isinstance(columns, str):
+      columns = [c.strip() for c in columns.split(",") if c.strip() != ""]
+    if columns is not None and len(columns) == 0:
+      columns = None
+    if columns is not None and extension == ".pdf":
+      raise Exception("columns only apply to .csv and .xlsx files")
 
-    bucketkey = "benfordapp/" + username + "/" + basename + "-" + str(uuid.uuid4()) + ".pdf"
+    input_columns = json.dumps(columns) if columns is not None else None
+
+    bucketkey = "benfordapp/" + username + "/" + basename + "-" + str(uuid.uuid4()) + extension
 
     print("S3 bucketkey:", bucketkey)
 
+    profiling.note_job(bucketname, bucketkey)
+
     #
     # Remember that the processing of the PDF is event-triggered,
     # and that lambda function is going to update the database as
@@ -181,14 +262,15 @@ def lambda_handler(event, context):
     print("**Adding jobs row to database**")
 
     sql = """
-      INSERT INTO jobs(userid, status, jobtype, originaldatafile, datafilekey, resultsfilekey)
-                  VALUES(%s, %s, %s, %s, %s, '');
+      INSERT INTO jobs(userid, status, jobtype, originaldatafile, datafilekey, resultsfilekey,
+                       input_columns)
+                  VALUES(%s, %s, %s, %s, %s, '', %s);
     """
 
     #
     # TODO #2 of 3: what values should we insert into the database?
     #
-    datatier.perform_action(dbConn, sql, [userid, "uploaded", jobtype, filename, bucketkey])
+    datatier.perform_action(dbConn, sql, [userid, "uploaded", jobtype, filename, bucketkey, input_columns])
 
     #
     # grab the jobid that was auto-generated by mysql:
@@ -214,9 +296,11 @@ def lambda_handler(event, context):
                       bucketkey, 
                       ExtraArgs={
                         'ACL': 'public-read',
-                        'ContentType': 'application/pdf'
+                        'ContentType': content_type
                       })
 
+    os.remove(local_filename)
+
     #
     # respond in an HTTP-like way, i.e. with a status
     # code and body in JSON format:
@@ -0,0 +1,96 @@
+#
+# Lists users in the BenfordApp database one page at a time,
+# using keyset pagination on userid.
+#
+# Query parameters (all optional):
+#
+#   after   return users with userid > after, i.e. the "next"
+#           value of the previous page
+#   limit   page size, default 100, at most 1000
+#
+# Returns {"rows": [[userid, username, pwdhash], ...],
+#          "next": userid or null}.
+#
+
+import json
+import os
+import datatier
+
+from configparser import ConfigParser
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_users**")
+
+    #
+    # setup AWS based on config file:
+    #
+    config_file = 'benfordapp-config.ini'
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+    configur = ConfigParser()
+    configur.read(config_file)
+
+    #
+    # configure for RDS access
+    #
+    rds_endpoint = configur.get('rds', 'endpoint')
+    rds_portnum = int(configur.get('rds', 'port_number'))
+    rds_username = configur.get('rds', 'user_name')
+    rds_pwd = configur.get('rds', 'user_pwd')
+    rds_dbname = configur.get('rds', 'db_name')
+
+    params = event.get("queryStringParameters") or {}
+
+    try:
+      limit = int(params.get("limit", DEFAULT_LIMIT))
+      after = int(params.get("after", 0))
+    except ValueError:
+      raise Exception("limit and after must be integers")
+
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    print("**Opening connection**")
+
+    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
+
+    print("**Retrieving users**")
+
+    #
+    # fetch one extra row to learn if there is another page:
+    #
+    sql = """
+      SELECT userid, username, pwdhash
+        FROM users
+       WHERE userid > %s
+       ORDER BY userid
+       LIMIT %s;
+    """
+
+    rows = datatier.retrieve_all_rows(dbConn, sql, [after, limit + 1])
+
+    next = None
+    if len(rows) > limit:
+      rows = rows[0:limit]
+      next = rows[-1][0]
+
+    print("**DONE, returning", len(rows), "rows**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps({"rows": [list(row) for row in rows], "next": next})
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 400,
+      'body': json.dumps(str(err))
+    }
@@ -0,0 +1,75 @@
+#
+# Checks compute is idempotent, in the emulator (see emulator.py):
+# each job's S3 event is delivered COPIES times at once, then
+# again after the job finished and as a hand-off, and every job
+# must be processed exactly once, with the other deliveries
+# counted in its duplicate_events (see scheduler.py).
+#
+# Runs under pytest, or on its own, exiting 1 on a failure:
+#
+#   python replay_test.py
+#
+
+import sqlite3
+import sys
+
+import emulator
+
+JOBS = 6
+COPIES = 8
+MIX = "benford+ner=1,benford=1"
+
+
+def replay():
+  """
+  Replays the jobs' events. Returns (replayed, duplicates,
+  {jobid: jobtype}, digit_counts jobs total), see run_replay.
+  """
+  emu = emulator.Emulator(comprehend_latency=0.01)
+
+  with emu:
+    replayed = emulator.run_replay(emu, JOBS, COPIES, MIX)
+    duplicates = emu.duplicate_events()
+
+    dbConn = sqlite3.connect(emu.database, timeout=30.0)
+    jobtypes = dict(dbConn.execute("SELECT jobid, jobtype FROM jobs;").fetchall())
+    counted = dbConn.execute("SELECT COALESCE(SUM(jobs), 0) FROM digit_counts;").fetchone()[0]
+    dbConn.close()
+
+  return (replayed, duplicates, jobtypes, counted)
+
+
+def test_replay_runs_each_job_once():
+  (replayed, duplicates, jobtypes, counted) = replay()
+
+  assert len(replayed) == JOBS
+
+  for (jobid, concurrent, late) in replayed:
+    bodies = concurrent + late
+    successes = bodies.count("success")
+    ignored = bodies.count("duplicate")
+
+    assert successes == 1, "job %d processed %d times: %s" % (jobid, successes, bodies)
+    assert ignored == len(bodies) - 1, "job %d: %s" % (jobid, bodies)
+
+    (status, duplicate_events) = duplicates[jobid]
+    assert status == "completed", "job %d is %s" % (jobid, status)
+    assert duplicate_events == ignored, "job %d counted %d duplicates, saw %d" % (
+      jobid, duplicate_events, ignored)
+
+  #
+  # a second completion would also have added the job to the
+  # user's digit totals a second time:
+  #
+  benford_jobs = sum(1 for jobtype in jobtypes.values() if "benford" in jobtype.split(","))
+  assert counted == benford_jobs, "digit_counts has %d jobs, expected %d" % (counted, benford_jobs)
+
+
+if __name__ == "__main__":
+  try:
+    test_replay_runs_each_job_once()
+  except AssertionError as err:
+    print("**FAILED**", err)
+    sys.exit(1)
+
+  print("**PASSED**")
@@ -0,0 +1,137 @@
+#
+# On-disk cache of completed job results for the benford app
+# client, keyed by job id.
+#
+# Only results the server sends with an ETag (completed jobs,
+# with "Cache-Control: private, no-cache") are stored, and the
+# client revalidates with If-None-Match on every download: job
+# ids start over after /reset, so a cached job id may later name
+# a different job, and the server's 304 is what tells us the
+# cached copy is still the right one. A 304 costs
+# the server one database lookup and no S3 read.
+#
+# Each entry is two files in the cache directory:
+#
+#   <jobid>.results   the results bytes
+#   <jobid>.etag      the ETag they were served with
+#
+# The total size is kept under max_bytes by evicting the least
+# recently used entries; a hit touches the entry's mtime.
+#
+
+import os
+import pathlib
+import tempfile
+import threading
+
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+
+
+class ResultsCache:
+
+  def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+    self.directory = pathlib.Path(directory)
+    self.max_bytes = max_bytes
+    self.lock = threading.Lock()
+
+    self.directory.mkdir(parents=True, exist_ok=True)
+
+  def paths(self, jobid):
+    return (self.directory / (str(jobid) + ".results"),
+            self.directory / (str(jobid) + ".etag"))
+
+  def etag(self, jobid):
+    """
+    Returns the ETag of the cached results for jobid, or None
+    if the job is not cached.
+    """
+    (results_path, etag_path) = self.paths(jobid)
+
+    try:
+      if not results_path.is_file():
+        return None
+      return etag_path.read_text().strip()
+    except OSError:
+      return None
+
+  def get(self, jobid):
+    """
+    Returns the cached results bytes for jobid, or None, and
+    marks the entry as recently used.
+    """
+    (results_path, etag_path) = self.paths(jobid)
+
+    try:
+      data = results_path.read_bytes()
+      os.utime(results_path)
+      return data
+    except OSError:
+      return None
+
+  def put(self, jobid, etag, data):
+    """
+    Stores results for jobid, then evicts old entries if the
+    cache has grown past max_bytes. Each file is written to a
+    temporary name and renamed, so readers never see half a file.
+    """
+    if len(data) > self.max_bytes:
+      return
+
+    (results_path, etag_path) = self.paths(jobid)
+
+    with self.lock:
+      self.write_atomic(etag_path, etag.encode())
+      self.write_atomic(results_path, data)
+      self.evict()
+
+  def write_atomic(self, path, data):
+    (fd, tmpname) = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+    try:
+      with os.fdopen(fd, "wb") as outfile:
+        outfile.write(data)
+      os.replace(tmpname, path)
+    except Exception:
+      if os.path.exists(tmpname):
+        os.remove(tmpname)
+      raise
+
+  def evict(self):
+    """
+    Removes least recently used entries until the results
+    files total at most max_bytes.
+    """
+    entries = []
+    total = 0
+
+    for path in self.directory.glob("*.results"):
+      try:
+        st = path.stat()
+      except OSError:
+        continue
+      entries.append((st.st_mtime, st.st_size, path))
+      total += st.st_size
+
+    entries.sort()
+
+    for (mtime, size, path) in entries:
+      if total <= self.max_bytes:
+        break
+      for victim in [path, path.with_suffix(".etag")]:
+        try:
+          victim.unlink()
+        except OSError:
+          pass
+      total -= size
+
+
+def default_directory(baseurl):
+  """
+  Cache directory for a web service: one per host, under the
+  user's cache directory.
+  """
+  from urllib.parse import urlparse
+
+  root = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+  host = urlparse(baseurl).netloc or "default"
+
+  return os.path.join(root, "benfordapp", host)
@@ -0,0 +1,206 @@
+#
+# Batched, concurrent deletion and archiving of S3 objects,
+# used by /reset (proj03_reset) and the retention sweeper
+# (proj03_sweeper). Like datatier.py, this file is deployed
+# alongside the lambda functions that use it.
+#
+# Deletes go through DeleteObjects, 1000 keys per call (the S3
+# maximum), with the batches spread over a pool of threads.
+#
+# The file can also be run directly, e.g. against a local S3
+# stand-in such as MinIO or moto_server, to measure cleanup
+# throughput:
+#
+#   python s3cleanup.py --endpoint-url http://localhost:9000 \
+#       --bucket benfordapp --prefix benfordapp/ --populate 20000
+#
+
+import argparse
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+#
+# S3 limits DeleteObjects to 1000 keys per request:
+#
+MAX_KEYS_PER_DELETE = 1000
+DEFAULT_WORKERS = 8
+
+
+class CleanupStats:
+  """
+  Counts what a cleanup did and how fast it went.
+  """
+
+  def __init__(self):
+    self.objects = 0
+    self.requests = 0
+    self.errors = []
+    self.start = time.perf_counter()
+    self.seconds = 0.0
+
+  def finish(self):
+    self.seconds = time.perf_counter() - self.start
+    return self
+
+  def per_sec(self):
+    if self.seconds <= 0.0:
+      return 0.0
+    return self.objects / self.seconds
+
+  def __str__(self):
+    return "%d objects in %d requests, %.2f secs (%.0f objects/sec), %d errors" % (
+      self.objects, self.requests, self.seconds, self.per_sec(), len(self.errors))
+
+
+def batches(keys, size=MAX_KEYS_PER_DELETE):
+  """
+  Splits a list of keys into lists of at most size keys.
+  """
+  for i in range(0, len(keys), size):
+    yield keys[i:i + size]
+
+
+def delete_batch(s3client, bucketname, keys):
+  """
+  Deletes up to 1000 keys with a single DeleteObjects call.
+  Returns (number deleted, list of error messages).
+  """
+  response = s3client.delete_objects(
+    Bucket=bucketname,
+    Delete={
+      "Objects": [{"Key": key} for key in keys],
+      "Quiet": True
+    })
+
+  errors = []
+  for err in response.get("Errors", []):
+    errors.append(err.get("Key", "?") + ": " + err.get("Message", err.get("Code", "unknown")))
+
+  return (len(keys) - len(errors), errors)
+
+
+def delete_keys(s3client, bucketname, keys, workers=DEFAULT_WORKERS):
+  """
+  Deletes the given keys, 1000 per request, with up to workers
+  requests in flight. Returns a CleanupStats.
+  """
+  stats = CleanupStats()
+
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    futures = [pool.submit(delete_batch, s3client, bucketname, batch)
+               for batch in batches(keys)]
+
+    for future in futures:
+      (deleted, errors) = future.result()
+      stats.objects += deleted
+      stats.requests += 1
+      stats.errors.extend(errors)
+
+  return stats.finish()
+
+
+def delete_prefix(s3client, bucketname, prefix, workers=DEFAULT_WORKERS):
+  """
+  Deletes every object under prefix. Each page of the listing
+  (up to 1000 keys) becomes one DeleteObjects request, handed to
+  the thread pool while the listing carries on. Returns a
+  CleanupStats.
+  """
+  stats = CleanupStats()
+
+  paginator = s3client.get_paginator("list_objects_v2")
+
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    futures = []
+
+    for page in paginator.paginate(Bucket=bucketname, Prefix=prefix,
+                                   PaginationConfig={"PageSize": MAX_KEYS_PER_DELETE}):
+      keys = [obj["Key"] for obj in page.get("Contents", [])]
+      if len(keys) > 0:
+        futures.append(pool.submit(delete_batch, s3client, bucketname, keys))
+
+    for future in futures:
+      (deleted, errors) = future.result()
+      stats.objects += deleted
+      stats.requests += 1
+      stats.errors.extend(errors)
+
+  return stats.finish()
+
+
+def archive_keys(s3client, bucketname, keys, storage_class="GLACIER", workers=DEFAULT_WORKERS):
+  """
+  Moves the given keys to a colder storage class by copying
+  each object onto itself. S3 has no batch copy, so this is one
+  request per key, spread over the thread pool. Keys that no
+  longer exist are skipped. Returns a CleanupStats.
+  """
+  stats = CleanupStats()
+
+  def archive_one(key):
+    try:
+      s3client.copy_object(
+        Bucket=bucketname,
+        Key=key,
+        CopySource={"Bucket": bucketname, "Key": key},
+        StorageClass=storage_class,
+        MetadataDirective="COPY")
+      return None
+    except Exception as err:
+      if "NoSuchKey" in str(err) or "Not Found" in str(err):
+        return None
+      return key + ": " + str(err)
+
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    for error in pool.map(archive_one, keys):
+      stats.requests += 1
+      if error is None:
+        stats.objects += 1
+      else:
+        stats.errors.append(error)
+
+  return stats.finish()
+
+
+############################################################
+#
+# command line: measure cleanup against any S3 endpoint
+#
+def populate(s3client, bucketname, prefix, count, workers=DEFAULT_WORKERS):
+  """
+  Creates count small objects under prefix, for testing.
+  """
+  def put_one(i):
+    key = prefix + "user/doc-" + str(i) + (".pdf" if i % 2 == 0 else ".txt")
+    s3client.put_object(Bucket=bucketname, Key=key, Body=b"x")
+
+  with ThreadPoolExecutor(max_workers=workers * 4) as pool:
+    list(pool.map(put_one, range(count)))
+
+
+if __name__ == "__main__":
+  import boto3
+
+  parser = argparse.ArgumentParser(description="delete every object under an S3 prefix")
+  parser.add_argument("--endpoint-url", default=None, help="S3 endpoint, e.g. a local stand-in")
+  parser.add_argument("--bucket", required=True)
+  parser.add_argument("--prefix", default="benfordapp/")
+  parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+  parser.add_argument("--populate", type=int, default=0, help="create this many objects first")
+  args = parser.parse_args()
+
+  s3client = boto3.client("s3", endpoint_url=args.endpoint_url)
+
+  if args.populate > 0:
+    print("**Creating", args.populate, "objects under", args.prefix, "**")
+    start = time.perf_counter()
+    populate(s3client, args.bucket, args.prefix, args.populate, args.workers)
+    print("created in %.2f secs" % (time.perf_counter() - start))
+
+  print("**Deleting", args.prefix, "with", args.workers, "workers**")
+  stats = delete_prefix(s3client, args.bucket, args.prefix, args.workers)
+  print(stats)
+
+  for error in stats.errors[0:10]:
+    print("  ", error)
@@ -0,0 +1,203 @@
+#
+# Adaptive page sampling for the sentiment analysis in
+# proj03_compute. Like datatier.py, this file is deployed
+# alongside the lambda function.
+#
+# Running detect_sentiment over every page of a long report
+# costs a call per page, and the first page alone says little
+# about the rest. Instead the pages are split into equal
+# contiguous strata (front matter, body, appendices...), and
+# sampling goes in rounds of one unsampled page per stratum,
+# chosen at random. After each round the page scores are
+# averaged, weighted by the length of text analyzed, and
+# sampling stops once the 95% confidence half-width of every
+# score (Positive, Negative, Neutral, Mixed) is within
+# target_halfwidth, or max_calls pages have been analyzed, or
+# every page has been. Blank pages (scans, images) cost no call
+# but still have to be extracted, so sampling also stops after
+# MAX_PAGES_PER_CALL * max_calls pages, blank or not.
+#
+# Pages are only extracted once sampled, so a sentiment-only job
+# skips extracting the rest. The choice of pages depends only on
+# the page count, so the same document samples the same pages
+# (and hits the Comprehend cache, see comprehendcache.py).
+#
+# Settings come from the [sentiment] section of the config file:
+#
+#   [sentiment]
+#   max_calls = 12
+#   strata = 4
+#   target_halfwidth = 0.05
+#
+
+import math
+import random
+import time
+
+DEFAULT_MAX_CALLS = 12
+DEFAULT_STRATA = 4
+DEFAULT_TARGET_HALFWIDTH = 0.05
+
+#
+# detect_sentiment takes at most 5,000 bytes of UTF-8:
+#
+MAX_TEXT_BYTES = 5000
+
+SCORES = ["Positive", "Negative", "Neutral", "Mixed"]
+
+Z_95 = 1.96
+
+#
+# pages that may be sampled (extracted) per call allowed:
+#
+MAX_PAGES_PER_CALL = 4
+
+SAMPLE_SEED = 310
+
+
+class Settings:
+
+  def __init__(self, max_calls, strata, target_halfwidth):
+    self.max_calls = max_calls
+    self.strata = strata
+    self.target_halfwidth = target_halfwidth
+
+
+def get_settings(configur):
+  """
+  Reads the [sentiment] section of the config file.
+  """
+  return Settings(
+    int(configur.get('sentiment', 'max_calls', fallback=DEFAULT_MAX_CALLS)),
+    int(configur.get('sentiment', 'strata', fallback=DEFAULT_STRATA)),
+    float(configur.get('sentiment', 'target_halfwidth', fallback=DEFAULT_TARGET_HALFWIDTH)))
+
+
+def truncate(text):
+  """
+  The longest prefix of text within MAX_TEXT_BYTES.
+  """
+  data = text.encode("utf-8")
+  if len(data) <= MAX_TEXT_BYTES:
+    return text
+  return data[0:MAX_TEXT_BYTES].decode("utf-8", errors="ignore")
+
+
+def rounds(number_of_pages, strata, rng):
+  """
+  Yields lists of page numbers, one unsampled page per stratum,
+  until every page has been yielded.
+  """
+  strata = max(1, min(strata, number_of_pages))
+
+  remaining = []
+  for s in range(strata):
+    pages = list(range(s * number_of_pages // strata, (s + 1) * number_of_pages // strata))
+    rng.shuffle(pages)
+    remaining.append(pages)
+
+  while any(len(pages) > 0 for pages in remaining):
+    yield [pages.pop() for pages in remaining if len(pages) > 0]
+
+
+def aggregate(samples):
+  """
+  Weighted means of the scores over samples, a list of (weight,
+  {score: value}), and the largest 95% confidence half-width
+  among them.
+  """
+  total = sum(weight for (weight, scores) in samples)
+  squares = sum(weight * weight for (weight, scores) in samples)
+
+  means = {}
+  halfwidth = 0.0
+
+  for name in SCORES:
+    mean = sum(weight * scores[name] for (weight, scores) in samples) / total
+    means[name] = mean
+
+    #
+    # weighted variance, over the effective sample size:
+    #
+    n = total * total / squares
+    if n > 1.0:
+      variance = sum(weight * (scores[name] - mean) ** 2 for (weight, scores) in samples) / total
+      halfwidth = max(halfwidth, Z_95 * math.sqrt(variance / (n - 1.0)))
+    else:
+      halfwidth = float("inf")
+
+  return (means, halfwidth)
+
+
+class Summary:
+
+  def __init__(self):
+    self.sentiment = None
+    self.scores = None
+    self.halfwidth = None
+    self.pages_sampled = 0
+    self.pages_total = 0
+    self.api_calls = 0
+    self.api_secs = 0.0
+    self.pages_extracted = 0
+    self.extract_secs = 0.0
+
+
+def sample_sentiment(detect, texts, settings):
+  """
+  Samples pages until the sentiment scores are tight enough or
+  the budget is spent.
+
+  Parameters
+  ----------
+  detect: function(text) => detect_sentiment's response
+  texts: the pages' text, extracted on first access (texts[i])
+  settings: Settings
+
+  Returns
+  -------
+  Summary
+  """
+  summary = Summary()
+  summary.pages_total = len(texts)
+
+  max_pages = MAX_PAGES_PER_CALL * settings.max_calls
+
+  def spent():
+    return summary.api_calls >= settings.max_calls or summary.pages_sampled >= max_pages
+
+  rng = random.Random(SAMPLE_SEED)
+  samples = []
+
+  for pages in rounds(len(texts), settings.strata, rng):
+    for i in pages:
+      if spent():
+        break
+
+      text = truncate(texts[i])
+      summary.pages_sampled += 1
+
+      if text.strip() == "":
+        continue
+
+      start = time.perf_counter()
+      response = detect(text)
+      summary.api_secs += time.perf_counter() - start
+      summary.api_calls += 1
+
+      samples.append((len(text), response['SentimentScore']))
+
+    if len(samples) > 0:
+      (summary.scores, summary.halfwidth) = aggregate(samples)
+      if summary.halfwidth <= settings.target_halfwidth:
+        break
+
+    if spent():
+      break
+
+  if len(samples) == 0:
+    raise Exception("no text to analyze for sentiment in " + str(summary.pages_sampled) + " pages")
+
+  summary.sentiment = max(SCORES, key=lambda name: summary.scores[name]).upper()
+
+  return summary
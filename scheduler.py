@@ -0,0 +1,366 @@
+#
+# Fair-share admission control for proj03_compute. Like
+# datatier.py, this file is deployed alongside the lambda
+# function.
+#
+# Without it, a user who uploads a thousand PDFs starts a
+# thousand compute invocations at once, using up RDS connections
+# and Comprehend TPS while everyone else's jobs wait behind them.
+# Instead, a job runs only if both
+#
+#   - fewer than max_running jobs are processing overall, and
+#   - its user has fewer than max_running_per_user processing,
+#
+# otherwise its status becomes 'queued' and the invocation ends.
+# Whenever a job finishes, the invocation that ran it claims the
+# next queued job and starts a new compute invocation for it.
+# Claims go round-robin across users: the next job comes from
+# the user with queued work, room under their limit, who least
+# recently had a job start.
+#
+# The per-user limit is exact: every change of a job to
+# 'processing' happens while holding a lock on its user's row,
+# and claims use SELECT ... FOR UPDATE SKIP LOCKED so concurrent
+# claimers move on to other users rather than wait. The overall
+# limit is checked without a lock, so simultaneous starts may
+# briefly exceed it.
+#
+# S3 can deliver an event more than once, and an async hand-off
+# can be retried, so each transition is a compare-and-set on the
+# job's row, and exactly one invocation wins a job: the one whose
+# UPDATE moves it out of 'uploaded' (admit), or, for a job a
+# hand-off claimed, the one that sets its claimid (take). The
+# claimid then guards the update that completes the job. Losers
+# count the job's duplicate_events and return at once.
+#
+# Hand-offs alone can strand work: a job queued while the only
+# finishing invocation was looking (it skips a user whose row is
+# locked, or doesn't yet see the uncommitted 'queued' row) waits
+# for another of its user's jobs to finish, which may never
+# happen; and an invocation that crashes or times out holds its
+# 'processing' slot forever. So proj03_claimer runs on a schedule
+# (e.g. an EventBridge rule every minute) and calls tick(), which
+# requeues jobs processing for longer than stale_secs (longer
+# than compute's timeout, so their invocation is certainly gone)
+# and then hands off queued jobs like a finishing job would.
+#
+# Settings come from the [scheduler] section of the config file
+# (0 = no limit):
+#
+#   [scheduler]
+#   max_running = 20
+#   max_running_per_user = 4
+#   stale_secs = 960
+#   compute_function = proj03_compute
+#
+
+import json
+import urllib.parse
+
+import datatier
+
+DEFAULT_MAX_RUNNING = 20
+DEFAULT_MAX_RUNNING_PER_USER = 4
+
+#
+# a finishing job frees one slot, but claim a few in case
+# earlier hand-offs failed and slots are sitting idle:
+#
+MAX_CLAIMS_PER_HAND_OFF = 4
+
+#
+# how many times to look for another user, if the one we
+# locked turns out to be at their limit after all:
+#
+MAX_CLAIM_ATTEMPTS = 3
+
+#
+# compute's timeout is at most 15 minutes, plus a margin:
+#
+DEFAULT_STALE_SECS = 960
+
+
+class Limits:
+
+  def __init__(self, max_running, max_running_per_user):
+    self.max_running = max_running
+    self.max_running_per_user = max_running_per_user
+
+
+def get_limits(configur):
+  """
+  Reads the [scheduler] section of the config file.
+  """
+  return Limits(
+    int(configur.get('scheduler', 'max_running', fallback=DEFAULT_MAX_RUNNING)),
+    int(configur.get('scheduler', 'max_running_per_user', fallback=DEFAULT_MAX_RUNNING_PER_USER)))
+
+
+def get_stale_secs(configur):
+  """
+  Reads [scheduler] stale_secs from the config file.
+  """
+  return int(configur.get('scheduler', 'stale_secs', fallback=DEFAULT_STALE_SECS))
+
+
+def prepare(dbConn):
+  """
+  Each statement must see the latest committed jobs, not the
+  snapshot from the start of the transaction, or a count taken
+  after locking a user could be stale.
+  """
+  datatier.perform_action(dbConn, "SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED;")
+
+
+def has_slot(dbConn, userid, limits):
+  """
+  True if the user, and the system as a whole, can start
+  another job.
+  """
+  sql = """
+    SELECT COUNT(*), COALESCE(SUM(userid = %s), 0)
+      FROM jobs
+     WHERE status = 'processing';
+  """
+  row = datatier.retrieve_one_row(dbConn, sql, [userid])
+
+  (running, mine) = (int(row[0]), int(row[1]))
+
+  if limits.max_running > 0 and running >= limits.max_running:
+    return False
+  if limits.max_running_per_user > 0 and mine >= limits.max_running_per_user:
+    return False
+  return True
+
+
+def admit(dbConn, jobid, userid, limits, claimid):
+  """
+  Called when a job's PDF lands in S3. Starts the job if there
+  is a free slot, as claimid, otherwise queues it.
+
+  Returns
+  -------
+  "processing" or "queued", or None if the job had already left
+  the 'uploaded' state (e.g. a repeated S3 event)
+  """
+  dbConn.commit()  # start a fresh transaction
+
+  datatier.retrieve_one_row(dbConn, "SELECT userid FROM users WHERE userid = %s FOR UPDATE;", [userid])
+
+  if has_slot(dbConn, userid, limits):
+    sql = """
+      UPDATE jobs SET status = 'processing', claimid = %s, pages_done = 0, started_at = NOW(3)
+       WHERE jobid = %s AND status = 'uploaded';
+    """
+    values = [claimid, jobid]
+    status = "processing"
+  else:
+    sql = "UPDATE jobs SET status = 'queued' WHERE jobid = %s AND status = 'uploaded';"
+    values = [jobid]
+    status = "queued"
+
+  modified = datatier.perform_action(dbConn, sql, values)  # commits, releasing the lock
+
+  return status if modified == 1 else None
+
+
+def claim_next(dbConn, limits):
+  """
+  Moves the next queued job, round-robin across users, to
+  'processing'.
+
+  Returns
+  -------
+  (jobid, datafilekey) of the claimed job, or None if nothing
+  can start
+  """
+  per_user = limits.max_running_per_user if limits.max_running_per_user > 0 else 2 ** 31 - 1
+
+  #
+  # users with queued work and room under their limit, the one
+  # whose last job started longest ago (or never) first. Users
+  # being claimed for by another invocation are locked, and
+  # skipped:
+  #
+  next_user_sql = """
+    SELECT u.userid
+      FROM users u
+     WHERE EXISTS (SELECT 1 FROM jobs q WHERE q.userid = u.userid AND q.status = 'queued')
+       AND (SELECT COUNT(*) FROM jobs r WHERE r.userid = u.userid AND r.status = 'processing') < %s
+     ORDER BY (SELECT MAX(s.started_at) FROM jobs s WHERE s.userid = u.userid), u.userid
+     LIMIT 1
+       FOR UPDATE OF u SKIP LOCKED;
+  """
+
+  next_job_sql = """
+    SELECT jobid, datafilekey
+      FROM jobs
+     WHERE userid = %s AND status = 'queued'
+     ORDER BY jobid
+     LIMIT 1
+       FOR UPDATE SKIP LOCKED;
+  """
+
+  for attempt in range(MAX_CLAIM_ATTEMPTS):
+    dbConn.commit()  # start a fresh transaction
+
+    row = datatier.retrieve_one_row(dbConn, next_user_sql, [per_user])
+    if row == ():
+      dbConn.commit()
+      return None
+
+    userid = row[0]
+
+    #
+    # we hold the user's lock now, so this count is exact:
+    #
+    if not has_slot(dbConn, userid, limits):
+      dbConn.commit()
+      if limits.max_running > 0 and not has_slot(dbConn, None, Limits(limits.max_running, 0)):
+        return None  # full overall, no point trying other users
+      continue
+
+    row = datatier.retrieve_one_row(dbConn, next_job_sql, [userid])
+    if row == ():
+      dbConn.commit()
+      continue
+
+    (jobid, datafilekey) = (row[0], row[1])
+
+    sql = """
+      UPDATE jobs SET status = 'processing', pages_done = 0, started_at = NOW(3)
+       WHERE jobid = %s;
+    """
+    datatier.perform_action(dbConn, sql, [jobid])  # commits, releasing the locks
+
+    return (jobid, datafilekey)
+
+  return None
+
+
+def take(dbConn, jobid, claimid):
+  """
+  Called by the compute invocation a hand-off started for a
+  claimed job: makes it the job's, unless another invocation
+  (a repeated delivery of the hand-off) already has.
+
+  Returns
+  -------
+  True if the job is now claimid's to process
+  """
+  sql = """
+    UPDATE jobs SET claimid = %s
+     WHERE jobid = %s AND status = 'processing' AND claimid IS NULL;
+  """
+  return datatier.perform_action(dbConn, sql, [claimid, jobid]) == 1
+
+
+def note_duplicate(dbConn, jobid):
+  """
+  Counts an event for the job that was ignored, since another
+  invocation had it (or it had finished).
+  """
+  sql = "UPDATE jobs SET duplicate_events = duplicate_events + 1 WHERE jobid = %s;"
+  datatier.perform_action(dbConn, sql, [jobid])
+
+
+def release(dbConn, jobid):
+  """
+  Puts a claimed job back in the queue, when we could not
+  start a compute invocation for it.
+  """
+  sql = """
+    UPDATE jobs SET status = 'queued', claimid = NULL, started_at = NULL
+     WHERE jobid = %s AND status = 'processing' AND claimid IS NULL;
+  """
+  datatier.perform_action(dbConn, sql, [jobid])
+
+
+def requeue_stale(dbConn, stale_secs):
+  """
+  Puts jobs that have been processing for more than stale_secs
+  back in the queue. Their invocation has died, and clearing
+  the claimid means it could not complete them anyway.
+
+  Returns
+  -------
+  the number of jobs requeued
+  """
+  sql = """
+    UPDATE jobs SET status = 'queued', claimid = NULL, pages_done = 0, started_at = NULL
+     WHERE status = 'processing' AND started_at < NOW(3) - INTERVAL %s SECOND;
+  """
+  return datatier.perform_action(dbConn, sql, [stale_secs])
+
+
+def claimed_event(bucketname, jobid, datafilekey):
+  """
+  The event for a compute invocation of a claimed job: the S3
+  event it would have had, plus the job id it was claimed as.
+  """
+  return {
+    "Records": [{
+      "eventSource": "aws:s3",
+      "eventName": "ObjectCreated:Put",
+      "s3": {
+        "bucket": {"name": bucketname},
+        "object": {"key": urllib.parse.quote_plus(datafilekey)}
+      }
+    }],
+    "claimed": jobid
+  }
+
+
+def hand_off(dbConn, limits, bucketname, function_name, lambda_client):
+  """
+  Called after a job finishes: claims queued jobs while there is
+  room, and invokes compute (asynchronously) for each.
+
+  Returns
+  -------
+  list of job ids started
+  """
+  started = []
+
+  while len(started) < MAX_CLAIMS_PER_HAND_OFF:
+    claimed = claim_next(dbConn, limits)
+    if claimed is None:
+      break
+
+    (jobid, datafilekey) = claimed
+
+    try:
+      lambda_client.invoke(FunctionName=function_name,
+                           InvocationType='Event',
+                           Payload=json.dumps(claimed_event(bucketname, jobid, datafilekey)))
+    except Exception as err:
+      print("**Could not start job", jobid, ", returning it to the queue:", str(err))
+      release(dbConn, jobid)
+      break
+
+    started.append(jobid)
+
+  return started
+
+
+def tick(dbConn, limits, stale_secs, bucketname, function_name, lambda_client):
+  """
+  The periodic claimer: requeues stale jobs, then starts queued
+  jobs while there are free slots.
+
+  Returns
+  -------
+  (number of jobs requeued, list of job ids started)
+  """
+  prepare(dbConn)
+
+  requeued = requeue_stale(dbConn, stale_secs)
+
+  started = []
+  while True:
+    batch = hand_off(dbConn, limits, bucketname, function_name, lambda_client)
+    started.extend(batch)
+    if len(batch) < MAX_CLAIMS_PER_HAND_OFF:
+      break
+
+  return (requeued, started)
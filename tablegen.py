@@ -0,0 +1,150 @@
+#
+# Generates synthetic ledgers as .csv and .xlsx files, for the
+# tabular Benford benchmarks (see benchmark.py and tabular.py).
+# Rows are written as they're generated, so files of millions
+# of rows take no more memory than small ones.
+#
+# Each row is a date, an invoice id, a vendor, an amount and a
+# quantity; the amounts and quantities follow Benford's law
+# (see pdfgen.benford_number), the rest are there to be skipped.
+#
+# Run "python tablegen.py ledger.csv 1000000" to write a million
+# row ledger; use a .xlsx name for a workbook.
+#
+
+import csv
+import random
+import sys
+import zipfile
+
+import pdfgen
+
+HEADER = ["Date", "Invoice", "Vendor", "Amount", "Quantity"]
+
+VENDORS = ["Northwind Traders", "Contoso Ltd", "Acme Corporation", "Fabrikam",
+           "Tailspin Toys", "Wide World Importers", "Adventure Works"]
+
+
+def random_rows(rng, rows):
+  """
+  Yields rows of [date, invoice, vendor, amount, quantity].
+  """
+  for i in range(rows):
+    yield ["2026-%02d-%02d" % (rng.randint(1, 12), rng.randint(1, 28)),
+           "INV-%07d" % i,
+           rng.choice(VENDORS),
+           "%.2f" % (pdfgen.benford_number(rng, 6) + rng.randrange(100) / 100.0),
+           str(pdfgen.benford_number(rng, 3))]
+
+
+def write_csv(filename, rows, rng):
+  with open(filename, "w", newline="") as outfile:
+    writer = csv.writer(outfile)
+    writer.writerow(HEADER)
+    writer.writerows(random_rows(rng, rows))
+
+
+def column_ref(index, row):
+  """
+  (0, 1) => "A1"
+  """
+  letters = ""
+  index += 1
+  while index > 0:
+    (index, r) = divmod(index - 1, 26)
+    letters = chr(ord('A') + r) + letters
+  return letters + str(row)
+
+
+CONTENT_TYPES_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>
+</Types>"""
+
+ROOT_RELS_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+WORKBOOK_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Ledger" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+WORKBOOK_RELS_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>
+</Relationships>"""
+
+
+def write_xlsx(filename, rows, rng):
+  """
+  Writes a workbook of one sheet, the way Excel does: text in
+  the shared string table (the header and vendors), numbers in
+  the cells. Dates are written as text, for simplicity.
+  """
+  strings = HEADER + VENDORS
+  index = {s: i for (i, s) in enumerate(strings)}
+
+  with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as zf:
+    zf.writestr("[Content_Types].xml", CONTENT_TYPES_XML)
+    zf.writestr("_rels/.rels", ROOT_RELS_XML)
+    zf.writestr("xl/workbook.xml", WORKBOOK_XML)
+    zf.writestr("xl/_rels/workbook.xml.rels", WORKBOOK_RELS_XML)
+
+    shared = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>',
+              '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" count="' +
+              str(len(strings)) + '" uniqueCount="' + str(len(strings)) + '">']
+    for s in strings:
+      shared.append("<si><t>" + s + "</t></si>")
+    shared.append("</sst>")
+    zf.writestr("xl/sharedStrings.xml", "".join(shared))
+
+    with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+      sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                  b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                  b'<sheetData>')
+
+      cells = ['<c r="' + column_ref(i, 1) + '" t="s"><v>' + str(index[h]) + '</v></c>'
+               for (i, h) in enumerate(HEADER)]
+      sheet.write(('<row r="1">' + "".join(cells) + '</row>').encode())
+
+      for (n, row) in enumerate(random_rows(rng, rows)):
+        r = n + 2
+        (date, invoice, vendor, amount, quantity) = row
+        sheet.write(('<row r="' + str(r) + '">'
+                     '<c r="A' + str(r) + '" t="inlineStr"><is><t>' + date + '</t></is></c>'
+                     '<c r="B' + str(r) + '" t="inlineStr"><is><t>' + invoice + '</t></is></c>'
+                     '<c r="C' + str(r) + '" t="s"><v>' + str(index[vendor]) + '</v></c>'
+                     '<c r="D' + str(r) + '"><v>' + amount + '</v></c>'
+                     '<c r="E' + str(r) + '"><v>' + quantity + '</v></c>'
+                     '</row>').encode())
+
+      sheet.write(b'</sheetData></worksheet>')
+
+
+def write_table(filename, rows, seed=0):
+  """
+  Writes a random ledger of the given number of rows, as CSV or
+  XLSX depending on filename's extension.
+  """
+  rng = random.Random(seed)
+  if filename.endswith(".xlsx"):
+    write_xlsx(filename, rows, rng)
+  else:
+    write_csv(filename, rows, rng)
+
+
+if __name__ == "__main__":
+  if len(sys.argv) < 3:
+    print("usage: python tablegen.py out.csv|out.xlsx rows [seed]")
+    sys.exit(1)
+
+  seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+  write_table(sys.argv[1], int(sys.argv[2]), seed)
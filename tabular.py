@@ -0,0 +1,390 @@
+#
+# Benford analysis of tabular inputs (.csv and .xlsx) for
+# proj03_compute, without printing them to PDF first. Like
+# datatier.py, this file is deployed alongside the lambda
+# functions that need it.
+#
+# Rows are streamed, one at a time, so memory doesn't grow with
+# the file: CSV through the csv module, and XLSX by parsing the
+# first worksheet's XML incrementally out of the zip with expat,
+# a chunk at a time. The first row is the header.
+#
+# Each cell that looks like a number -- 1234, -1,234.50,
+# (1,234), $12.5, 3.2E-4, 45% -- has its first significant digit
+# tallied under its column. Unless the job names its columns,
+# the numeric columns are picked after the fact: those where at
+# least NUMERIC_FRACTION of the non-empty cells were numbers
+# (dates, ids with letters and text columns drop out). The
+# overall tally is the sum of the picked columns.
+#
+# NOTE: the S3 trigger for proj03_compute must fire for .csv and
+# .xlsx keys, as well as .pdf, and the API Gateway must list
+# text/csv and the XLSX content type as binary media types.
+#
+# NOTE: in XLSX, text cells are stored in a shared string table
+# that can be as large as the sheet; we only look up the
+# header's, so numbers stored as text count as text in XLSX.
+#
+
+import csv
+import re
+import xml.parsers.expat
+import zipfile
+
+from xml.etree.ElementTree import iterparse
+
+CONTENT_TYPES = {
+  ".csv": "text/csv",
+  ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+EXTENSIONS = list(CONTENT_TYPES.keys())
+
+#
+# a column is numeric if at least this fraction of its non-empty
+# cells are numbers:
+#
+NUMERIC_FRACTION = 0.9
+
+#
+# sign, currency, digits with optional thousands separators and
+# decimals, exponent, closing parenthesis or percent. Group 1 is
+# the digits, whose first non-zero is the one we count:
+#
+NUMBER = re.compile(r"\s*[-+(]?\s*[$€£]?\s*([0-9][0-9,]*\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?\s*\)?\s*%?\s*$")
+
+#
+# stands in for an XLSX text cell we didn't look up; never
+# matches NUMBER:
+#
+TEXT = "\x00"
+
+#
+# bytes of worksheet XML parsed at a time:
+#
+XLSX_CHUNK_BYTES = 64 * 1024
+
+SPREADSHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+RELATIONSHIP_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+
+class ColumnTally:
+
+  def __init__(self, name):
+    self.name = name
+    self.digits = {'1': 0, '2': 0, '3': 0, '4': 0, '5': 0, '6': 0, '7': 0, '8': 0, '9': 0}
+    self.zeros = 0
+    self.text = 0
+
+  def numbers(self):
+    return sum(self.digits.values()) + self.zeros
+
+  def is_numeric(self):
+    numbers = self.numbers()
+    return numbers > 0 and numbers >= NUMERIC_FRACTION * (numbers + self.text)
+
+
+class Table:
+  """
+  The result of tallying a file: how many rows (not counting the
+  header), every column's tally, and the columns analyzed.
+  """
+
+  def __init__(self, rows, tallies, picked):
+    self.rows = rows
+    self.tallies = tallies
+    self.picked = picked
+
+  def overall(self):
+    digits = {'1': 0, '2': 0, '3': 0, '4': 0, '5': 0, '6': 0, '7': 0, '8': 0, '9': 0}
+    for tally in self.picked:
+      for d in digits:
+        digits[d] += tally.digits[d]
+    return digits
+
+
+############################################################
+#
+# reading rows
+#
+def iter_csv(filename):
+  """
+  Yields the rows of a CSV file as lists of strings.
+  """
+  with open(filename, "r", encoding="utf-8-sig", errors="replace", newline="") as infile:
+    for row in csv.reader(infile):
+      yield row
+
+
+def column_index(ref):
+  """
+  "C12" => 2
+  """
+  index = 0
+  for ch in ref:
+    if not ch.isalpha():
+      break
+    index = index * 26 + (ord(ch.upper()) - ord('A') + 1)
+  return index - 1
+
+
+def first_sheet(zf):
+  """
+  The zip member holding the workbook's first worksheet.
+  """
+  try:
+    with zf.open("xl/workbook.xml") as infile:
+      for (event, elem) in iterparse(infile):
+        if elem.tag == SPREADSHEET_NS + "sheet":
+          rid = elem.get(RELATIONSHIP_NS + "id")
+          break
+      else:
+        rid = None
+
+    with zf.open("xl/_rels/workbook.xml.rels") as infile:
+      for (event, elem) in iterparse(infile):
+        if elem.get("Id") == rid:
+          target = elem.get("Target")
+          return target.lstrip("/") if target.startswith("/") else "xl/" + target
+  except KeyError:
+    pass
+
+  return "xl/worksheets/sheet1.xml"
+
+
+def shared_strings(zf, wanted):
+  """
+  {index: text} for the shared strings whose indices are in
+  wanted, reading the table one entry at a time.
+  """
+  found = {}
+  if len(wanted) == 0:
+    return found
+
+  try:
+    infile = zf.open("xl/sharedStrings.xml")
+  except KeyError:
+    return found
+
+  with infile:
+    index = 0
+    for (event, elem) in iterparse(infile):
+      if elem.tag == SPREADSHEET_NS + "si":
+        if index in wanted:
+          found[index] = "".join(t.text or "" for t in elem.iter(SPREADSHEET_NS + "t"))
+          if len(found) == len(wanted):
+            break
+        index += 1
+        elem.clear()
+
+  return found
+
+
+def iter_xlsx(filename):
+  """
+  Yields the rows of the first worksheet of an XLSX file as
+  lists of strings (None for an empty cell, TEXT for text cells
+  after the header).
+
+  The sheet is read in chunks through expat, which calls us per
+  element without building a tree; rows completed by a chunk are
+  yielded before the next is read.
+  """
+  ns = SPREADSHEET_NS[1:-1] + " "
+  (c_tag, v_tag, t_tag, row_tag) = (ns + "c", ns + "v", ns + "t", ns + "row")
+
+  rows = []
+  columns = {}  # "AB" => 27
+  state = {"row": None, "kind": None, "ref": None, "text": None}
+  header_done = [False]
+
+  def start(name, attrs):
+    if name == c_tag:
+      state["kind"] = attrs.get("t")
+      state["ref"] = attrs.get("r")
+      state["text"] = None
+    elif name == v_tag or name == t_tag:
+      state["text"] = []
+    elif name == row_tag:
+      state["row"] = []
+
+  def chars(data):
+    text = state["text"]
+    if text is not None:
+      text.append(data)
+
+  def end(name):
+    if name == c_tag:
+      row = state["row"]
+
+      ref = state["ref"]
+      if ref is not None:
+        letters = ref.rstrip("0123456789")
+        index = columns.get(letters)
+        if index is None:
+          index = columns[letters] = column_index(letters)
+        while len(row) < index:
+          row.append(None)
+
+      kind = state["kind"]
+      text = state["text"]
+      if kind == "s":
+        #
+        # the shared string's index, looked up for the header:
+        #
+        if header_done[0] or len(rows) > 0:
+          row.append(TEXT)
+        else:
+          row.append(("s", int("".join(text))))
+      elif kind == "b" or kind == "e":
+        row.append(TEXT)
+      else:
+        row.append("".join(text) if text is not None else None)
+
+      state["text"] = None
+
+    elif name == row_tag:
+      rows.append(state["row"])
+
+  parser = xml.parsers.expat.ParserCreate(namespace_separator=" ")
+  parser.buffer_text = True
+  parser.StartElementHandler = start
+  parser.CharacterDataHandler = chars
+  parser.EndElementHandler = end
+
+  with zipfile.ZipFile(filename) as zf:
+    sheet = first_sheet(zf)
+
+    with zf.open(sheet) as infile:
+      while True:
+        data = infile.read(XLSX_CHUNK_BYTES)
+        parser.Parse(data, len(data) == 0)
+
+        for row in rows:
+          if not header_done[0]:
+            header_done[0] = True
+            wanted = set(cell[1] for cell in row if isinstance(cell, tuple))
+            found = shared_strings(zf, wanted)
+            row = [found.get(cell[1], "") if isinstance(cell, tuple) else cell for cell in row]
+          yield row
+
+        rows.clear()
+
+        if len(data) == 0:
+          break
+
+
+def iter_rows(filename, extension):
+  if extension == ".csv":
+    return iter_csv(filename)
+  if extension == ".xlsx":
+    return iter_xlsx(filename)
+  raise Exception("expecting a .csv or .xlsx file, not '" + extension + "'")
+
+
+############################################################
+#
+# tallying
+#
+def tally_rows(rows, columns=None):
+  """
+  Tallies the first significant digit of every numeric cell, per
+  column, over rows (an iterator, the first row the header).
+
+  Parameters
+  ----------
+  rows: iterator of lists of cell strings
+  columns: names of the columns to analyze, or None for every
+    numeric column
+
+  Returns
+  -------
+  Table
+  """
+  header = next(rows, None)
+  if header is None:
+    raise Exception("file is empty")
+
+  tallies = []
+  for (i, name) in enumerate(header):
+    name = (name or "").strip() if name != TEXT else ""
+    tallies.append(ColumnTally(name if name != "" else "column " + str(i + 1)))
+
+  indices = None
+  if columns is not None and len(columns) > 0:
+    names = [tally.name for tally in tallies]
+    indices = []
+    for name in columns:
+      if name not in names:
+        raise Exception("no column named '" + name + "', columns are: " + ", ".join(names))
+      indices.append(names.index(name))
+
+  match = NUMBER.match
+  count = 0
+
+  for row in rows:
+    count += 1
+
+    while len(tallies) < len(row):
+      tallies.append(ColumnTally("column " + str(len(tallies) + 1)))
+
+    for i in (indices if indices is not None else range(len(row))):
+      if i >= len(row):
+        continue
+
+      cell = row[i]
+      if cell is None or cell == "":
+        continue
+
+      m = match(cell)
+      if m is None:
+        tallies[i].text += 1
+        continue
+
+      #
+      # the first non-zero digit, skipping leading zeros and
+      # separators (0.0042 => 4):
+      #
+      d = m.group(1).lstrip("0.,")[0:1]
+      if d == "":
+        tallies[i].zeros += 1
+      else:
+        tallies[i].digits[d] += 1
+
+  if indices is not None:
+    picked = [tallies[i] for i in indices]
+  else:
+    picked = [tally for tally in tallies if tally.is_numeric()]
+
+  return Table(count, tallies, picked)
+
+
+def tally_file(filename, extension, columns=None):
+  return tally_rows(iter_rows(filename, extension), columns)
+
+
+def results_section(table):
+  """
+  The Benford section of the results document: the overall
+  tally, in the same form as for a PDF, then each column's.
+  """
+  lines = []
+  lines.append(str(table.rows) + " rows\n")
+  lines.append("0 0\n")
+
+  overall = table.overall()
+  for d in overall.keys():
+    lines.append(str(d) + " " + str(overall[d]) + "\n")
+
+  for tally in table.picked:
+    lines.append("**Column: " + tally.name + "**\n")
+    lines.append(str(tally.numbers()) + " values\n")
+    lines.append("0 0\n")
+    for d in tally.digits.keys():
+      lines.append(str(d) + " " + str(tally.digits[d]) + "\n")
+
+  skipped = [tally.name for tally in table.tallies if tally not in table.picked]
+  if len(skipped) > 0:
+    lines.append("Columns not analyzed: " + ", ".join(skipped) + "\n")
+
+  return "".join(lines)
@@ -0,0 +1,171 @@
+#
+# Full-text search over the page text of jobs' PDFs. Like
+# datatier.py, this file is deployed alongside the lambda
+# functions that need it.
+#
+# proj03_compute keeps each page's text, as it extracts it, in
+# the page_texts table, whose FULLTEXT index answers /search
+# (proj03_search). Pages are inserted in bulk, many per INSERT,
+# so indexing costs a round trip per batch rather than per page.
+# Locally, the emulator's page_texts is an SQLite FTS5 table and
+# the same queries are translated (see emulator.py).
+#
+# The text of a job that asked for PII analysis is never kept:
+# the PDF is known to hold personal data, and like the entities
+# table (see entitystore.py) page_texts must not store it.
+# /search only ever returns the caller's own jobs.
+#
+# Settings come from the [search] section of the config file:
+#
+#   [search]
+#   index_text = true
+#
+# NOTE: InnoDB FULLTEXT ignores words shorter than
+# innodb_ft_min_token_size (3) and its stopwords, so neither
+# matches nor ranks on them.
+#
+
+import re
+import time
+
+import datatier
+
+#
+# pages per multi-row INSERT, and most characters of text in
+# one, to stay well under max_allowed_packet:
+#
+PAGES_PER_INSERT = 100
+MAX_INSERT_CHARS = 4 * 1024 * 1024
+
+#
+# most words of a query that count, and the characters of text
+# each side of the first match in a snippet:
+#
+MAX_TERMS = 10
+SNIPPET_CHARS = 80
+
+WORD = re.compile(r"\w+")
+
+
+def get_index_text(configur):
+  """
+  Reads [search] index_text from the config file.
+  """
+  return configur.getboolean('search', 'index_text', fallback=True)
+
+
+def should_index(configur, names):
+  """
+  True if a job with these analyses should have its text kept:
+  indexing is on, and the job is not a pii job.
+  """
+  return get_index_text(configur) and "pii" not in names
+
+
+class Indexer:
+  """
+  Collects a job's pages as they're extracted, and inserts them
+  into page_texts a batch at a time.
+  """
+
+  def __init__(self, dbConn, jobid, userid, enabled=True):
+    self.dbConn = dbConn
+    self.jobid = jobid
+    self.userid = userid
+    self.enabled = enabled
+    self.batch = []
+    self.batch_chars = 0
+    self.indexed = set()
+    self.pages = 0
+    self.chars = 0
+    self.inserts = 0
+    self.secs = 0.0
+
+  def clear(self):
+    """
+    Deletes what the job indexed before, e.g. in an invocation
+    that was retried.
+    """
+    if not self.enabled:
+      return
+
+    sql = "DELETE FROM page_texts WHERE jobid = %s;"
+    datatier.perform_action(self.dbConn, sql, [self.jobid])
+
+  def add(self, page, text):
+    """
+    Adds the page's text (page is 0-based), inserting the batch
+    once it's full. Pages without text, or already added, are
+    skipped.
+    """
+    if not self.enabled or page in self.indexed or text.strip() == "":
+      return
+
+    self.indexed.add(page)
+    self.batch.append([self.jobid, self.userid, page + 1, text])
+    self.batch_chars += len(text)
+
+    if len(self.batch) >= PAGES_PER_INSERT or self.batch_chars >= MAX_INSERT_CHARS:
+      self.flush()
+
+  def flush(self):
+    """
+    Inserts the pages added since the last flush.
+    """
+    if len(self.batch) == 0:
+      return
+
+    start = time.perf_counter()
+
+    values = []
+    for row in self.batch:
+      values.extend(row)
+
+    sql = """
+      INSERT INTO page_texts(jobid, userid, page, text)
+             VALUES """ + ", ".join(["(%s, %s, %s, %s)"] * len(self.batch)) + ";"
+    datatier.perform_action(self.dbConn, sql, values)
+
+    self.secs += time.perf_counter() - start
+    self.pages += len(self.batch)
+    self.chars += self.batch_chars
+    self.inserts += 1
+
+    self.batch = []
+    self.batch_chars = 0
+
+
+def terms(query):
+  """
+  "ACME Corp." => ["acme", "corp"]
+  """
+  return [word.casefold() for word in WORD.findall(query)][0:MAX_TERMS]
+
+
+def snippet(text, words):
+  """
+  The text around the first of words found in text, with each
+  of words in it marked [like this].
+  """
+  text = " ".join(text.split())
+
+  if len(words) == 0:
+    return text[0:2 * SNIPPET_CHARS]
+
+  pattern = re.compile(r"\b(" + "|".join(re.escape(word) for word in words) + r")\b", re.IGNORECASE)
+
+  m = pattern.search(text)
+  if m is None:
+    return text[0:2 * SNIPPET_CHARS]
+
+  start = max(0, m.start() - SNIPPET_CHARS)
+  end = min(len(text), m.end() + SNIPPET_CHARS)
+
+  excerpt = pattern.sub(r"[\1]", text[start:end])
+
+  if start > 0:
+    excerpt = "..." + excerpt
+  if end < len(text):
+    excerpt = excerpt + "..."
+
+  return excerpt
@@ -0,0 +1,316 @@
+#
+# Shared helpers for moving PDF and results bytes between the
+# client (main.py) and the lambda functions. Like datatier.py,
+# this file is deployed alongside each lambda function.
+#
+# Two wire formats are supported:
+#
+#   json:   {"filename": ..., "data": <base64 string>} -- the
+#           original format, kept as a fallback
+#   binary: raw bytes (application/pdf, text/plain), optionally
+#           compressed with gzip or zstd and labelled with a
+#           Content-Encoding header
+#
+# NOTE: the binary format requires the API Gateway to list
+# application/pdf, text/plain, application/gzip and
+# application/zstd as binary media types, so that bodies reach
+# the lambda function with isBase64Encoded set to true.
+#
+# Run "python transport.py somefile.pdf" to compare bytes on
+# the wire and encode/decode time for each format.
+#
+
+import base64
+import gzip
+import io
+import json
+import sys
+import time
+import zlib
+
+try:
+  import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+  zstandard = None
+
+
+#
+# most bytes a compressed body may expand to: a few KB of gzip
+# can otherwise inflate to gigabytes and exhaust the function's
+# memory. Output is produced (and checked) a chunk at a time:
+#
+MAX_DECOMPRESSED_BYTES = 64 * 1024 * 1024
+DECOMPRESS_CHUNK_BYTES = 1024 * 1024
+
+
+############################################################
+#
+# encodings
+#
+def available_encodings():
+  """
+  Returns the content encodings this process can produce
+  and consume, in order of preference.
+  """
+  encodings = []
+  if zstandard is not None:
+    encodings.append("zstd")
+  encodings.append("gzip")
+  encodings.append("identity")
+  return encodings
+
+
+def accept_encoding_header():
+  """
+  Returns a value for the Accept-Encoding request header
+  listing only the encodings we are able to decode.
+  """
+  return ", ".join(e for e in available_encodings() if e != "identity")
+
+
+def compress(data, encoding):
+  """
+  Compresses raw bytes with the given content encoding
+  (identity, gzip or zstd) and returns the encoded bytes.
+  """
+  if encoding is None or encoding == "" or encoding == "identity":
+    return data
+  if encoding == "gzip":
+    # level 6 is the usual speed/size sweet spot:
+    return gzip.compress(data, compresslevel=6, mtime=0)
+  if encoding == "zstd":
+    if zstandard is None:
+      raise Exception("zstd encoding requested but zstandard is not installed")
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+  raise Exception("unsupported content encoding '" + encoding + "'")
+
+
+def decompress(data, encoding, max_bytes=MAX_DECOMPRESSED_BYTES):
+  """
+  Reverses compress(): decodes bytes received with the given
+  content encoding and returns the raw bytes. Raises an
+  exception if they would be more than max_bytes.
+  """
+  if encoding is None or encoding == "" or encoding == "identity":
+    return data
+
+  chunks = []
+  total = 0
+
+  def add(chunk):
+    nonlocal total
+    total += len(chunk)
+    if total > max_bytes:
+      raise Exception("body exceeds " + str(max_bytes) + " bytes when decompressed")
+    chunks.append(chunk)
+
+  if encoding == "gzip":
+    #
+    # member by member (gzip.decompress accepts several), each
+    # a chunk of output at a time:
+    #
+    while len(data) > 0:
+      decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+      while len(data) > 0:
+        add(decompressor.decompress(data, DECOMPRESS_CHUNK_BYTES))
+        data = decompressor.unconsumed_tail
+      while not decompressor.eof:
+        chunk = decompressor.decompress(b"", DECOMPRESS_CHUNK_BYTES)
+        if len(chunk) == 0:
+          raise Exception("gzip body is truncated")
+        add(chunk)
+      data = decompressor.unused_data
+    return b"".join(chunks)
+
+  if encoding == "zstd":
+    if zstandard is None:
+      raise Exception("zstd encoding received but zstandard is not installed")
+    # the frame may not record its content size, so stream it:
+    reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+    while True:
+      chunk = reader.read(DECOMPRESS_CHUNK_BYTES)
+      if len(chunk) == 0:
+        break
+      add(chunk)
+    return b"".join(chunks)
+
+  raise Exception("unsupported content encoding '" + encoding + "'")
+
+
+def choose_encoding(accept_encoding):
+  """
+  Picks the best encoding we support from an Accept-Encoding
+  header value, honoring q-values. Returns "identity" if the
+  header is missing or nothing acceptable is supported.
+  """
+  if accept_encoding is None or accept_encoding.strip() == "":
+    return "identity"
+
+  weights = {}
+  for part in accept_encoding.split(","):
+    fields = part.strip().split(";")
+    name = fields[0].strip().lower()
+    q = 1.0
+    for param in fields[1:]:
+      param = param.strip()
+      if param.startswith("q="):
+        try:
+          q = float(param[2:])
+        except ValueError:
+          q = 0.0
+    if name != "":
+      weights[name] = q
+
+  best = "identity"
+  best_q = 0.0
+  for encoding in available_encodings():
+    q = weights.get(encoding, weights.get("*", 0.0))
+    if q > best_q:
+      best = encoding
+      best_q = q
+
+  return best
+
+
+############################################################
+#
+# event helpers (lambda side)
+#
+def get_header(event, name):
+  """
+  Returns the value of an HTTP header from an API Gateway
+  event, ignoring case, or None if the header is not present.
+  """
+  headers = event.get("headers") or {}
+  name = name.lower()
+  for key in headers:
+    if key.lower() == name:
+      return headers[key]
+  return None
+
+
+def get_query_param(event, name, default=None):
+  """
+  Returns a query string parameter from an API Gateway event,
+  or the default if not present.
+  """
+  params = event.get("queryStringParameters") or {}
+  return params.get(name, default)
+
+
+def get_body_bytes(event):
+  """
+  Returns the raw bytes of the request body of an API Gateway
+  event, undoing the gateway's base64 wrapping of binary bodies
+  and any Content-Encoding applied by the client.
+  """
+  body = event.get("body")
+  if body is None:
+    raise Exception("event has no body")
+
+  if event.get("isBase64Encoded", False):
+    data = base64.b64decode(body)
+  elif isinstance(body, bytes):
+    data = body
+  else:
+    data = body.encode("latin-1")
+
+  return decompress(data, get_header(event, "Content-Encoding"))
+
+
+def wants_binary(event):
+  """
+  True if the client asked for raw results rather than the
+  base64-in-JSON fallback.
+  """
+  accept = get_header(event, "Accept")
+  if accept is None:
+    return False
+  accept = accept.lower()
+  return "text/plain" in accept or "application/octet-stream" in accept
+
+
+def binary_response(data, event, content_type="text/plain; charset=utf-8", extra_headers=None):
+  """
+  Builds an API Gateway response carrying raw bytes, compressed
+  according to the request's Accept-Encoding header.
+  """
+  encoding = choose_encoding(get_header(event, "Accept-Encoding"))
+  body = compress(data, encoding)
+
+  headers = {"Content-Type": content_type}
+  if extra_headers is not None:
+    headers.update(extra_headers)
+  if encoding != "identity":
+    headers["Content-Encoding"] = encoding
+
+  return {
+    'statusCode': 200,
+    'headers': headers,
+    'body': base64.b64encode(body).decode(),
+    'isBase64Encoded': True
+  }
+
+
+############################################################
+#
+# measurement
+#
+def measure(data, filename="data.pdf"):
+  """
+  Encodes and decodes the given bytes in every supported wire
+  format, returning a list of (format, wire bytes, encode
+  seconds, decode seconds) tuples.
+  """
+  results = []
+
+  start = time.perf_counter()
+  packet = json.dumps({"filename": filename, "data": base64.b64encode(data).decode()}).encode()
+  encode_secs = time.perf_counter() - start
+
+  start = time.perf_counter()
+  body = json.loads(packet)
+  base64.b64decode(body["data"].encode())
+  decode_secs = time.perf_counter() - start
+
+  results.append(("json+base64", len(packet), encode_secs, decode_secs))
+
+  for encoding in available_encodings():
+    start = time.perf_counter()
+    packet = compress(data, encoding)
+    encode_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decompress(packet, encoding)
+    decode_secs = time.perf_counter() - start
+
+    results.append(("binary+" + encoding, len(packet), encode_secs, decode_secs))
+
+  return results
+
+
+def print_measurements(results, raw_size):
+  """
+  Prints the output of measure() as a small table.
+  """
+  print("raw size:", raw_size, "bytes")
+  print("%-16s %12s %8s %12s %12s" % ("format", "wire bytes", "ratio", "encode ms", "decode ms"))
+  for (name, size, enc, dec) in results:
+    ratio = size / raw_size if raw_size > 0 else 0.0
+    print("%-16s %12d %8.3f %12.3f %12.3f" % (name, size, ratio, enc * 1000.0, dec * 1000.0))
+
+
+if __name__ == "__main__":
+  if len(sys.argv) < 2:
+    print("usage: python transport.py file [file ...]")
+    sys.exit(1)
+
+  for filename in sys.argv[1:]:
+    infile = open(filename, "rb")
+    data = infile.read()
+    infile.close()
+
+    print("**", filename, "**")
+    print_measurements(measure(data, filename), len(data))
+    print()